@@ -0,0 +1,171 @@
+"""
+bench_adjudication.py
+
+Benchmark of the resign and draw adjudication of duel.py on long
+synthetic score streams. The incremental counters of duel.Adjudicator are
+compared with the previous adjudication that scans the score history
+after every move, the decisions must be the same at every move.
+
+Usage:
+  python bench_adjudication.py --plies 2000 --games 20
+"""
+
+
+import argparse
+import logging
+import random
+import time
+
+import duel
+
+
+def adjudicate_win_scan(score_history, resign_option, side):
+    """
+    The previous resign adjudication, it scans the score history.
+    """
+    ret, gres, e1score = False, '*', 0.0
+
+    if len(score_history) >= 40:
+        fcp_score = score_history[0::2]
+        scp_score = score_history[1::2]
+
+        fwin_cnt, swin_cnt = 0, 0
+        movecount = resign_option['movecount'] * 2
+        score = resign_option['score']
+
+        for i, (fs, ss) in enumerate(zip(reversed(fcp_score),
+                                         reversed(scp_score))):
+            if i >= movecount:
+                break
+            if i <= movecount and fs >= score and ss <= -score:
+                fwin_cnt += 1
+            elif i <= movecount and fs <= -score and ss >= score:
+                swin_cnt += 1
+
+        if fwin_cnt >= movecount:
+            gres = '1-0' if side else '0-1'
+            e1score = 1.0
+            ret = True
+        if swin_cnt >= movecount:
+            gres = '1-0' if side else '0-1'
+            e1score = 0
+            ret = True
+
+    return ret, gres, e1score
+
+
+def adjudicate_draw_scan(score_history, draw_option):
+    """
+    The previous draw adjudication, it scans the score history.
+    """
+    ret, gres, e1score = False, '*', 0.0
+
+    if len(score_history) >= draw_option['movenumber'] * 2:
+        fcp_score = score_history[0::2]
+        scp_score = score_history[1::2]
+
+        draw_cnt = 0
+        movecount = draw_option['movecount'] * 2
+        score = draw_option['score']
+
+        for i, (fs, ss) in enumerate(zip(reversed(fcp_score),
+                                         reversed(scp_score))):
+            if i >= movecount:
+                break
+            if (i <= movecount and abs(fs) <= score
+                    and abs(ss) <= score):
+                draw_cnt += 1
+
+        if draw_cnt >= movecount:
+            gres = '1/2-1/2'
+            e1score = 0.5
+            ret = True
+
+    return ret, gres, e1score
+
+
+def score_stream(plies, rng):
+    """
+    Return the scores of a long game: a random walk with drawish phases
+    near 0 and winning phases, the sign alternates between the engines
+    most of the time like real engine scores.
+    """
+    scores, score = [], 0
+    for ply in range(plies):
+        r = rng.random()
+        if r < 0.01:
+            score = 0
+        elif r < 0.02:
+            score = rng.choice([-1, 1]) * rng.randint(300, 1000)
+        else:
+            score += rng.randint(-8, 8)
+        noise = rng.randint(-3, 3)
+        scores.append(score + noise if ply % 2 == 0 else -score + noise)
+    return scores
+
+
+def run_scan(scores, resign_option, draw_option):
+    decisions, history = [], []
+    for ply, score in enumerate(scores):
+        history.append(score)
+        decisions.append((adjudicate_win_scan(history, resign_option, ply % 2),
+                          adjudicate_draw_scan(history, draw_option)))
+    return decisions
+
+
+def run_incremental(scores, resign_option, draw_option):
+    decisions = []
+    adjudicator = duel.Adjudicator(resign_option, draw_option)
+    for ply, score in enumerate(scores):
+        adjudicator.add(score)
+        decisions.append((adjudicator.adjudicate_win(ply % 2),
+                          adjudicator.adjudicate_draw()))
+    return decisions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--plies', required=False, type=int, default=2000,
+                        help='number of moves of every game, default=2000')
+    parser.add_argument('--games', required=False, type=int, default=20,
+                        help='number of games, default=20')
+    parser.add_argument('--seed', required=False, type=int, default=1,
+                        help='random seed of the score streams, default=1')
+
+    args = parser.parse_args()
+
+    # The adjudication logs every move in duel.py.
+    logging.disable(logging.INFO)
+
+    rng = random.Random(args.seed)
+    options = [({'movecount': 4, 'score': 400}, {'movenumber': 40, 'movecount': 4, 'score': 5}),
+               ({'movecount': 3, 'score': 300}, {'movenumber': 34, 'movecount': 8, 'score': 20}),
+               ({'movecount': 1, 'score': 0}, {'movenumber': 0, 'movecount': 0, 'score': 0})]
+
+    scan_time, incremental_time, decisions = 0.0, 0.0, 0
+    for game in range(args.games):
+        scores = score_stream(args.plies, rng)
+        resign_option, draw_option = options[game % len(options)]
+
+        t1 = time.perf_counter()
+        expected = run_scan(scores, resign_option, draw_option)
+        t2 = time.perf_counter()
+        actual = run_incremental(scores, resign_option, draw_option)
+        t3 = time.perf_counter()
+
+        scan_time += t2 - t1
+        incremental_time += t3 - t2
+        decisions += len(expected)
+
+        for ply, (e, a) in enumerate(zip(expected, actual)):
+            if e != a:
+                raise AssertionError(f'game {game + 1} ply {ply}: scan {e}, incremental {a}')
+
+    print(f'games: {args.games}, plies per game: {args.plies}, decisions: {decisions}, all equal')
+    print(f'scan       : {scan_time:0.3f}s, {1e6 * scan_time / decisions:0.2f}us per move')
+    print(f'incremental: {incremental_time:0.3f}s, {1e6 * incremental_time / decisions:0.2f}us per move')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+bench_harness.py
+
+Benchmark of the games per second and of the overhead per move of
+duel.py at increasing concurrency, with mock_engine.py as engines so that
+it runs on any machine. A match is played at every concurrency and the
+overhead is read from the latency line of duel.py, the time of a move
+less the search time reported by the engine.
+
+Usage:
+  python bench_harness.py --concurrency 1,2,4,8 --rounds 40 --think-ms 5
+"""
+
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+DIR = Path(__file__).resolve().parent
+
+
+def run_match(concurrency, args):
+    """
+    Play a match of duel.py, return the games, the seconds and the
+    latency line of the match.
+    """
+    engine = (DIR / 'mock_engine.py').as_posix()
+    command = [sys.executable, (DIR / 'duel.py').as_posix(),
+               '-rounds', str(args.rounds), '-repeat', '2', '-concurrency', str(concurrency),
+               '-jsonl', '-engine', f'cmd={engine}', 'name=test', f'proto={args.proto}',
+               '-engine', f'cmd={engine}', 'name=base', f'proto={args.proto}',
+               '-each', f'tc={args.tc}'] + args.duel_options.split()
+    env = {**os.environ, 'MOCK_ENGINE_OPTIONS': f'ThinkMs={args.think_ms} InfoLines={args.info_lines} '
+                                                f'StartupMs={args.startup_ms}'}
+
+    t = time.perf_counter()
+    output = subprocess.run(command, env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+    seconds = time.perf_counter() - t
+
+    games, latency = 0, None
+    for line in output.splitlines():
+        if not line.startswith('{'):
+            continue
+        res = json.loads(line)
+        if res['type'] == 'score':
+            games = res['games']
+        elif res['type'] == 'latency':
+            latency = res
+    return games, seconds, latency
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--concurrency', required=False, default='1,2,4',
+                        help='concurrency of every match, default=1,2,4')
+    parser.add_argument('--rounds', required=False, type=int, default=20,
+                        help='games of every match, default=20')
+    parser.add_argument('--think-ms', required=False, type=int, default=5,
+                        help='search time per move of the engines in ms, default=5')
+    parser.add_argument('--info-lines', required=False, type=int, default=1,
+                        help='search info lines per move of the engines, default=1')
+    parser.add_argument('--startup-ms', required=False, type=int, default=0,
+                        help='start time of the engines in ms, default=0')
+    parser.add_argument('--proto', required=False, choices=['uci', 'xboard'], default='uci',
+                        help='protocol of the engines, default=uci')
+    parser.add_argument('--tc', required=False, default='0/10+0.1',
+                        help='time control of the games, default=0/10+0.1')
+    parser.add_argument('--duel-options', required=False, default='',
+                        help='other options of duel.py, example: "-openings file=a.epd"')
+
+    args = parser.parse_args()
+
+    print(f'{"concurrency":>11s} {"games":>6s} {"seconds":>8s} {"games/s":>8s} '
+          f'{"moves":>7s} {"ovh p50":>8s} {"ovh p90":>8s} {"ovh p99":>8s} {"harness p50":>11s}')
+    for concurrency in [int(c) for c in args.concurrency.split(',')]:
+        games, seconds, latency = run_match(concurrency, args)
+        overhead = latency['engines']['test']['overhead'] if latency else {}
+        harness = latency['engines']['test'].get('harness', {}) if latency else {}
+        print(f'{concurrency:11d} {games:6d} {seconds:8.2f} {games / seconds:8.2f} '
+              f'{overhead.get("moves", 0):7d} {overhead.get("p50", 0):8.2f} {overhead.get("p90", 0):8.2f} '
+              f'{overhead.get("p99", 0):8.2f} {harness.get("p50", 0):11.2f}')
+
+    print('\novh: time of a move less the search time of the engine in ms, of the test engine')
+    print('harness: time of duel.py between a move and the next go in ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""
+calibration.py
+
+Speed of a machine relative to a reference speed, to scale the time
+control of the games so that slow and fast machines, or a machine under a
+varying load, play games of the same strength.
+
+The speed is the nodes per second of a fixed-node search of the base
+engine from the start position, or of a perft of chessboard.py with
+benchmark: cpu. The reference speed is set in the calibration section of
+the setting file, or is the speed of the optimizer machine at startup,
+with the cpu benchmark if the engine one fails there. The workers use the
+benchmark of the reference, a speed is never compared with a reference
+of the other benchmark:
+
+calibration:
+  benchmark: engine  # engine or cpu
+  nodes: 1000000  # nodes of the engine search
+  reference_speed: 1500000  # nodes per second, default: the optimizer machine
+  interval: 600  # seconds between two measures
+
+The time control of a machine is multiplied by reference / speed, a
+machine at half the reference speed plays tc=0/5+0.05 as tc=0/10+0.1.
+"""
+
+
+import logging
+import shlex
+import statistics
+import subprocess
+import threading
+import time
+
+import chessboard
+
+
+# Nodes of the fixed-node search of the engine.
+DEFAULT_NODES = 1000000
+
+# Seconds between two measures of the speed.
+DEFAULT_INTERVAL = 600
+
+# Limits of the time control factor.
+MIN_FACTOR = 0.25
+MAX_FACTOR = 4.0
+
+# Measures per calibration, the median is used.
+REPEAT = 3
+
+# Wall-clock limit of an engine benchmark in seconds.
+ENGINE_TIMEOUT = 60
+
+
+def parse_engine(cp):
+    """
+    Return the command and the protocol of an engine setting like
+    "cmd=engine.exe name=base proto=uci".
+    """
+    cmd, proto = None, 'uci'
+    for opt in shlex.split(cp):
+        if opt.startswith('cmd='):
+            cmd = opt.split('=', 1)[1]
+        elif opt.startswith('proto='):
+            proto = opt.split('=', 1)[1]
+    return cmd, proto
+
+
+def engine_speed(cmd, nodes=DEFAULT_NODES):
+    """
+    Return the nodes per second of a search of nodes nodes of the UCI
+    engine cmd from the start position.
+    """
+    process = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True, bufsize=1)
+    timer = threading.Timer(ENGINE_TIMEOUT, process.kill)
+    timer.start()
+
+    def send(command):
+        process.stdin.write(command + '\n')
+        process.stdin.flush()
+
+    def wait_for(token):
+        for line in process.stdout:
+            if line.startswith(token):
+                return
+        raise RuntimeError(f'{cmd} exited before {token}')
+
+    try:
+        send('uci')
+        wait_for('uciok')
+        send('isready')
+        wait_for('readyok')
+        send('position startpos')
+        t = time.perf_counter()
+        send(f'go nodes {nodes}')
+        wait_for('bestmove')
+        seconds = time.perf_counter() - t
+        send('quit')
+    finally:
+        timer.cancel()
+        process.kill()
+        process.wait()
+    return nodes / max(seconds, 1e-6)
+
+
+def cpu_speed(depth=3):
+    """
+    Return the nodes per second of a perft of the start position.
+    """
+    board = chessboard.Board()
+    t = time.perf_counter()
+    nodes = chessboard.perft(board, depth)
+    return nodes / max(time.perf_counter() - t, 1e-6)
+
+
+def scale_tc(tc, factor):
+    """
+    Return the time control tc like "40/60", "0/5+0.05" or "3:00+1" with
+    its base time and increment multiplied by factor.
+    """
+    moves, _, time_inc = tc.rpartition('/')
+    base, _, inc = time_inc.partition('+')
+    if ':' in base:
+        minutes, seconds = base.split(':')
+        base_sec = int(minutes) * 60 + float(seconds)
+    else:
+        base_sec = float(base)
+    scaled = f'{base_sec * factor:.4g}'
+    if inc:
+        scaled += f'+{float(inc) * factor:.4g}'
+    return f'{moves}/{scaled}' if moves else scaled
+
+
+def scale_engine_options(options, factor):
+    """
+    Return the engine options like "tc=0/5+0.05 option.Hash=64" with the
+    tc and st time controls multiplied by factor. Fixed depth or nodes
+    are not changed.
+    """
+    scaled = []
+    for opt in options.split():
+        if opt.startswith('tc=') and opt != 'tc=inf':
+            opt = f'tc={scale_tc(opt[3:], factor)}'
+        elif opt.startswith('st='):
+            opt = f'st={float(opt[3:]) * factor:.4g}'
+        scaled.append(opt)
+    return ' '.join(scaled)
+
+
+class Calibration:
+    def __init__(self, benchmark='engine', engine=None, nodes=DEFAULT_NODES,
+                 reference_speed=None, interval=DEFAULT_INTERVAL):
+        """
+        Speed of this machine measured with benchmark, engine or cpu,
+        engine is the setting of the engine like "cmd=engine.exe proto=uci".
+        Without reference_speed the first measure is the reference.
+        """
+        self.benchmark = benchmark
+        self.engine = engine
+        self.nodes = nodes
+        self.reference_speed = reference_speed
+        self.interval = interval
+        self.speed = None
+        self.measured = None  # time.monotonic() of the last measure
+
+    @classmethod
+    def from_setting(cls, setting, engine=None):
+        """
+        Return the calibration of the calibration section of the setting
+        file, engine is the engine setting of the engine benchmark.
+        """
+        return cls(setting.get('benchmark', 'engine'), engine, setting.get('nodes', DEFAULT_NODES),
+                   setting.get('reference_speed'), setting.get('interval', DEFAULT_INTERVAL))
+
+    def run_benchmark(self):
+        """
+        Return the speed of one run of the benchmark in nodes per second.
+        """
+        if self.benchmark == 'cpu':
+            return cpu_speed()
+        cmd, proto = parse_engine(self.engine) if self.engine else (None, None)
+        if cmd is None or proto != 'uci':
+            raise RuntimeError(f'the engine benchmark needs a UCI engine, got {self.engine!r}')
+        return engine_speed(cmd, self.nodes)
+
+    def measure(self):
+        """
+        Measure the speed of the machine, the median of REPEAT runs of the
+        benchmark. Speeds of the engine and cpu benchmarks are in different
+        units, so the cpu benchmark replaces a failed engine benchmark only
+        while there is no reference speed, the measure fails otherwise.
+        """
+        try:
+            speeds = [self.run_benchmark() for _ in range(REPEAT)]
+        except (OSError, RuntimeError) as ex:
+            if self.benchmark == 'cpu' or self.reference_speed is not None:
+                raise RuntimeError(f'{self.benchmark} benchmark failed, the speed cannot be compared '
+                                   f'with the reference speed: {ex!r}') from ex
+            logging.warning(f'{__file__} > engine benchmark failed: {ex!r}, the reference is the cpu benchmark')
+            self.benchmark = 'cpu'
+            speeds = [self.run_benchmark() for _ in range(REPEAT)]
+        self.speed = statistics.median(speeds)
+        self.measured = time.monotonic()
+        if self.reference_speed is None:
+            self.reference_speed = self.speed
+        logging.info(f'{__file__} > {self.benchmark} speed: {self.speed:.0f} nodes/s, '
+                     f'reference: {self.reference_speed:.0f}, tc factor: {self.factor():.2f}')
+        return self.speed
+
+    def refresh(self):
+        """
+        Measure the speed again if the last measure is older than interval,
+        keep the last speed if the benchmark fails.
+        """
+        if self.measured is None or time.monotonic() - self.measured >= self.interval:
+            if self.speed is None:
+                self.measure()
+                return
+            try:
+                self.measure()
+            except RuntimeError as ex:
+                logging.warning(f'{__file__} > {ex}, keep the speed of the last measure')
+                self.measured = time.monotonic()
+
+    def factor(self):
+        """
+        Return the factor of the time control of this machine.
+        """
+        if self.speed is None:
+            self.measure()
+        return round(min(max(self.reference_speed / self.speed, MIN_FACTOR), MAX_FACTOR), 2)
+
+    def job_setting(self):
+        """
+        Return the setting of the calibration of a remote job, the workers
+        measure their own speed with the benchmark of the reference speed.
+        """
+        return {'benchmark': self.benchmark, 'nodes': self.nodes, 'interval': self.interval,
+                'reference_speed': self.reference_speed}
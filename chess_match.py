@@ -35,17 +35,56 @@ outcome to its standard output, which is a real number between 0.0 (the engine
 lost all the games of the match), and 1.0 (the engine won all the games of the
 match). For example in a match of six games, 2 wins, 1 draw and 3 losses gives
 a match result of (2 + 0.5 + 0) / 6 = 0.417
+
+The score is followed by the wins, draws and losses of the test engine and
+by the pentanomial counts of the game pairs, one pair being the two games
+played from the same opening with colors reversed. The results are read
+while the match is running, from the lines of cutechess-cli or from the
+json lines of duel.py:
+  0.417
+  wdl: 2 1 3
+  penta: 1 1 0 1 0
+  failures: 0
+  games: [{"game": 1, "white": "test", "black": "base", "result": "1-0", ...}, ...]
+  metrics: {"match.total": {"count": 1, "sum": 12.5, ...}, ...}
+
+failures is the number of engine games, workers and matches that failed
+and were played again. games has the result and termination of every
+game, with the opening, plies and duration of the games of duel.py.
+metrics has the histograms of the timing spans of
+this script and of duel.py, see metrics.py. A match that is not over after --timeout seconds
+is killed with its engines and played again, up to --retries times.
 """
 
 
 from subprocess import Popen, PIPE
+import os
+import sys
+import json
+import time
+import signal
 import logging
+import functools
+import threading
 import argparse
 from pathlib import Path
 
+import resources
+import metrics
+import calibration
+
+
+# Start of this process for the match.total span.
+START_TIME = time.perf_counter()
+
 
 APP_VERSION = 1.1
 
+# The match timeout is computed for games of this number of moves per
+# engine, plus a margin for starting the engines.
+MATCH_TIMEOUT_MOVES = 200
+MATCH_TIMEOUT_MARGIN = 60
+
 
 logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.INFO,
                     filename='spsa_log.txt', filemode='a')
@@ -73,17 +112,45 @@ def main():
                         help='cutechess-cli options')
     parser.add_argument('--cutechess-cli-engine-options', required=True,
                         help='cutechess-cli engine options')
-    parser.add_argument('--test-param', required=True,
+    parser.add_argument('--test-param', required=False,
                         help='parameters to be optimized.\n'
                         'Example "QueenValueOp 800 500 1500 1000, RookValueOp ..."')
-    parser.add_argument('--base-param', required=True,
+    parser.add_argument('--base-param', required=False,
                         help='parameters for base_engine.\n'
                              'Example "QueenValueOp 800 500 1500 1000, RookValueOp ..."')
+    parser.add_argument('--test-param-file', required=False,
+                        help='file with the parameters to be optimized, one "name value"\n'
+                             'per line, used instead of --test-param')
+    parser.add_argument('--base-param-file', required=False,
+                        help='file with the parameters for base_engine, used instead of --base-param')
+    parser.add_argument('--test-param-option', required=False,
+                        help='engine option of test engine that reads a parameter file.\n'
+                             'If set, the engine gets only option.<name>=<test param file>.\n'
+                             'Otherwise every parameter is sent as an engine option.')
+    parser.add_argument('--base-param-option', required=False,
+                        help='engine option of base engine that reads a parameter file')
+    parser.add_argument('--timeout', required=False, type=float, default=None,
+                        help='wall-clock limit of the match in seconds, 0 for no limit.\n'
+                             'default: from the rounds, concurrency and tc of the match\n'
+                             f'for games of {MATCH_TIMEOUT_MOVES} moves, no limit without tc')
+    parser.add_argument('--retries', required=False, type=int, default=1,
+                        help='number of times the match is played again after\n'
+                             'it failed or timed out, default=1')
+    parser.add_argument('--affinity', required=False,
+                        help='cores of the match like 2-5 (Linux). duel.py pins the engines\n'
+                             'of every game slot to its own cores, other managers and\n'
+                             'their engines are run on these cores.')
+    parser.add_argument('--tc-factor', required=False, type=float, default=None,
+                        help='factor of the tc and st of the engine options from the speed\n'
+                             'of this machine, see calibration.py. It is recorded in every game.')
 
     args = parser.parse_args()
     cutechess_cli_path = args.cutechess_cli_path.rstrip()
     cutechess_cli_options = args.cutechess_cli_options.rstrip()
     cutechess_cli_engine_options = args.cutechess_cli_engine_options.rstrip()
+    if args.tc_factor is not None:
+        cutechess_cli_engine_options = calibration.scale_engine_options(cutechess_cli_engine_options,
+                                                                        args.tc_factor)
     seed = args.seed
 
     # test engine
@@ -95,53 +162,301 @@ def main():
     engine_base_name = args.scp.split('name=')[1].strip().split()[0].strip()
     scp = opponents[seed % len(opponents)]
 
-    # Parse the parameters that should be optimized
-    # --param "q 800 500 1200 1000, r 450 400 600 1000"
-    # q value min max factor, r value min max factor
-    for par in args.test_param.split(','):
-        par = par.strip()
-        sppar = par.split()  # Does not support param with space
-        spname = sppar[0].strip()
-        spvalue = int(sppar[1].strip())
-        fcp += f' option.{spname}={spvalue} '
-
-    # Parse parameters for base engine
-    for par in args.base_param.split(','):
-        par = par.strip()
-        sppar = par.split()  # Does not support param with space
-        spname = sppar[0].strip()
-        spvalue = int(sppar[1].strip())
-        scp += f' option.{spname}={spvalue} '
+    fcp += engine_param_options(args.test_param, args.test_param_file,
+                                args.test_param_option)
+    scp += engine_param_options(args.base_param, args.base_param_file,
+                                args.base_param_option)
 
     # Run optimizer at the folder where game_optimizer.py is located.
+    # duel.py prints its results as json lines.
     if Path(cutechess_cli_path).suffix == '.py':
-        command = f'python -u {cutechess_cli_path} {cutechess_cli_options} '
+        command = f'"{sys.executable}" -u {cutechess_cli_path} {cutechess_cli_options} -srand {seed} -jsonl '
     else:
         command = f'{cutechess_cli_path} {cutechess_cli_options} -srand {seed} '
+    cores = None
+    if args.affinity is not None:
+        if Path(cutechess_cli_path).suffix == '.py':
+            command += f'-affinity {args.affinity} -reserve-cores 0 '
+        else:
+            cores = resources.parse_cores(args.affinity)
     command += f'-engine {fcp} -engine {scp} '
     command += f'-each {cutechess_cli_engine_options}'
     logging.info(f'{__file__} > {command}')
 
-    # Run cutechess-cli and wait for it to finish
-    process = Popen(command, shell=True, stdout=PIPE, text=True)
-    output = process.communicate()[0]
-    if process.returncode != 0:
+    timeout = args.timeout
+    if timeout is None:
+        timeout = get_match_timeout(cutechess_cli_options, cutechess_cli_engine_options,
+                                    Path(cutechess_cli_path).suffix == '.py')
+
+    # Run cutechess-cli and read its results while the games are played.
+    # A match that fails is played again from the start.
+    failures = 0
+    for attempt in range(args.retries + 1):
+        match_result = MatchResult(engine_test_name, engine_base_name)
+        t = time.perf_counter()
+        returncode, timed_out = run_match(command, match_result, timeout, cores)
+        manager_elapsed = time.perf_counter() - t
+        metrics.observe('match.manager', manager_elapsed)
+        if returncode == 0 and match_result.score != '':
+            break
+        failures += 1
+        reason = f'timed out after {timeout}s' if timed_out else f'returned {returncode}'
+        logging.warning(f'{__file__} > match {reason}, attempt {attempt + 1}/{args.retries + 1}')
+    else:
         print('Could not execute command: %s' % command)
         return 2
 
-    # Convert cutechess-cli's output into a match score:
-    # we search for the last line containing a score of the match
-    result = ""
-    for line in output.splitlines():
-        if line.startswith(f'Score of {engine_test_name} vs {engine_base_name}'):
-            result = line[line.find("[")+1: line.find("]")]
+    # The score of the match is the last score of the match.
+    result, wdl, penta = match_result.score, match_result.wdl, match_result.penta
+    failures += match_result.failures
+    if args.tc_factor is not None:
+        for game in match_result.games:
+            game['tc_factor'] = args.tc_factor
+
+    # The start and stop of duel.py is the time of the manager that is
+    # not measured by duel.py itself.
+    metrics.registry.merge(match_result.spans)
+    if 'duel.total' in match_result.spans:
+        metrics.observe('match.manager_spawn', manager_elapsed - match_result.spans['duel.total']['sum'])
+
+    logging.info(f'{__file__} > match result: {result}, wdl: {wdl}, penta: {penta}, '
+                 f'failures: {failures}, seed: {seed}')
+
+    # First line is the match score, the game pair statistics follow.
+    print(result)
+    print(f'wdl: {" ".join(str(v) for v in wdl)}')
+    print(f'penta: {" ".join(str(v) for v in penta)}')
+    print(f'failures: {failures}')
+    print(f'games: {json.dumps(match_result.games, separators=(",", ":"))}')
+    metrics.observe('match.total', time.perf_counter() - START_TIME)
+    print(f'metrics: {metrics.to_json(metrics.registry.snapshot())}')
+
+
+def run_match(command, match_result, timeout, cores=None):
+    """
+    Run the tournament manager and add its lines to match_result. The
+    manager and its engines are killed if the match is not over after
+    timeout seconds. With cores they run only on these cores (Linux).
+    Return (return code, timed out).
+    """
+    if os.name == 'nt':
+        process = Popen(command, shell=True, stdout=PIPE, text=True)
+    else:
+        # The shell, the manager and the engines get their own process
+        # group so that the watchdog can kill all of them. They inherit
+        # the cores of the shell.
+        preexec_fn = None if cores is None else functools.partial(os.sched_setaffinity, 0, cores)
+        process = Popen(command, shell=True, stdout=PIPE, text=True, start_new_session=True,
+                        preexec_fn=preexec_fn)
+
+    killed = threading.Event()
+    watchdog = None
+    if timeout:
+        watchdog = threading.Timer(timeout, kill_process_tree, [process, killed])
+        watchdog.daemon = True
+        watchdog.start()
+
+    parse_time = 0.0
+    try:
+        for line in process.stdout:
+            t = time.perf_counter()
+            match_result.add_line(line)
+            parse_time += time.perf_counter() - t
+        process.wait()
+    finally:
+        metrics.observe('match.parse', parse_time)
+        if watchdog is not None:
+            watchdog.cancel()
+            watchdog.join()
+
+    return process.returncode, killed.is_set()
+
+
+def kill_process_tree(process, killed):
+    """
+    Kill process and the processes it started, killed is set.
+    """
+    if process.poll() is not None:
+        return
+    killed.set()
+    logging.warning(f'{__file__} > kill match process {process.pid}')
+    try:
+        if os.name == 'nt':
+            Popen(f'taskkill /F /T /PID {process.pid}', shell=True).wait()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def get_match_timeout(options, engine_options, duel=False):
+    """
+    Return the wall-clock limit of a match in seconds from the options
+    of the tournament manager like "-rounds 8 -repeat 2 -concurrency 2"
+    and the engine options like "tc=0/5+0.05", duel is True for duel.py
+    and False for cutechess-cli. Return None if the time control is not
+    known, like for games at a fixed depth.
+    """
+    tc = None
+    for opt in engine_options.split():
+        if opt.startswith('tc='):
+            tc = opt.split('=', 1)[1]
+    if tc is None or tc == 'inf':
+        return None
 
-    if result == "":
-        raise Exception('The match did not terminate properly')
+    # cutechess tc: [moves/]time[+inc], time is seconds or min:sec
+    base, _, inc = tc.split('/')[-1].partition('+')
+    if ':' in base:
+        minutes, seconds = base.split(':')
+        base_sec = int(minutes) * 60 + float(seconds)
     else:
-        logging.info(f'{__file__} > match result: {result}')
-        print(result)
+        base_sec = float(base)
+    inc_sec = float(inc) if inc else 0.0
+    game_sec = 2 * (base_sec + inc_sec * MATCH_TIMEOUT_MOVES)
+
+    opts = options.split()
+
+    def value(name, default):
+        if name in opts:
+            i = opts.index(name)
+            if i + 1 < len(opts) and opts[i + 1].isdigit():
+                return int(opts[i + 1])
+        return default
+
+    # cutechess-cli plays -games games per round, -repeat only reuses the
+    # openings. duel.py plays every one of rounds * games / repeat
+    # openings repeat times, with -games 1 its rounds are the games.
+    if duel:
+        repeat = max(value('-repeat', 2), 1)
+        games = max(1, value('-rounds', 2) * value('-games', 1) // repeat) * repeat
+    else:
+        games = value('-rounds', 1) * value('-games', 1)
+    concurrency = value('-concurrency', 1)
+
+    return -(-games // concurrency) * game_sec + MATCH_TIMEOUT_MARGIN
+
+
+def engine_param_options(param, param_file, param_option):
+    """
+    Return the engine options that send the parameters to the engine.
+
+    param is a string like "q 800 500 1200 1000, r 450 400 600 1000" with
+    q value min max factor, r value min max factor. param_file has one
+    "name value" per line. If param_option is set, the engine reads the
+    param_file itself and only that option is returned.
+    """
+    if param_file is not None and param_option is not None:
+        return f' option.{param_option}={Path(param_file).resolve().as_posix()} '
+
+    if param_file is not None:
+        with open(param_file) as f:
+            pars = [line.split() for line in f if line.strip() != '']
+    elif param is not None:
+        pars = [par.split() for par in param.split(',')]  # Does not support param with space
+    else:
+        return ''
+
+    return ''.join(f' option.{par[0].strip()}={int(par[1].strip())} ' for par in pars)
+
+
+def get_wdl(line):
+    """
+    Return [wins, draws, losses] of the test engine from a line like:
+    Score of test vs base: 2 - 1 - 1  [0.625] 4
+    """
+    try:
+        wins, losses, draws = line.split(':')[1].split('[')[0].split('-')
+        return [int(wins), int(draws), int(losses)]
+    except ValueError:
+        # Old style duel.py line without the W - L - D counts.
+        return [0, 0, 0]
+
+
+class MatchResult:
+    def __init__(self, engine_test_name, engine_base_name):
+        """
+        Score, wins, draws and losses and pentanomial counts of the test
+        engine, read line by line from the output of the tournament
+        manager. Only the games whose pair is not finished are kept.
+
+        The cutechess-cli lines are:
+        Finished game 1 (test vs base): 1-0 {White mates}
+        Score of test vs base: 2 - 1 - 1  [0.625] 4
+
+        The json lines of duel.py are:
+        {"type": "game", "game": 1, "white": "test", "black": "base", "result": "1-0", ...}
+        {"type": "score", "name": "test", "wins": 2, "losses": 1, "draws": 1, "score": 0.625,
+         "failures": 0, ...}
+        {"type": "error", "pair": 3, "failures": 3, "error": "..."}
+        """
+        self.engine_test_name = engine_test_name
+        self.engine_base_name = engine_base_name
+        self.score = ''
+        self.wdl = [0, 0, 0]
+        self.penta = [0, 0, 0, 0, 0]
+        self.failures = 0
+        self.spans = {}  # timing spans of duel.py
+        self.games = []  # result and termination of every game
+        self.unpaired = {}  # game number: points
+
+    def add_line(self, line):
+        line = line.strip()
+        if line.startswith('{'):
+            try:
+                res = json.loads(line)
+            except ValueError:
+                return
+            if res.get('type') == 'game':
+                self.add_game(res['game'], res['white'], res['result'])
+                self.games.append({k: res.get(k) for k in ('game', 'white', 'black', 'result', 'termination',
+                                                           'fen', 'plies', 'duration')})
+            elif res.get('type') == 'score' and res['name'] == self.engine_test_name:
+                self.score = f'{res["score"]:0.3f}'
+                self.wdl = [res['wins'], res['draws'], res['losses']]
+                self.failures = res.get('failures', 0)
+            elif res.get('type') == 'error':
+                # The next score line includes these failures.
+                self.failures += res['failures']
+            elif res.get('type') == 'latency':
+                for w in res['warnings']:
+                    logging.warning(f'{__file__} > overhead: {w}')
+            elif res.get('type') == 'metrics':
+                self.spans = res['spans']
+            elif res.get('type') == 'affinity':
+                logging.info(f'{__file__} > slot {res["slot"]}: cores {res["cores"]}')
+        elif line.startswith('Finished game'):
+            num = int(line.split()[2])
+            white = line.split('(')[1].split(' vs ')[0].strip()
+            res = line.split('):')[1].split()[0].strip()
+            self.add_game(num, white, res)
+            black = line.split(' vs ')[1].split(')')[0].strip()
+            termination = line.split('{')[1].rstrip('}') if '{' in line else None
+            self.games.append({'game': num, 'white': white, 'black': black, 'result': res,
+                               'termination': termination})
+        elif line.startswith(f'Score of {self.engine_test_name} vs {self.engine_base_name}'):
+            self.score = line[line.find("[")+1: line.find("]")]
+            self.wdl = get_wdl(line)
+
+    def add_game(self, num, white, res):
+        """
+        Count the pentanomial of the pair of game num when both games are
+        finished. With repeat 2 the games 1 and 2 are played from the same
+        opening with colors reversed, and so on.
+        """
+        if res == '1/2-1/2':
+            points = 0.5
+        elif res in ['1-0', '0-1']:
+            white_won = res == '1-0'
+            points = 1.0 if white_won == (white == self.engine_test_name) else 0.0
+        else:
+            return
+
+        partner = num + 1 if num % 2 == 1 else num - 1
+        if partner in self.unpaired:
+            self.penta[int(2 * (points + self.unpaired.pop(partner)))] += 1
+        else:
+            self.unpaired[num] = points
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
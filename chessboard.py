@@ -0,0 +1,457 @@
+"""
+chessboard.py
+
+A small chess board with legal move generation, SAN parsing and game end
+detection. It is used to convert openings to FEN and to follow the games
+of engines that do not claim the game result like UCI engines.
+
+Moves are given and returned in UCI format like e2e4, e7e8q or e1g1.
+"""
+
+
+FILES = 'abcdefgh'
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+KNIGHT_STEPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+KING_STEPS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+BISHOP_STEPS = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+ROOK_STEPS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+
+def square(name):
+    """
+    Return the square number 0 (a1) to 63 (h8) of a square name like e4.
+    """
+    return FILES.index(name[0]) + 8 * (int(name[1]) - 1)
+
+
+def square_name(sq):
+    return f'{FILES[sq % 8]}{sq // 8 + 1}'
+
+
+def is_white_piece(piece):
+    return piece.isupper()
+
+
+class Board:
+    def __init__(self, fen=START_FEN):
+        self.set_fen(fen)
+
+    def set_fen(self, fen):
+        """
+        Set the position from a FEN or from an EPD, the move counters
+        are optional.
+        """
+        fields = fen.split()
+        self.board = ['.'] * 64
+        for r, row in enumerate(fields[0].split('/')):
+            f = 0
+            for ch in row:
+                if ch.isdigit():
+                    f += int(ch)
+                else:
+                    self.board[(7 - r) * 8 + f] = ch
+                    f += 1
+
+        self.white = len(fields) < 2 or fields[1] == 'w'
+        self.castling = fields[2] if len(fields) > 2 and fields[2] != '-' else ''
+        self.ep = square(fields[3]) if len(fields) > 3 and fields[3] != '-' else None
+        self.halfmove = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        self.fullmove = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+
+        self.stack = []
+        self.keys = [self.epd()]
+
+    def copy(self):
+        b = Board.__new__(Board)
+        b.board = self.board[:]
+        b.white, b.castling, b.ep = self.white, self.castling, self.ep
+        b.halfmove, b.fullmove = self.halfmove, self.fullmove
+        b.stack, b.keys = self.stack[:], self.keys[:]
+        return b
+
+    def placement(self):
+        rows = []
+        for rank in range(7, -1, -1):
+            row, empty = '', 0
+            for f in range(8):
+                piece = self.board[rank * 8 + f]
+                if piece == '.':
+                    empty += 1
+                else:
+                    row += (str(empty) if empty else '') + piece
+                    empty = 0
+            rows.append(row + (str(empty) if empty else ''))
+        return '/'.join(rows)
+
+    def epd(self):
+        """
+        Return the first 4 fields of the FEN. The en passant square is only
+        shown if a pawn can capture on it so that the same positions have
+        the same EPD.
+        """
+        ep = '-'
+        if self.ep is not None and self._ep_capturable():
+            ep = square_name(self.ep)
+        return f'{self.placement()} {"w" if self.white else "b"} {self.castling or "-"} {ep}'
+
+    def fen(self):
+        return f'{self.epd()} {self.halfmove} {self.fullmove}'
+
+    def _ep_capturable(self):
+        pawn = 'P' if self.white else 'p'
+        f, r = self.ep % 8, self.ep // 8
+        rr = r - 1 if self.white else r + 1
+        for ff in (f - 1, f + 1):
+            if 0 <= ff < 8 and self.board[rr * 8 + ff] == pawn:
+                return True
+        return False
+
+    def is_attacked(self, sq, by_white):
+        """
+        Return True if sq is attacked by a piece of the side by_white.
+        """
+        b = self.board
+        f, r = sq % 8, sq // 8
+
+        pawn_rank = r - 1 if by_white else r + 1
+        if 0 <= pawn_rank < 8:
+            for ff in (f - 1, f + 1):
+                if 0 <= ff < 8 and b[pawn_rank * 8 + ff] == ('P' if by_white else 'p'):
+                    return True
+
+        for steps, pieces in [(KNIGHT_STEPS, 'N'), (KING_STEPS, 'K')]:
+            piece = pieces if by_white else pieces.lower()
+            for df, dr in steps:
+                ff, rr = f + df, r + dr
+                if 0 <= ff < 8 and 0 <= rr < 8 and b[rr * 8 + ff] == piece:
+                    return True
+
+        for steps, pieces in [(BISHOP_STEPS, 'BQ'), (ROOK_STEPS, 'RQ')]:
+            if not by_white:
+                pieces = pieces.lower()
+            for df, dr in steps:
+                ff, rr = f + df, r + dr
+                while 0 <= ff < 8 and 0 <= rr < 8:
+                    piece = b[rr * 8 + ff]
+                    if piece != '.':
+                        if piece in pieces:
+                            return True
+                        break
+                    ff, rr = ff + df, rr + dr
+
+        return False
+
+    def king_square(self, white):
+        return self.board.index('K' if white else 'k')
+
+    def is_check(self):
+        return self.is_attacked(self.king_square(self.white), not self.white)
+
+    def pseudo_legal_moves(self):
+        b, white = self.board, self.white
+        moves = []
+
+        for fr, piece in enumerate(b):
+            if piece == '.' or is_white_piece(piece) != white:
+                continue
+            f, r = fr % 8, fr // 8
+            kind = piece.upper()
+
+            if kind == 'P':
+                dr = 1 if white else -1
+                promo = ['q', 'r', 'b', 'n'] if r + dr in (0, 7) else ['']
+                to = fr + 8 * dr
+                if b[to] == '.':
+                    moves += [(fr, to, p) for p in promo]
+                    start_rank = 1 if white else 6
+                    if r == start_rank and b[to + 8 * dr] == '.':
+                        moves.append((fr, to + 8 * dr, ''))
+                for ff in (f - 1, f + 1):
+                    if not 0 <= ff < 8:
+                        continue
+                    to = (r + dr) * 8 + ff
+                    if (b[to] != '.' and is_white_piece(b[to]) != white) or to == self.ep:
+                        moves += [(fr, to, p) for p in promo]
+
+            elif kind in 'NK':
+                for df, dr in (KNIGHT_STEPS if kind == 'N' else KING_STEPS):
+                    ff, rr = f + df, r + dr
+                    if 0 <= ff < 8 and 0 <= rr < 8:
+                        to = rr * 8 + ff
+                        if b[to] == '.' or is_white_piece(b[to]) != white:
+                            moves.append((fr, to, ''))
+
+            else:
+                steps = []
+                if kind in 'BQ':
+                    steps += BISHOP_STEPS
+                if kind in 'RQ':
+                    steps += ROOK_STEPS
+                for df, dr in steps:
+                    ff, rr = f + df, r + dr
+                    while 0 <= ff < 8 and 0 <= rr < 8:
+                        to = rr * 8 + ff
+                        if b[to] == '.':
+                            moves.append((fr, to, ''))
+                        else:
+                            if is_white_piece(b[to]) != white:
+                                moves.append((fr, to, ''))
+                            break
+                        ff, rr = ff + df, rr + dr
+
+        moves += self._castling_moves()
+
+        return moves
+
+    def _castling_moves(self):
+        moves = []
+        b, white = self.board, self.white
+        home = 0 if white else 56
+        king, rook = ('K', 'R') if white else ('k', 'r')
+        kside, qside = ('K', 'Q') if white else ('k', 'q')
+
+        if b[home + 4] != king:
+            return moves
+        if kside in self.castling and b[home + 7] == rook \
+                and b[home + 5] == '.' and b[home + 6] == '.' \
+                and not any(self.is_attacked(home + i, not white) for i in (4, 5, 6)):
+            moves.append((home + 4, home + 6, ''))
+        if qside in self.castling and b[home] == rook \
+                and b[home + 1] == '.' and b[home + 2] == '.' and b[home + 3] == '.' \
+                and not any(self.is_attacked(home + i, not white) for i in (4, 3, 2)):
+            moves.append((home + 4, home + 2, ''))
+
+        return moves
+
+    def _make(self, move):
+        fr, to, promo = move
+        b = self.board
+        piece, captured = b[fr], b[to]
+        self.stack.append((move, piece, captured, self.castling, self.ep,
+                           self.halfmove, self.fullmove))
+
+        b[to], b[fr] = piece, '.'
+        if piece in 'Pp' and to == self.ep:
+            # En passant capture, the captured pawn is behind the ep square.
+            b[to - 8 if piece == 'P' else to + 8] = '.'
+            captured = 'p' if piece == 'P' else 'P'
+        if promo:
+            b[to] = promo.upper() if piece == 'P' else promo.lower()
+        if piece in 'Kk' and abs(to - fr) == 2:
+            if to > fr:
+                b[fr + 1], b[fr + 3] = b[fr + 3], '.'
+            else:
+                b[fr - 1], b[fr - 4] = b[fr - 4], '.'
+
+        for sq, right in [(4, 'KQ'), (0, 'Q'), (7, 'K'), (60, 'kq'), (56, 'q'), (63, 'k')]:
+            if fr == sq or to == sq:
+                self.castling = ''.join(c for c in self.castling if c not in right)
+
+        self.ep = (fr + to) // 2 if piece in 'Pp' and abs(to - fr) == 16 else None
+        self.halfmove = 0 if piece in 'Pp' or captured != '.' else self.halfmove + 1
+        if not self.white:
+            self.fullmove += 1
+        self.white = not self.white
+
+    def _unmake(self):
+        move, piece, captured, self.castling, self.ep, self.halfmove, self.fullmove = self.stack.pop()
+        fr, to, promo = move
+        b = self.board
+        self.white = not self.white
+
+        b[fr] = piece
+        if piece in 'Pp' and to == self.ep:
+            b[to] = '.'
+            b[to - 8 if piece == 'P' else to + 8] = 'p' if piece == 'P' else 'P'
+        else:
+            b[to] = captured
+        if piece in 'Kk' and abs(to - fr) == 2:
+            if to > fr:
+                b[fr + 3], b[fr + 1] = b[fr + 1], '.'
+            else:
+                b[fr - 4], b[fr - 1] = b[fr - 1], '.'
+
+    def legal_moves(self):
+        """
+        Return the legal moves as a list of (from, to, promotion).
+        """
+        return [m for m in self.pseudo_legal_moves() if self.is_legal(m)]
+
+    def is_legal(self, move):
+        """
+        Return True if the pseudo legal move does not leave the king in check.
+        """
+        white = self.white
+        self._make(move)
+        legal = not self.is_attacked(self.king_square(white), not white)
+        self._unmake()
+        return legal
+
+    def legal_uci_moves(self):
+        return [move_to_uci(m) for m in self.legal_moves()]
+
+    def push(self, move):
+        """
+        Play a move given as (from, to, promotion) or as a UCI string.
+        """
+        if isinstance(move, str):
+            move = uci_to_move(move)
+        self._make(move)
+        self.keys.append(self.epd())
+
+    def push_uci(self, uci):
+        move = uci_to_move(uci)
+        if move not in self.legal_moves():
+            raise ValueError(f'illegal move {uci} in {self.fen()}')
+        self.push(move)
+
+    def pop(self):
+        self.keys.pop()
+        self._unmake()
+
+    def parse_san(self, san):
+        """
+        Return the legal move (from, to, promotion) of a SAN move like Nbd7,
+        exd8=Q+ or O-O. Raise ValueError if there is no such move.
+        """
+        text = san.rstrip('+#!?').replace('0', 'O')
+
+        if text in ('O-O', 'O-O-O'):
+            home = 0 if self.white else 56
+            to = home + (6 if text == 'O-O' else 2)
+            for m in self.legal_moves():
+                if m[0] == home + 4 and m[1] == to and self.board[m[0]] in 'Kk':
+                    return m
+            raise ValueError(f'illegal move {san} in {self.fen()}')
+
+        promo = ''
+        if '=' in text:
+            text, promo = text.split('=')
+            promo = promo[:1].lower()
+        elif text[-1] in 'QRBN' and text[0] in FILES:
+            text, promo = text[:-1], text[-1].lower()
+
+        kind = text[0] if text[0] in 'NBRQK' else 'P'
+        if kind != 'P':
+            text = text[1:]
+        to = square(text[-2:])
+        hint = text[:-2].replace('x', '')
+
+        # Only the candidate moves are checked for legality.
+        found = []
+        for m in self.pseudo_legal_moves():
+            if m[1] != to or m[2] != promo or self.board[m[0]].upper() != kind:
+                continue
+            name = square_name(m[0])
+            if all(c in name for c in hint) and self.is_legal(m):
+                found.append(m)
+
+        if len(found) != 1:
+            raise ValueError(f'illegal or ambiguous move {san} in {self.fen()}')
+
+        return found[0]
+
+    def push_san(self, san):
+        move = self.parse_san(san)
+        self.push(move)
+        return move
+
+    def san(self, move):
+        """
+        Return the SAN of a legal move given as (from, to, promotion) or
+        as a UCI string.
+        """
+        if isinstance(move, str):
+            move = uci_to_move(move)
+        fr, to, promo = move
+        piece = self.board[fr]
+        kind = piece.upper()
+
+        if kind == 'K' and abs(to - fr) == 2:
+            text = 'O-O' if to > fr else 'O-O-O'
+        else:
+            capture = self.board[to] != '.' or (kind == 'P' and to == self.ep)
+            if kind == 'P':
+                text = FILES[fr % 8] + 'x' if capture else ''
+            else:
+                text = kind
+                others = [m[0] for m in self.legal_moves()
+                          if m[1] == to and m[0] != fr and self.board[m[0]] == piece]
+                if others:
+                    if all(o % 8 != fr % 8 for o in others):
+                        text += FILES[fr % 8]
+                    elif all(o // 8 != fr // 8 for o in others):
+                        text += str(fr // 8 + 1)
+                    else:
+                        text += square_name(fr)
+                if capture:
+                    text += 'x'
+            text += square_name(to)
+            if promo:
+                text += '=' + promo.upper()
+
+        self._make(move)
+        if self.is_check():
+            text += '#' if not self.legal_moves() else '+'
+        self._unmake()
+
+        return text
+
+    def is_insufficient_material(self):
+        pieces = [p for p in self.board if p not in '.Kk']
+        if not pieces:
+            return True
+        if len(pieces) == 1 and pieces[0] in 'NBnb':
+            return True
+        # Only bishops on squares of the same color
+        if all(p in 'Bb' for p in pieces):
+            colors = {(sq % 8 + sq // 8) % 2 for sq, p in enumerate(self.board) if p in 'Bb'}
+            return len(colors) == 1
+        return False
+
+    def outcome(self):
+        """
+        Return (result, termination) if the game is over, else None.
+        The result is 1-0, 0-1 or 1/2-1/2.
+        """
+        if not self.legal_moves():
+            if self.is_check():
+                if self.white:
+                    return '0-1', 'black mates white'
+                return '1-0', 'white mates black'
+            return '1/2-1/2', 'draw by stalemate'
+
+        if self.is_insufficient_material():
+            return '1/2-1/2', 'draw by insufficient mating material'
+
+        if self.halfmove >= 100:
+            return '1/2-1/2', 'draw by fifty moves rule'
+
+        if self.keys.count(self.keys[-1]) >= 3:
+            return '1/2-1/2', 'draw by repetition'
+
+        return None
+
+
+def uci_to_move(uci):
+    return square(uci[0:2]), square(uci[2:4]), uci[4:5].lower()
+
+
+def move_to_uci(move):
+    return f'{square_name(move[0])}{square_name(move[1])}{move[2]}'
+
+
+def perft(board, depth):
+    """
+    Count the leaf nodes of the legal move tree, used to verify the move
+    generator and as a fixed amount of cpu work.
+    """
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in board.legal_moves():
+        board._make(move)
+        nodes += perft(board, depth - 1)
+        board._unmake()
+    return nodes
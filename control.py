@@ -0,0 +1,149 @@
+"""
+control.py
+
+Control of a running optimizer over http on localhost. The optimizer
+serves its status and applies the requests between two iterations:
+
+  GET  /status       iteration, games per hour, current theta, ...
+  POST /pause        pause after the current iteration
+  POST /resume       resume a paused optimizer
+  POST /stop         stop after the current iteration
+  POST /concurrency  set the games per match, body {"concurrency": 4}
+
+Example: curl -X POST -d '{"concurrency": 4}' http://127.0.0.1:8642/concurrency
+"""
+
+
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Control:
+    def __init__(self, max_concurrency=None):
+        """
+        The requests received by the server and the status set by the
+        optimizer, shared by the server thread and the optimizer. A
+        concurrency above max_concurrency, the games per match admitted
+        by the machine budget, is rejected.
+        """
+        self.max_concurrency = max_concurrency
+        self.lock = threading.Lock()
+        self.resumed = threading.Event()
+        self.resumed.set()
+        self.stop_requested = False
+        self.concurrency = None  # games per match of the next iteration
+        self.status = {'state': 'starting'}
+
+    def get_status(self):
+        with self.lock:
+            status = dict(self.status)
+        if self.stop_requested and status['state'] != 'stopped':
+            status['state'] = 'stopping'
+        elif not self.resumed.is_set():
+            status['state'] = 'pausing' if status['state'] == 'running' else status['state']
+        if self.concurrency is not None:
+            status['next_concurrency'] = self.concurrency
+        if self.max_concurrency is not None:
+            status['max_concurrency'] = self.max_concurrency
+        return status
+
+    def set_status(self, **kwargs):
+        with self.lock:
+            self.status.update(kwargs)
+
+    def pause(self):
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    def stop(self):
+        self.stop_requested = True
+        self.resumed.set()
+
+    def set_concurrency(self, concurrency):
+        if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+            raise ValueError(f'concurrency must be a positive integer, got {concurrency!r}')
+        if self.max_concurrency is not None and concurrency > self.max_concurrency:
+            raise ValueError(f'concurrency {concurrency} is above {self.max_concurrency}, '
+                             f'the games per match that fit in the machine budget')
+        with self.lock:
+            self.concurrency = concurrency
+
+    def next_iteration(self):
+        """
+        Called by the optimizer between two iterations. Wait while the
+        optimizer is paused, then return the requests as a dict with stop
+        and concurrency, concurrency is None if it is not changed.
+        """
+        if not self.resumed.is_set():
+            logging.info(f'{__file__} > paused')
+            self.set_status(state='paused')
+            self.resumed.wait()
+            logging.info(f'{__file__} > resumed')
+
+        with self.lock:
+            concurrency, self.concurrency = self.concurrency, None
+            if concurrency is not None:
+                self.status['concurrency'] = concurrency
+            self.status['state'] = 'stopped' if self.stop_requested else 'running'
+
+        return {'stop': self.stop_requested, 'concurrency': concurrency}
+
+
+class ControlHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self.reply(200, self.server.control.get_status())
+        else:
+            self.reply(404, {'error': f'unknown path {self.path}'})
+
+    def do_POST(self):
+        control = self.server.control
+        path = self.path.rstrip('/')
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if path == '/pause':
+                control.pause()
+            elif path == '/resume':
+                control.resume()
+            elif path == '/stop':
+                control.stop()
+            elif path == '/concurrency':
+                control.set_concurrency(body.get('concurrency'))
+            else:
+                self.reply(404, {'error': f'unknown path {self.path}'})
+                return
+        except (ValueError, AttributeError) as ex:
+            self.reply(400, {'error': str(ex)})
+            return
+
+        logging.info(f'{__file__} > {path[1:]} {body if body else ""}')
+        self.reply(200, control.get_status())
+
+    def reply(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(f'{__file__} > {self.address_string()} {format % args}')
+
+
+def serve(control, port, host='127.0.0.1'):
+    """
+    Serve the requests of control in a daemon thread, return the server.
+    Only local clients can connect with the default host.
+    """
+    server = ThreadingHTTPServer((host, port), ControlHandler)
+    server.daemon_threads = True
+    server.control = control
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f'{__file__} > control server on http://{host}:{server.server_port}')
+    return server
@@ -0,0 +1,383 @@
+"""
+distributed.py
+
+Matches of the optimizer played by workers on other machines. The
+optimizer runs a coordinator and the matches of the iterations are sent
+to it as jobs instead of being run locally. Workers connect to the
+coordinator, play the jobs with the local match script and send the
+results back:
+
+  python game_optimizer.py --coordinator 0.0.0.0:8650 --coordinator-token <secret>
+  python distributed.py worker --coordinator optimizer-host:8650 --token <secret> --slots 2
+
+A job runs the engines it names, so every connection must send the
+shared token, also read from the SPSA_TOKEN environment variable. Without
+a token the coordinator only listens on a loopback address. The workers
+only run the match scripts of MATCH_SCRIPTS, without a shell.
+
+A job is a match or a part of a match: the engines, the parameter values,
+the openings when the optimizer uses an opening index, the options of the
+tournament manager and the seed. The engine and tournament manager files
+must be at the same paths on the workers as on the optimizer machine.
+
+The messages are json lines over tcp, the first message of a connection
+has the token:
+
+  worker -> coordinator  {"type": "get", "token": "..."}
+  coordinator -> worker  {"type": "job", "id": 3, "job": {...}}
+  worker -> coordinator  {"type": "heartbeat"} every HEARTBEAT seconds
+  worker -> coordinator  {"type": "result", "id": 3, "result": {...}}
+  match  -> coordinator  {"type": "submit", "token": "...", "jobs": [{...}, ...]}
+  coordinator -> match   {"type": "results", "results": [{...}, ...]}
+
+A job of a worker that disconnects or sends no heartbeat for
+HEARTBEAT_TIMEOUT seconds is queued again, up to MAX_REQUEUES times.
+
+With the calibration section in the setting file of the optimizer, a
+worker measures its speed at the first job and every interval seconds
+and plays the jobs with the time control scaled to the reference speed.
+"""
+
+
+import argparse
+import collections
+import hmac
+import ipaddress
+import json
+import logging
+import os
+import shlex
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import calibration
+
+
+# Seconds between the heartbeats of a worker that plays a job.
+HEARTBEAT = 5
+
+# A worker that sends nothing for this time is lost.
+HEARTBEAT_TIMEOUT = 30
+
+# A job lost more times fails.
+MAX_REQUEUES = 3
+
+DIR = Path(__file__).resolve().parent
+
+# The match scripts that a job can run.
+MATCH_SCRIPTS = ('chess_match.py', 'match_sim.py')
+
+# The calibrations of this worker by setting, shared by the slots.
+calibrations = {}
+calibration_lock = threading.Lock()
+
+
+def parse_address(address):
+    """
+    Return (host, port) of an address like host:8650.
+    """
+    host, port = address.rsplit(':', 1)
+    return host or '0.0.0.0', int(port)
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def send(wfile, message, lock=None):
+    data = (json.dumps(message, separators=(',', ':')) + '\n').encode()
+    if lock is None:
+        wfile.write(data)
+        wfile.flush()
+    else:
+        with lock:
+            wfile.write(data)
+            wfile.flush()
+
+
+class Coordinator:
+    def __init__(self, token=None):
+        """
+        The jobs waiting for a worker and the jobs played by the workers,
+        the connections must send token.
+        """
+        self.token = token
+        self.cond = threading.Condition()
+        self.waiting = collections.deque()  # job ids
+        self.jobs = {}  # id: {'job', 'tries', 'result'}
+        self.running = {}  # (id, connection): time of the last message of the worker
+        self.next_id = 0
+
+    def submit(self, jobs):
+        """
+        Queue jobs, wait for their results and return them in order.
+        """
+        with self.cond:
+            ids = []
+            for job in jobs:
+                self.next_id += 1
+                self.jobs[self.next_id] = {'job': job, 'tries': 0, 'result': None}
+                self.waiting.append(self.next_id)
+                ids.append(self.next_id)
+            self.cond.notify_all()
+            self.cond.wait_for(lambda: all(self.jobs[i]['result'] is not None for i in ids))
+            return [self.jobs.pop(i)['result'] for i in ids]
+
+    def authorize(self, message):
+        return self.token is None or hmac.compare_digest(str(message.get('token', '')), self.token)
+
+    def take(self, connection):
+        """
+        Wait for a job for the worker of connection, return (id, job).
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.waiting) > 0)
+            job_id = self.waiting.popleft()
+            self.running[(job_id, connection)] = time.monotonic()
+            self.jobs[job_id]['tries'] += 1
+            return job_id, self.jobs[job_id]['job']
+
+    def heartbeat(self, job_id, connection):
+        with self.cond:
+            if (job_id, connection) in self.running:
+                self.running[(job_id, connection)] = time.monotonic()
+
+    def finish(self, job_id, result, connection):
+        """
+        Keep the result of the job if the worker of connection still holds
+        it, not if the job was queued again after the worker was lost.
+        """
+        with self.cond:
+            if self.running.pop((job_id, connection), None) is not None and job_id in self.jobs:
+                self.jobs[job_id]['result'] = result
+                self.cond.notify_all()
+
+    def lose(self, job_id, reason, connection):
+        """
+        Queue again the job of a lost worker, or fail it after
+        MAX_REQUEUES tries.
+        """
+        with self.cond:
+            if self.running.pop((job_id, connection), None) is None or job_id not in self.jobs:
+                return
+            job = self.jobs[job_id]
+            logging.warning(f'{__file__} > job {job_id} lost ({reason}), try {job["tries"]}/{MAX_REQUEUES}')
+            if job['tries'] >= MAX_REQUEUES:
+                job['result'] = {'returncode': -1, 'output': '', 'error': f'job lost {job["tries"]} times: {reason}'}
+            else:
+                self.waiting.appendleft(job_id)
+            self.cond.notify_all()
+
+    def reap(self):
+        """
+        Close the connections of the workers without heartbeat, their
+        handlers then queue their jobs again.
+        """
+        while True:
+            time.sleep(HEARTBEAT)
+            now = time.monotonic()
+            with self.cond:
+                lost = [key for key, last in self.running.items() if now - last > HEARTBEAT_TIMEOUT]
+            for job_id, connection in lost:
+                self.lose(job_id, f'no heartbeat for {HEARTBEAT_TIMEOUT}s', connection)
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+class CoordinatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        coordinator = self.server.coordinator
+        job_id = None
+        try:
+            for num, line in enumerate(self.rfile):
+                message = json.loads(line)
+                if num == 0 and not coordinator.authorize(message):
+                    logging.warning(f'{__file__} > connection {self.client_address}: bad token')
+                    return
+                if message['type'] == 'submit':
+                    results = coordinator.submit(message['jobs'])
+                    send(self.wfile, {'type': 'results', 'results': results})
+                    return
+                elif message['type'] == 'get':
+                    job_id, job = coordinator.take(self.request)
+                    send(self.wfile, {'type': 'job', 'id': job_id, 'job': job})
+                elif message['type'] == 'heartbeat' and job_id is not None:
+                    coordinator.heartbeat(job_id, self.request)
+                elif message['type'] == 'result':
+                    coordinator.finish(message['id'], message['result'], self.request)
+                    job_id = None
+        except (OSError, ValueError) as ex:
+            logging.warning(f'{__file__} > connection {self.client_address}: {ex!r}')
+        finally:
+            if job_id is not None:
+                coordinator.lose(job_id, f'worker {self.client_address[0]} disconnected', self.request)
+
+
+def serve(coordinator, address):
+    """
+    Serve the workers and the matches in daemon threads, return the server.
+    A coordinator without token only serves a loopback address.
+    """
+    host, port = parse_address(address)
+    if coordinator.token is None and not is_loopback(host):
+        raise ValueError(f'a token is required to serve the workers on {address}')
+    server = socketserver.ThreadingTCPServer((host, port), CoordinatorHandler,
+                                             bind_and_activate=False)
+    server.allow_reuse_address = True
+    server.server_bind()
+    server.server_activate()
+    server.daemon_threads = True
+    server.coordinator = coordinator
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=coordinator.reap, daemon=True).start()
+    logging.info(f'{__file__} > coordinator on {address}')
+    return server
+
+
+def submit(address, jobs, token=None):
+    """
+    Send jobs to the coordinator and return their results.
+    """
+    host, port = parse_address(address)
+    with socket.create_connection(('127.0.0.1' if host == '0.0.0.0' else host, port)) as sock:
+        f = sock.makefile('rwb')
+        send(f, {'type': 'submit', 'token': token, 'jobs': jobs})
+        line = f.readline()
+    if not line:
+        raise ConnectionError(f'coordinator {address} closed the connection')
+    return json.loads(line)['results']
+
+
+def tc_factor(job):
+    """
+    Return the time control factor of this worker for the calibration
+    setting of job.
+    """
+    setting = job['calibration']
+    key = json.dumps(setting, sort_keys=True)
+    with calibration_lock:
+        if key not in calibrations:
+            calibrations[key] = calibration.Calibration.from_setting(setting, job['scp'])
+        calibrations[key].refresh()
+        return calibrations[key].factor()
+
+
+def run_job(job, concurrency=None):
+    """
+    Play the match of job with the local match script, return the result
+    with the returncode, the output and the games of the match.
+    """
+    import game_optimizer
+
+    script, _, script_args = job['script'].partition(' ')
+    if script not in MATCH_SCRIPTS:
+        return {'returncode': -1, 'output': '', 'error': f'{script} is not a match script',
+                'worker': socket.gethostname()}
+
+    if concurrency is not None:
+        job = {**job, 'concurrency': concurrency}
+    if job.get('calibration') is not None:
+        try:
+            job = {**job, 'tc_factor': tc_factor(job)}
+        except RuntimeError as ex:
+            return {'returncode': -1, 'output': '', 'error': str(ex), 'worker': socket.gethostname()}
+    with tempfile.TemporaryDirectory() as tmp:
+        test_param_file = game_optimizer.write_param_file(
+            {n: {'value': v} for n, v in job['test_param'].items()}, os.path.join(tmp, 'param_test.txt'))
+        base_param_file = game_optimizer.write_param_file(
+            {n: {'value': v} for n, v in job['base_param'].items()}, os.path.join(tmp, 'param_base.txt'))
+        openings_file = None
+        if job.get('openings') is not None:
+            openings_file = Path(tmp, 'openings.epd').as_posix()
+            with open(openings_file, 'w') as f:
+                f.write(''.join(f'{epd}\n' for epd in job['openings']))
+        pgn_file = Path(tmp, 'games.pgn').as_posix() if job.get('pgn') else None
+
+        args = game_optimizer.match_arguments(job, test_param_file, base_param_file, openings_file, pgn_file)
+        command = [sys.executable, (DIR / script).as_posix()] + shlex.split(script_args) + shlex.split(args)
+        t = time.perf_counter()
+        process = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        result = {'returncode': process.returncode, 'output': process.stdout,
+                  'seconds': time.perf_counter() - t, 'worker': socket.gethostname(),
+                  'tc_factor': job.get('tc_factor')}
+        if pgn_file is not None and os.path.isfile(pgn_file):
+            result['pgn'] = Path(pgn_file).read_text()
+    return result
+
+
+def work(address, concurrency=None, token=None):
+    """
+    Play the jobs of the coordinator one after the other, reconnect when
+    the connection is lost.
+    """
+    host, port = parse_address(address)
+    while True:
+        try:
+            with socket.create_connection((host, port)) as sock:
+                f = sock.makefile('rwb')
+                lock = threading.Lock()
+                while True:
+                    send(f, {'type': 'get', 'token': token}, lock)
+                    line = f.readline()
+                    if not line:
+                        raise ConnectionError('coordinator closed the connection')
+                    message = json.loads(line)
+                    logging.info(f'{__file__} > job {message["id"]}')
+
+                    done = threading.Event()
+
+                    def beat():
+                        while not done.wait(HEARTBEAT):
+                            send(f, {'type': 'heartbeat'}, lock)
+
+                    threading.Thread(target=beat, daemon=True).start()
+                    try:
+                        result = run_job(message['job'], concurrency)
+                    finally:
+                        done.set()
+                    send(f, {'type': 'result', 'id': message['id'], 'result': result}, lock)
+        except (OSError, ValueError) as ex:
+            logging.warning(f'{__file__} > {address}: {ex!r}, reconnect in {HEARTBEAT}s')
+            time.sleep(HEARTBEAT)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Worker that plays the matches of a distributed optimizer.',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('mode', choices=['worker'])
+    parser.add_argument('--coordinator', required=True,
+                        help='address of the coordinator of game_optimizer.py, example: host:8650')
+    parser.add_argument('--slots', required=False, type=int, default=1,
+                        help='jobs played at the same time, default=1')
+    parser.add_argument('--concurrency', required=False, type=int, default=None,
+                        help='games per job on this machine, default=the concurrency of the optimizer')
+    parser.add_argument('--token', required=False, default=os.environ.get('SPSA_TOKEN'),
+                        help='shared token of the coordinator, default=$SPSA_TOKEN')
+
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.INFO)
+
+    threads = [threading.Thread(target=work, args=(args.coordinator, args.concurrency, args.token),
+                                daemon=True)
+               for _ in range(args.slots)]
+    for t in threads:
+        t.start()
+    print(f'worker with {args.slots} slots for {args.coordinator}')
+    for t in threads:
+        t.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,45 @@
 """
 duel.py
 
-A module to handle xboard or winboard engine matches.
+A module to handle xboard/winboard or UCI engine matches. It accepts the
+options of cutechess-cli used by chess_match.py and prints the same
+"Finished game" and "Score of" lines so that it can be used as the
+tournament manager of the optimizer.
 """
 
 
-import subprocess
+import asyncio
 import argparse
+import collections
+import json
+import math
+import os
 import time
 import random
+import functools
 import concurrent.futures
 from concurrent.futures import ProcessPoolExecutor
+import multiprocessing.util
 import logging
-from statistics import mean
 from typing import List
 
+import chessboard
+import opening_book
+import pgn_sink
+import resources
+import game_cache
+import metrics
 
+
+# Start of this process for the duel.startup and duel.total spans.
+START_TIME = time.perf_counter()
+
+
+# The lines sent to and received from the engines are not logged, they
+# are kept in the Trace of every game.
 logging.basicConfig(
     filename='log_duel.txt', filemode='a',
-    level=logging.DEBUG,
+    level=logging.INFO,
     format='%(asctime)s - pid%(process)5d - %(levelname)5s - %(message)s')
 
 
@@ -50,8 +71,10 @@ def define_engine(engine_option_value):
     Define engine files, name and options.
     """
     ed1, ed2 = {}, {}
-    e1 = {'proc': None, 'cmd': None, 'name': 'test', 'opt': ed1, 'tc': '', 'depth': 0}
-    e2 = {'proc': None, 'cmd': None, 'name': 'base', 'opt': ed2, 'tc': '', 'depth': 0}
+    e1 = {'proc': None, 'cmd': None, 'name': 'test', 'opt': ed1, 'tc': '', 'depth': 0, 'nodes': 0,
+          'proto': None}
+    e2 = {'proc': None, 'cmd': None, 'name': 'base', 'opt': ed2, 'tc': '', 'depth': 0, 'nodes': 0,
+          'proto': None}
     for i, eng_opt_val in enumerate(engine_option_value):
         for value in eng_opt_val:
             if i == 0:
@@ -61,7 +84,7 @@ def define_engine(engine_option_value):
                     # Todo: support float value
                     # option.QueenValueOpening=1000
                     optn = value.split('option.')[1].split('=')[0]
-                    optv = int(value.split('option.')[1].split('=')[1])
+                    optv = option_value(value.split('option.')[1].split('=', 1)[1])
                     ed1.update({optn: optv})
                     e1.update({'opt': ed1})
                 elif 'tc=' in value:
@@ -70,12 +93,16 @@ def define_engine(engine_option_value):
                     e1.update({'name': value.split('=')[1]})
                 elif 'depth=' in value:
                     e1.update({'depth': int(value.split('=')[1])})
+                elif 'nodes=' in value:
+                    e1.update({'nodes': int(value.split('=')[1])})
+                elif 'proto=' in value:
+                    e1.update({'proto': value.split('=')[1]})
             elif i == 1:
                 if 'cmd=' in value:
                     e2.update({'cmd': value.split('=')[1]})
                 elif 'option.' in value:
                     optn = value.split('option.')[1].split('=')[0]
-                    optv = int(value.split('option.')[1].split('=')[1])
+                    optv = option_value(value.split('option.')[1].split('=', 1)[1])
                     ed2.update({optn: optv})
                     e2.update({'opt': ed2})
                 elif 'tc=' in value:
@@ -84,23 +111,46 @@ def define_engine(engine_option_value):
                     e2.update({'name': value.split('=')[1]})
                 elif 'depth=' in value:
                     e2.update({'depth': int(value.split('=')[1])})
+                elif 'nodes=' in value:
+                    e2.update({'nodes': int(value.split('=')[1])})
+                elif 'proto=' in value:
+                    e2.update({'proto': value.split('=')[1]})
 
     return e1, e2
 
 
-def get_fen_list(fn, is_rand=False):
+def option_value(value):
+    """
+    Return the value of an engine option as int if possible, else as string
+    like a path of a parameter file.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def get_fen_list(fn, is_rand=False, fmt='epd', plies=10000, start=1):
     """
-    Read fen file and return a list of fens.
+    Read the opening file and return a list of fens. fmt is epd or pgn,
+    plies is the maximum number of moves read from pgn games and start is
+    the number of the first opening to play.
     """
     fens = []
 
     if fn is None:
         return fens
 
-    with open(fn) as f:
-        for lines in f:
-            fen = lines.strip()
-            fens.append(fen)
+    if fmt == 'pgn':
+        fens = opening_book.read_pgn_openings(fn, plies)
+    else:
+        with open(fn) as f:
+            for lines in f:
+                fen = lines.strip()
+                if fen != '':
+                    fens.append(fen)
+
+    fens = fens[max(0, start - 1):]
 
     if is_rand:
         random.shuffle(fens)
@@ -110,144 +160,208 @@ def get_fen_list(fn, is_rand=False):
 
 def get_tc(tcd):
     """
-    tc=0/3+1 or 3+1, blitz 3m + 1s inc
-    tc=0/0:5+0.1 or 0:5+0.1, blitz 0m + 5s + 0.1s inc
+    The time control of cutechess-cli, the base time is in seconds.
+    tc=0/180+1 or 180+1 or 3:00+1, blitz 3m + 1s inc
+    tc=0/5+0.1 or 0:5+0.1, blitz 0m + 5s + 0.1s inc
+    tc=40/60, 60s for 40 moves is played as 60s without inc
     """
     base_minv, base_secv, inc_secv = 0, 0, 0.0
 
     if tcd == '':
         return base_minv, base_secv, inc_secv
 
-    # Check base time with minv:secv format.
-    if '/' in tcd:
-        basev = tcd.split('/')[1].split('+')[0].strip()
-    else:
-        basev = tcd.split('+')[0].strip()
+    # Drop the moves per time control.
+    tcd = tcd.split('/')[-1]
 
+    # Check base time with minv:secv format.
+    basev = tcd.split('+')[0].strip()
     if ':' in basev:
         base_minv = int(basev.split(':')[0])
-        base_secv = int(basev.split(':')[1])
+        base_secv = float(basev.split(':')[1])
     else:
-        base_minv = int(basev)
+        base_minv = int(float(basev) // 60)
+        base_secv = float(basev) - base_minv * 60
 
-    if '/' in tcd:
-        inc_secv = float(tcd.split('/')[1].split('+')[1].strip())
-    else:
+    if '+' in tcd:
         inc_secv = float(tcd.split('+')[1].strip())
 
     return base_minv, base_secv, inc_secv
 
 
+def get_level(base_minv, base_secv, inc_secv):
+    """
+    Return the xboard level command of a time control.
+    """
+    secv = round(base_secv)
+    base = f'{base_minv}:{secv:02d}' if secv else f'{base_minv}'
+    return f'level 0 {base} {inc_secv:g}'
+
+
+def is_fixed_search(e):
+    """
+    Return True if the engine dict e searches to a fixed depth or number
+    of nodes instead of using its time.
+    """
+    return e['depth'] > 0 or e.get('nodes', 0) > 0
+
+
+def get_game_timeout(e1, e2):
+    """
+    Return the wall-clock limit of a game in seconds from the time
+    controls of the engines.
+    """
+    if is_fixed_search(e1) or is_fixed_search(e2) or e1['tc'] == '' or e2['tc'] == '':
+        return DEPTH_GAME_TIMEOUT
+    timeout = GAME_TIMEOUT_MARGIN
+    for e in [e1, e2]:
+        base_minv, base_secv, inc_secv = get_tc(e['tc'])
+        timeout += base_minv * 60 + base_secv + inc_secv * GAME_TIMEOUT_MOVES
+    return timeout
+
+
 def turn(fen):
     """
-    Return side to move of the given fen.
+    Return side to move of the given fen, the start position if fen is None.
     """
+    if fen is None:
+        return True
     side = fen.split()[1].strip()
     if side == 'w':
         return True
     return False
 
 
-def save_game(outfn, fen, moves, scores, depths, e1, e2, start_turn, gres,
-              termination='', variant=''):
-    logging.info('Saving game ...')
-    with open(outfn, 'a') as f:
-        f.write('[Event "Optimization test"]\n')
-        f.write(f'[White "{e1 if start_turn else e2}"]\n')
-        f.write(f'[Black "{e1 if not start_turn else e2}"]\n')
-        f.write(f'[Result "{gres}"]\n')
+def format_game(fen, moves, scores, depths, e1, e2, start_turn, gres,
+                termination='', variant=''):
+    """
+    Return the pgn text of a game.
+    """
+    text = ['[Event "Optimization test"]\n',
+            f'[White "{e1 if start_turn else e2}"]\n',
+            f'[Black "{e1 if not start_turn else e2}"]\n',
+            f'[Result "{gres}"]\n',
+            f'[Variant "{variant}"]\n']
 
-        f.write(f'[Variant "{variant}"]\n')
+    if termination != '':
+        text.append(f'[Termination "{termination}"]\n')
 
-        if termination != '':
-            f.write(f'[Termination "{termination}"]\n')
+    if fen is not None:
+        text.append(f'[FEN "{fen}"]\n\n')
+    else:
+        text.append('\n')
 
-        if not isinstance(fen, int):
-            f.write(f'[FEN "{fen}"]\n\n')
+    for i, (m, s, d) in enumerate(zip(moves, scores, depths)):
+        num = i + 1
+        if num % 2 == 0:
+            if start_turn:
+                str_num = f'{num // 2}... '
+            else:
+                str_num = f'{num // 2}. '
         else:
-            f.write('\n')
-
-        for i, (m, s, d) in enumerate(zip(moves, scores, depths)):
-            num = i + 1
-            if num % 2 == 0:
-                if start_turn:
-                    str_num = f'{num // 2}... '
-                else:
-                    str_num = f'{num // 2}. '
+            num += 1
+            if start_turn:
+                str_num = f'{num // 2}. '
             else:
-                num += 1
-                if start_turn:
-                    str_num = f'{num // 2}. '
-                else:
-                    str_num = f'{num // 2}... '
-            f.write(f'{str_num}{m} {{{s}/{d}}} ')
-            if (i + 1) % 5 == 0:
-                f.write('\n')
-        f.write('\n\n')
-
+                str_num = f'{num // 2}... '
+        text.append(f'{str_num}{m} {{{s}/{d}}} ')
+        if (i + 1) % 5 == 0:
+            text.append('\n')
+    text.append('\n\n')
 
-def adjudicate_win(score_history, resign_option, side):
-    logging.info('Try adjudicating this game by win ...')
-    ret, gres, e1score = False, '*', 0.0
+    return ''.join(text)
 
-    if len(score_history) >= 40:
-        fcp_score = score_history[0::2]
-        scp_score = score_history[1::2]
 
-        fwin_cnt, swin_cnt = 0, 0
-        movecount = resign_option['movecount'] * 2
-        score = resign_option['score']
+class Adjudicator:
+    def __init__(self, resign_option, draw_option):
+        """
+        Resign and draw adjudication from the scores of the engines, the
+        counters are updated after every move with constant work.
+
+        The score of a move is paired with the score of the previous move,
+        the first engine (white or black who moved first) gives the score of
+        the even moves. The pairs ending at the last move are every other
+        pair, the counters of consecutive pairs that qualify are kept
+        for the pairs ending at even and at odd moves.
+        """
+        self.resign_option = resign_option
+        self.draw_option = draw_option
+        self.plies = 0
+        self.last_score = None
+
+        # Consecutive pairs won by the first or second engine and drawn,
+        # for the pairs ending at even and odd moves.
+        self.fwin_cnt = [0, 0]
+        self.swin_cnt = [0, 0]
+        self.draw_cnt = [0, 0]
+
+    def add(self, score):
+        """
+        Called with the score of every move.
+        """
+        ply = self.plies
+        self.plies += 1
+
+        if self.last_score is not None:
+            p = ply % 2
+            fs, ss = (score, self.last_score) if p == 0 else (self.last_score, score)
+
+            rscore = self.resign_option['score']
+            if rscore is not None:
+                if fs >= rscore and ss <= -rscore:
+                    self.fwin_cnt[p] += 1
+                    self.swin_cnt[p] = 0
+                elif fs <= -rscore and ss >= rscore:
+                    self.fwin_cnt[p] = 0
+                    self.swin_cnt[p] += 1
+                else:
+                    self.fwin_cnt[p] = 0
+                    self.swin_cnt[p] = 0
 
-        for i, (fs, ss) in enumerate(zip(reversed(fcp_score),
-                                         reversed(scp_score))):
-            if i >= movecount:
-                break
-            if i <= movecount and fs >= score and ss <= -score:
-                fwin_cnt += 1
-            elif i <= movecount and fs <= -score and ss >= score:
-                swin_cnt += 1
+            dscore = self.draw_option['score']
+            if dscore is not None:
+                if abs(fs) <= dscore and abs(ss) <= dscore:
+                    self.draw_cnt[p] += 1
+                else:
+                    self.draw_cnt[p] = 0
 
-        if fwin_cnt >= movecount:
-            gres = '1-0' if side else '0-1'
-            e1score = 1.0
-            logging.info(f'{"White" if side else "Black"} wins by adjudication.')
-            ret = True
-        if swin_cnt >= movecount:
-            gres = '1-0' if side else '0-1'
-            e1score = 0
-            logging.info(f'{"White" if side else "Black"} wins by adjudication.')
-            ret = True
+        self.last_score = score
 
-    return ret, gres, e1score
+    def adjudicate_win(self, side):
+        logging.debug('Try adjudicating this game by win ...')
+        ret, gres, e1score = False, '*', 0.0
 
+        if self.plies >= 40:
+            p = (self.plies - 1) % 2
+            movecount = self.resign_option['movecount'] * 2
 
-def adjudicate_draw(score_history, draw_option):
-    logging.info('Try adjudicating this game by draw ...')
-    ret, gres, e1score = False, '*', 0.0
+            if self.fwin_cnt[p] >= movecount:
+                gres = '1-0' if side else '0-1'
+                e1score = 1.0
+                logging.info(f'{"White" if side else "Black"} wins by adjudication.')
+                ret = True
+            if self.swin_cnt[p] >= movecount:
+                gres = '1-0' if side else '0-1'
+                e1score = 0
+                logging.info(f'{"White" if side else "Black"} wins by adjudication.')
+                ret = True
 
-    if len(score_history) >= draw_option['movenumber'] * 2:
-        fcp_score = score_history[0::2]
-        scp_score = score_history[1::2]
+        return ret, gres, e1score
 
-        draw_cnt = 0
-        movecount = draw_option['movecount'] * 2
-        score = draw_option['score']
+    def adjudicate_draw(self):
+        logging.debug('Try adjudicating this game by draw ...')
+        ret, gres, e1score = False, '*', 0.0
 
-        for i, (fs, ss) in enumerate(zip(reversed(fcp_score),
-                                         reversed(scp_score))):
-            if i >= movecount:
-                break
-            if (i <= movecount and abs(fs) <= score
-                    and abs(ss) <= score):
-                draw_cnt += 1
+        if self.plies >= self.draw_option['movenumber'] * 2:
+            p = (self.plies - 1) % 2
+            movecount = self.draw_option['movecount'] * 2
 
-        if draw_cnt >= movecount:
-            gres = '1/2-1/2'
-            e1score = 0.5
-            logging.info('Draw by adjudication.')
-            ret = True
+            if self.draw_cnt[p] >= movecount:
+                gres = '1/2-1/2'
+                e1score = 0.5
+                logging.info('Draw by adjudication.')
+                ret = True
 
-    return ret, gres, e1score
+        return ret, gres, e1score
 
 
 def is_game_end(line, test_engine_color):
@@ -272,13 +386,43 @@ def is_game_end(line, test_engine_color):
         elif 'insufficient' in line.lower():
             termination = 'draw by insufficient mating material'
         elif 'fifty' in line.lower():
-            termination = 'draw by insufficient mating material'
+            termination = 'draw by fifty moves rule'
         elif 'stalemate' in line.lower():
             termination = 'draw by stalemate'
 
     return game_end, gres, e1score, termination
 
 
+def get_e1score(gres, test_engine_color):
+    """
+    Return the score of the test engine from the game result.
+    """
+    if gres == '1/2-1/2':
+        return 0.5
+    if gres == '1-0':
+        return 1.0 if test_engine_color else 0.0
+    if gres == '0-1':
+        return 0.0 if test_engine_color else 1.0
+    return 0.0
+
+
+def board_move(board, text):
+    """
+    Return the legal move of a move text in coordinate notation like e2e4
+    or in SAN like Nf3. Raise ValueError if the move is not legal.
+    """
+    try:
+        move = chessboard.uci_to_move(text)
+        if move in board.legal_moves():
+            return move
+    except (ValueError, IndexError):
+        pass
+    try:
+        return board.parse_san(text)
+    except IndexError:
+        raise ValueError(f'illegal move {text}')
+
+
 def param_to_dict(param):
     """
     Convert string param to a dictionary.
@@ -329,240 +473,739 @@ def time_forfeit(is_timeup, current_color, test_engine_color):
     return game_end, gres, e1score
 
 
-def match(e1, e2, fen, output_game_file, variant, draw_option,
-          resign_option, repeat=2) -> List[float]:
+class EngineError(Exception):
+    pass
+
+
+# Default number of engine lines kept in the trace of a game.
+TRACE_SIZE = 1000
+
+# File where the traces of the games are written.
+TRACE_FILE = 'log_duel_trace.txt'
+
+
+class Trace:
+    def __init__(self, size=TRACE_SIZE):
+        """
+        The last size lines sent to and received from the engines during a
+        game, kept in memory. The lines are formatted only when the trace
+        is written, for the games that failed or ended oddly.
+        """
+        self.lines = collections.deque(maxlen=size)
+        self.t0 = time.perf_counter_ns()
+
+    def add(self, name, direction, line):
+        self.lines.append((time.perf_counter_ns(), name, direction, line))
+
+    def write(self, fn, title):
+        """
+        Append the trace to the file fn in a single write.
+        """
+        text = [f'--- pid {os.getpid()}: {title}']
+        for t, name, direction, line in self.lines:
+            text.append(f'{(t - self.t0) / 1e6:10.1f}ms {name} {direction} {line}')
+        with open(fn, 'a') as f:
+            f.write('\n'.join(text) + '\n')
+
+
+def is_odd_game(game):
     """
-    Run an engine match between e1 and e2. Save the game and print result
-    from e1 perspective.
+    Return True if the game was not ended by the rules or by a regular
+    adjudication, its trace is worth keeping.
     """
-    move_hist = []
-    all_e1score = []
-    is_show_search_info = False
+    termination = game['termination']
+    return (game['gres'] == '*' or termination == 'forfeits on time'
+            or 'illegal move' in termination)
 
-    # Start engine match, 2 games will be played.
-    for gn in range(repeat):
-        logging.info(f'Match game no. {gn + 1}')
-        logging.info(f'Test engine plays as {"first" if gn % 2 == 0 else "second"} engine.')
 
-        pe1 = subprocess.Popen(e1['cmd'], stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT,
-                               universal_newlines=True, bufsize=1)
+# Time in ms given to an engine above its remaining time before its move
+# is considered lost on time.
+MOVE_TIMEOUT_MARGIN_MS = 1000
 
-        pe2 = subprocess.Popen(e2['cmd'], stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT,
-                               universal_newlines=True, bufsize=1)
+# Score in cp of a mate in 0 moves, a mate in n is MATE_SCORE - n.
+MATE_SCORE = 32000
 
-        e1.update({'proc': pe1})
-        e2.update({'proc': pe2})
+# Time in seconds for an engine to start, answer the handshake and be
+# ready for a game.
+READY_TIMEOUT = 30
 
-        if gn % 2 == 0:
-            eng = [e1, e2]
-        else:
-            eng = [e2, e1]
+# The wall-clock limit of a game is the time of both engines for
+# GAME_TIMEOUT_MOVES moves plus GAME_TIMEOUT_MARGIN seconds. Games at a
+# fixed depth or number of nodes get DEPTH_GAME_TIMEOUT seconds.
+GAME_TIMEOUT_MOVES = 200
+GAME_TIMEOUT_MARGIN = 30
+DEPTH_GAME_TIMEOUT = 3600
 
-        for i, pr in enumerate(eng):
-            e = pr['proc']
-            pn = pr['name']
+# Latencies of every move in ms, see LatencyMeter.
+LATENCY_METRICS = ['think', 'overhead', 'first_output', 'move_delay', 'harness']
 
-            e.stdin.write('xboard\n')
-            logging.debug(f'{pn} > xboard')
-            e.stdin.write('protover 2\n')
-            logging.debug(f'{pn} > protover 2')
+# An engine is flagged if 90% of its moves do not have less overhead than
+# this in ms, a slot if its median overhead is SLOT_OVERHEAD_FACTOR times
+# the median of all slots.
+OVERHEAD_WARN_MS = 20
+SLOT_OVERHEAD_FACTOR = 2
 
-            for eline in iter(e.stdout.readline, ''):
-                line = eline.strip()
-                logging.debug(f'{pn} < {line}')
-                if 'done=1' in line:
-                    break
+# Errors after which a game pair is played again with new engines.
+RETRY_ERRORS = (EngineError, ConnectionError, asyncio.TimeoutError, OSError)
 
-            # Set param to engines.
-            for k, v in pr['opt'].items():
-                e.stdin.write(f'option {k}={v}\n')
-                logging.debug(f'{pn} > option {k}={v}')
-
-        timer, depth_control = [], []
-        for i, pr in enumerate(eng):
-            e = pr['proc']
-            pn = pr['name']
-
-            e.stdin.write(f'variant {variant}\n')
-            logging.debug(f'{pn} > variant {variant}')
-
-            e.stdin.write('ping 1\n')
-            logging.debug(f'{pn} > ping 1')
-            for eline in iter(e.stdout.readline, ''):
-                line = eline.strip()
-                logging.debug(f'{pn} < {line}')
-                if 'pong' in line:
-                    break
 
-            e.stdin.write('new\n')
-            logging.debug(f'{pn} > new')
+class Engine:
+    def __init__(self, cfg):
+        """
+        A running engine that can play several games. cfg is the engine
+        dict from define_engine(). The engine is started by start(), the
+        protocol is implemented by XboardEngine and UciEngine.
+        """
+        self.cmd = cfg['cmd']
+        self.name = cfg['name']
+        self.key = (cfg['cmd'], cfg['name'])
+        self.options = {}  # options sent to the engine
+        # One thread and a cleared hash in every game, so that a game at a
+        # fixed depth or number of nodes is played the same every time.
+        self.deterministic = cfg.get('deterministic', False)
+        self.games = 0
+        self.failed = False
+        self.proc = None
+        self.trace = None  # Trace of the current game
+
+    async def start(self, cores=None):
+        """
+        Start the engine, it runs only on cores if given (Linux only).
+        """
+        # The cores are set in the child before the engine starts its threads.
+        preexec_fn = None if cores is None else functools.partial(os.sched_setaffinity, 0, cores)
+        self.proc = await asyncio.create_subprocess_exec(
+            self.cmd, stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            preexec_fn=preexec_fn)
+
+    def send(self, command):
+        if self.trace is not None:
+            self.trace.add(self.name, '>', command)
+        if self.proc.stdin.is_closing():
+            raise EngineError(f'{self.name} cannot receive {command}')
+        self.proc.stdin.write(f'{command}\n'.encode())
+
+    async def readline(self, timeout=None):
+        """
+        Return the next line of the engine. Raise asyncio.TimeoutError if
+        there is no line after timeout seconds.
+        """
+        line = await asyncio.wait_for(self.proc.stdout.readline(), timeout)
+        if line == b'':
+            raise EngineError(f'{self.name} has quit')
+        line = line.decode(errors='replace').strip()
+        if self.trace is not None:
+            self.trace.add(self.name, '<', line)
+        return line
+
+    async def wait_for(self, token, timeout=None):
+        while True:
+            line = await self.readline(timeout)
+            if token in line:
+                return line
+
+    def set_options(self, options):
+        """
+        Send only the options that are not yet set to these values.
+        """
+        for k, v in options.items():
+            if self.options.get(k) != v:
+                self.send(self.option_command(k, v))
+                self.options[k] = v
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def quit(self):
+        try:
+            self.send('quit')
+            await asyncio.wait_for(self.proc.wait(), 2)
+        except (EngineError, asyncio.TimeoutError, ConnectionError):
+            self.kill()
+
+    def kill(self):
+        if self.is_alive():
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+
 
-            e.stdin.write('post\n')
-            logging.debug(f'{pn} > post')
+class XboardEngine(Engine):
+    """
+    An engine that uses the xboard protocol version 2.
+    """
+    # The engine can claim the result of the game.
+    claims_result = True
 
-            # Define time control, base time in minutes and inc in seconds.
-            base_minv, base_secv, incv = get_tc(pr['tc'])
-            all_base_sec = base_minv * 60 + base_secv
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.pings = 0
+        self.searching = False
+        self.smp = False  # the engine accepts the cores command
 
-            logging.info(f'base_minv: {base_minv}m, base_secv: {base_secv}s, incv: {incv}s')
+    def start_handshake(self):
+        self.send('xboard')
+        self.send('protover 2')
 
-            # Send level command to each engine.
-            tbase = max(1, all_base_sec//60)
-            e.stdin.write(f'level 0 {tbase} {float(incv):0.2f}\n')
-            logging.debug(f'{pn} > level 0 {tbase} {float(incv):0.2f}')
+    async def end_handshake(self):
+        while True:
+            line = await self.readline()
+            if line.startswith('feature') and 'smp=1' in line:
+                self.smp = True
+            if 'done=1' in line:
+                return
 
-            # Setup Timer, convert base time to ms and inc in sec to ms
-            timer.append(Timer(all_base_sec * 1000, int(incv * 1000)))
+    def option_command(self, name, value):
+        return f'option {name}={value}'
 
-            depth_control.append(pr['depth'])
+    def new_game(self, options, variant, tc, fen):
+        """
+        Reset the engine for the new game and send the options that
+        changed since its last game.
+        """
+        self.send('new')
+        self.set_options(options)
+        if self.deterministic and self.smp:
+            self.send('cores 1')
+        if variant != 'normal':
+            self.send(f'variant {variant}')
+        self.send('post')
+        if tc[0] * 60 + tc[1] > 0:
+            self.send(get_level(*tc))
+        self.send('force')
+        if fen is not None:
+            self.send(f'setboard {fen}')
+        self.searching = False
+
+    def ping(self):
+        self.pings += 1
+        self.send(f'ping {self.pings}')
+
+    async def wait_ready(self):
+        await self.wait_for('pong')
+
+    def go(self, fen, moves, timer, otimer, white, depth, nodes=0):
+        """
+        Send the last move of the opponent and let the engine search. The
+        nodes are sent as a node rate for one second per move.
+        """
+        if depth > 0 or nodes > 0:
+            if depth > 0:
+                self.send(f'sd {depth}')
+            if nodes > 0:
+                self.send(f'nps {nodes}')
+                self.send('st 1')
+        else:
+            self.send(f'time {timer.rem_cs()}')
+            self.send(f'otim {otimer.rem_cs()}')
+        if len(moves):
+            self.send(moves[-1])
+
+        # The engine is in force mode until its first go, then it
+        # replies to every move.
+        if not self.searching:
+            self.send('go')
+            self.searching = True
+
+    def parse_info(self, line):
+        """
+        Return (depth, score, time in ms) of a search info line like:
+        10 25 120 250000 e2e4 e7e5
+        where the time is in centiseconds.
+        """
+        parts = line.split()
+        if len(parts) >= 2 and parts[0].isdigit():
+            try:
+                think = int(parts[2]) * 10 if len(parts) >= 3 and parts[2].isdigit() else None
+                return int(parts[0]), int(parts[1]), think
+            except ValueError:
+                return None
+        return None
 
-            e.stdin.write('force\n')
-            logging.debug(f'{pn} > force')
+    def parse_move(self, line):
+        if line.startswith('move '):
+            return line.split()[1]
+        return None
 
-            e.stdin.write(f'setboard {fen}\n')
-            logging.debug(f'{pn} > setboard {fen}')
 
-            e.stdin.write('ping 2\n')
-            logging.debug(f'{pn} > ping 2')
-            for eline in iter(e.stdout.readline, ''):
-                line = eline.strip()
-                logging.debug(f'{pn} < {line}')
-                if 'pong' in line:
-                    break
+class UciEngine(Engine):
+    """
+    An engine that uses the UCI protocol.
+    """
+    claims_result = False
 
-        num, side, move, line, game_end = 0, 0, None, '', False
-        score_history, elapse_history, depth_history = [], [], []
-        start_turn = turn(fen) if not isinstance(fen, int) else True
-        gres, e1score = '*', 0.0
-        is_time_over = [False, False]
-        current_color = start_turn  # True if white to move
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.engine_options = set()  # names of the options of the engine
 
-        test_engine_color = True if ((start_turn and gn % 2 == 0) or (not start_turn and gn % 2 != 0)) else False
-        termination = ''
+    def start_handshake(self):
+        self.send('uci')
 
-        # Start the game.
+    async def end_handshake(self):
         while True:
-            if depth_control[side] > 0:
-                eng[side]['proc'].stdin.write(f'sd {depth_control[side]}\n')
-                logging.debug(f'{eng[side]["name"]} > sd {depth_control[side]}')
-            else:
-                eng[side]['proc'].stdin.write(f'time {timer[side].rem_cs()}\n')
-                logging.debug(f'{eng[side]["name"]} > time {timer[side].rem_cs()}')
+            line = await self.readline()
+            if line.startswith('option name '):
+                self.engine_options.add(line[len('option name '):].split(' type ')[0].strip())
+            if 'uciok' in line:
+                return
+
+    def option_command(self, name, value):
+        return f'setoption name {name} value {value}'
+
+    def new_game(self, options, variant, tc, fen):
+        if self.deterministic and 'Threads' in self.engine_options:
+            options = {**options, 'Threads': 1}
+        self.set_options(options)
+        self.send('ucinewgame')
+        if self.deterministic and 'Clear Hash' in self.engine_options:
+            self.send('setoption name Clear Hash')
+
+    def ping(self):
+        self.send('isready')
+
+    async def wait_ready(self):
+        await self.wait_for('readyok')
+
+    def go(self, fen, moves, timer, otimer, white, depth, nodes=0):
+        """
+        Send the start position with all the moves of the game and let the
+        engine search.
+        """
+        position = 'startpos' if fen in (None, chessboard.START_FEN) else f'fen {fen}'
+        if len(moves):
+            position += ' moves ' + ' '.join(moves)
+        self.send(f'position {position}')
+
+        if depth > 0 or nodes > 0:
+            limits = f' depth {depth}' if depth > 0 else ''
+            limits += f' nodes {nodes}' if nodes > 0 else ''
+            self.send(f'go{limits}')
+        else:
+            wtimer, btimer = (timer, otimer) if white else (otimer, timer)
+            self.send(f'go wtime {max(1, wtimer.rem_time)} btime {max(1, btimer.rem_time)} '
+                      f'winc {wtimer.inc_time} binc {btimer.inc_time}')
 
-                eng[side]['proc'].stdin.write(f'otim {timer[not side].rem_cs()}\n')
-                logging.debug(f'{eng[side]["name"]} > otim {timer[not side].rem_cs()}')
+    def parse_info(self, line):
+        """
+        Return (depth, score, time in ms) of a search info line like:
+        info depth 10 score cp 25 time 120 nodes 250000 pv e2e4 e7e5
+        The score of a mate in n is MATE_SCORE - n, the time is None if
+        it is not given.
+        """
+        parts = line.split()
+        if len(parts) == 0 or parts[0] != 'info' or 'score' not in parts or 'string' in parts:
+            return None
+        try:
+            depth = int(parts[parts.index('depth') + 1]) if 'depth' in parts else 0
+            i = parts.index('score')
+            score = int(parts[i + 2])
+            if parts[i + 1] == 'mate':
+                score = MATE_SCORE - score if score > 0 else -MATE_SCORE - score
+            think = int(parts[parts.index('time') + 1]) if 'time' in parts else None
+        except (ValueError, IndexError):
+            return None
+        return depth, score, think
+
+    def parse_move(self, line):
+        if line.startswith('bestmove'):
+            parts = line.split()
+            return parts[1] if len(parts) > 1 else '(none)'
+        return None
+
+
+def new_engine(cfg):
+    if cfg.get('proto') == 'uci':
+        return UciEngine(cfg)
+    return XboardEngine(cfg)
+
+
+class EnginePool:
+    def __init__(self, max_games=100, cores=None, slot=None):
+        """
+        Engines that are kept running across games. An engine is recycled
+        after max_games games or when it fails. Engines that are not
+        playing are kept per (cmd, name) so that concurrent games of the
+        same event loop use different engines. With cores the engines
+        are pinned to these cores. slot is the number of the game slot.
+        """
+        self.max_games = max_games
+        self.cores = cores
+        self.slot = slot
+        self.idle = {}  # (cmd, name): [Engine]
 
-            t1 = time.perf_counter_ns()
+    async def get(self, cfgs):
+        """
+        Return running engines for the engine dicts in cfgs. Missing
+        engines are started, all handshakes are done at the same time.
+        """
+        engines, new = [], []
+        for cfg in cfgs:
+            e = None
+            idle = self.idle.get((cfg['cmd'], cfg['name']), [])
+            while idle and e is None:
+                e = idle.pop()
+                if not e.is_alive():
+                    logging.warning(f'{e.name} is not running, restart it')
+                    e = None
+            if e is None:
+                e = new_engine(cfg)
+                new.append(e)
+            engines.append(e)
+
+        t = time.perf_counter()
+        try:
+            await asyncio.gather(*[e.start(self.cores) for e in new])
+            for e in new:
+                e.start_handshake()
+            await asyncio.wait_for(asyncio.gather(*[e.end_handshake() for e in new]),
+                                   READY_TIMEOUT)
+        except (EngineError, ConnectionError, asyncio.TimeoutError, OSError) as ex:
+            for e in new:
+                e.kill()
+            raise EngineError(f'engines could not be started: {ex!r}')
+        if new:
+            metrics.observe('duel.engine_start', time.perf_counter() - t)
+
+        return engines
+
+    async def release(self, e):
+        """
+        Called after every game, the engine is stopped if it has played
+        max_games games or if it failed.
+        """
+        e.games += 1
+        if e.failed:
+            # It may hang, it is not asked to quit.
+            e.kill()
+        elif self.max_games and e.games >= self.max_games:
+            await e.quit()
+        else:
+            self.idle.setdefault(e.key, []).append(e)
 
-            if num == 0:
-                eng[side]['proc'].stdin.write('go\n')
-                logging.debug(f'{eng[side]["name"]} > go')
-            else:
-                move_hist.append(move)
-                eng[side]['proc'].stdin.write(f'{move}\n')
-                logging.debug(f'{eng[side]["name"]} > {move}')
+    async def close(self):
+        for engines in self.idle.values():
+            await asyncio.gather(*[e.quit() for e in engines])
+        self.idle = {}
 
-                # Send another go because of force.
-                if num == 1:
-                    eng[side]['proc'].stdin.write('go\n')
-                    logging.debug(f'{eng[side]["name"]} > go')
 
-            num += 1
-            score, depth = None, None
+# Event loop, engines and match setting of a worker process of the
+# process runner
+_worker_loop = None
+_engine_pool = None
+_match_setting = None
 
-            for eline in iter(eng[side]['proc'].stdout.readline, ''):
-                line = eline.strip()
 
-                logging.debug(f'{eng[side]["name"]} < {line}')
+def init_worker(max_games, setting, slots):
+    """
+    Called once in every worker process. setting has the round_match()
+    arguments that are the same for all openings, they are sent once to
+    the worker instead of with every job. A worker is a game slot, it
+    takes the number and the cores of its slot from the slots queue.
+    """
+    global _worker_loop, _engine_pool, _match_setting
+    _worker_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker_loop)
+    slot, cores = slots.get()
+    _engine_pool = EnginePool(max_games, cores, slot)
+    # The spans of a forked worker start empty, they are sent with every job.
+    metrics.registry.reset()
+    _match_setting = setting
+    multiprocessing.util.Finalize(_engine_pool, close_worker, exitpriority=10)
+
+
+def close_worker():
+    _worker_loop.run_until_complete(_engine_pool.close())
 
-                if is_show_search_info:
-                    if not line.startswith('#'):
-                        print(line)
 
-                # Save score and depth from engine search info.
-                if line.split()[0].isdigit():
-                    score = int(line.split()[1])  # cp
-                    depth = int(line.split()[0])
+async def play_game(eng, proc, gn, fen, variant, draw_option, resign_option,
+                    is_show_search_info=False):
+    """
+    Play one game between the engine dicts eng with the running engines
+    proc, eng[0] plays first. fen is None for the start position of the
+    variant. Return a dict with the game.
+    """
+    t_setup = time.perf_counter()
+    timer, depth_control, nodes_control, fixed = [], [], [], []
+    for pr, e in zip(eng, proc):
+        # Define time control, base time in minutes and seconds and inc in seconds.
+        base_minv, base_secv, incv = get_tc(pr['tc'])
+        all_base_sec = base_minv * 60 + base_secv
+
+        logging.info(f'base_minv: {base_minv}m, base_secv: {base_secv}s, incv: {incv}s')
+
+        e.new_game(pr['opt'], variant, (base_minv, base_secv, incv), fen)
+
+        # Setup Timer, convert base time to ms and inc in sec to ms
+        timer.append(Timer(int(all_base_sec * 1000), int(incv * 1000)))
+
+        depth_control.append(pr['depth'])
+        nodes_control.append(pr.get('nodes', 0))
+        fixed.append(is_fixed_search(pr))
+
+    # Health check of both engines, the answers are read after both
+    # are asked so that the engines get ready at the same time.
+    for e in proc:
+        e.ping()
+    await asyncio.wait_for(asyncio.gather(*[e.wait_ready() for e in proc]),
+                           READY_TIMEOUT)
+    t_play = time.perf_counter()
+    metrics.observe('duel.game_setup', t_play - t_setup)
+
+    # In standard chess the moves are played on a board, illegal moves
+    # lose and the game ends without the claim of the engines, UCI
+    # engines do not claim results.
+    board = None
+    if variant == 'normal':
+        board = chessboard.Board(fen if fen is not None else chessboard.START_FEN)
+        fen = board.fen()
+
+    num, side, move, line, game_end = 0, 0, None, '', False
+    move_hist, score_history, elapse_history, depth_history = [], [], [], []
+    latency = {pr['name']: {m: [] for m in LATENCY_METRICS} for pr in eng}
+    t_move, last_mover = None, None
+    adjudicator = Adjudicator(resign_option, draw_option)
+    played = []  # moves sent to the engines
+    start_turn = turn(fen)
+    gres, e1score = '*', 0.0
+    is_time_over = [False, False]
+    current_color = start_turn  # True if white to move
+
+    test_engine_color = True if ((start_turn and gn % 2 == 0) or (not start_turn and gn % 2 != 0)) else False
+    termination = ''
+
+    # Start the game.
+    while True:
+        e = proc[side]
+        t1 = time.perf_counter_ns()
+        if t_move is not None:
+            latency[last_mover]['harness'].append((t1 - t_move) / 1e6)
+
+        e.go(fen, played, timer[side], timer[not side], current_color,
+             depth_control[side], nodes_control[side])
+
+        num += 1
+        score, depth, move = None, None, None
+        t_first, t_info, think = None, None, None
+
+        # The move must come before the remaining time of the engine is
+        # over, there is no deadline for a depth or nodes limited search.
+        deadline = None
+        if not fixed[side]:
+            deadline = t1 + (timer[side].rem_time + MOVE_TIMEOUT_MARGIN_MS) * 1000000
 
-                # Check end of game as claimed by engines.
+        while True:
+            try:
+                timeout = None if deadline is None else max(0, deadline - time.perf_counter_ns()) / 1e9
+                line = await e.readline(timeout)
+            except asyncio.TimeoutError:
+                # The engine is still thinking, it is not reused.
+                e.failed = True
+                timer[side].update((time.perf_counter_ns() - t1) // 1000000)
+                is_time_over[current_color] = True
+                termination = 'forfeits on time'
+                logging.info(f'{e.name} did not move in time')
+                break
+
+            t_line = time.perf_counter_ns()
+            if t_first is None:
+                t_first = t_line
+
+            if is_show_search_info:
+                if not line.startswith('#'):
+                    print(line)
+
+            # Save score, depth and search time from engine search info.
+            info = e.parse_info(line)
+            if info is not None:
+                depth, score = info[0], info[1]
+                think = info[2] if info[2] is not None else think
+                t_info = t_line
+                continue
+
+            # Check end of game as claimed by engines.
+            if e.claims_result:
                 game_endr, gresr, e1scorer, termi = is_game_end(line, test_engine_color)
                 if game_endr:
                     game_end, gres, e1score, termination = game_endr, gresr, e1scorer, termi
                     break
 
-                if 'move ' in line and not line.startswith('#'):
-                    elapse = (time.perf_counter_ns() - t1) // 1000000
-                    timer[side].update(elapse)
-                    elapse_history.append(elapse)
+            move = e.parse_move(line)
+            if move is not None:
+                elapse = (time.perf_counter_ns() - t1) // 1000000
+                timer[side].update(elapse)
+                elapse_history.append(elapse)
+
+                # Time of the move that is not the search of the engine.
+                lat = latency[eng[side]['name']]
+                lat['first_output'].append((t_first - t1) / 1e6)
+                if t_info is not None:
+                    lat['move_delay'].append((t_line - t_info) / 1e6)
+                if think is not None:
+                    lat['think'].append(think)
+                    lat['overhead'].append((t_line - t1) / 1e6 - think)
+                t_move, last_mover = t_line, eng[side]['name']
+
+                score_history.append(score if score is not None else 0)
+                adjudicator.add(score_history[-1])
+                depth_history.append(depth if depth is not None else 0)
+
+                if not fixed[side] and timer[side].is_zero_time():
+                    is_time_over[current_color] = True
+                    termination = 'forfeits on time'
+                    logging.info('time is over')
+                break
 
-                    move = line.split('move ')[1]
-                    score_history.append(score if score is not None else 0)
-                    depth_history.append(depth if depth is not None else 0)
+        if game_end:
+            break
 
-                    if timer[side].is_zero_time():
-                        is_time_over[current_color] = True
-                        termination = 'forfeits on time'
-                        logging.info('time is over')
+        if move is not None and not is_time_over[current_color]:
+            if board is None:
+                move_hist.append(move)
+                played.append(move)
+            else:
+                try:
+                    m = board_move(board, move)
+                except ValueError:
+                    gres = '0-1' if current_color else '1-0'
+                    e1score = get_e1score(gres, test_engine_color)
+                    termination = f'{"white" if current_color else "black"} makes an illegal move'
+                    logging.info(f'{e.name} played the illegal move {move}')
+                    break
+                move_hist.append(board.san(m))
+                board.push(m)
+                played.append(chessboard.move_to_uci(m))
+
+                outcome = board.outcome()
+                if outcome is not None:
+                    gres, termination = outcome
+                    e1score = get_e1score(gres, test_engine_color)
                     break
 
-            if game_end:
+        # Game adjudications
+
+        # Resign
+        if (resign_option['movecount'] is not None
+                and resign_option['score'] is not None):
+            game_endr, gresr, e1scorer = adjudicator.adjudicate_win(side)
+
+            if game_endr:
+                gres, e1score = gresr, e1scorer
+                logging.info('Game ends by resign adjudication.')
                 break
 
-            # Game adjudications
+        # Draw
+        if (draw_option['movenumber'] is not None
+                and draw_option['movenumber'] is not None
+                and draw_option['score'] is not None):
+            game_endr, gresr, e1scorer = adjudicator.adjudicate_draw()
+            if game_endr:
+                gres, e1score = gresr, e1scorer
+                logging.info('Game ends by resign adjudication.')
+                break
 
-            # Resign
-            if (resign_option['movecount'] is not None
-                    and resign_option['score'] is not None):
-                game_endr, gresr, e1scorer = adjudicate_win(
-                    score_history, resign_option, side)
+        # Time is over
+        if not fixed[side]:
+            game_endr, gresr, e1scorer = time_forfeit(
+                is_time_over[current_color], current_color, test_engine_color)
+            if game_endr:
+                gres, e1score = gresr, e1scorer
+                break
 
-                if game_endr:
-                    gres, e1score = gresr, e1scorer
-                    logging.info('Game ends by resign adjudication.')
-                    break
+        side = not side
+        current_color = not current_color
 
-            # Draw
-            if (draw_option['movenumber'] is not None
-                    and draw_option['movenumber'] is not None
-                    and draw_option['score'] is not None):
-                game_endr, gresr, e1scorer = adjudicate_draw(
-                    score_history, draw_option)
-                if game_endr:
-                    gres, e1score = gresr, e1scorer
-                    logging.info('Game ends by resign adjudication.')
-                    break
+    metrics.observe('duel.play', time.perf_counter() - t_play)
 
-            # Time is over
-            if depth_control[side] == 0:
-                game_endr, gresr, e1scorer = time_forfeit(
-                    is_time_over[current_color], current_color, test_engine_color)
-                if game_endr:
-                    gres, e1score = gresr, e1scorer
-                    break
+    return {'e1score': e1score, 'gres': gres,
+            'white': eng[0]['name'] if start_turn else eng[1]['name'],
+            'black': eng[1]['name'] if start_turn else eng[0]['name'],
+            'termination': termination, 'moves': move_hist,
+            'scores': score_history, 'depths': depth_history,
+            'start_turn': start_turn, 'fen': fen, 'latency': latency}
 
-            side = not side
-            current_color = not current_color
 
-        if output_game_file is not None:
-            save_game(output_game_file, fen, move_hist, score_history,
-                      depth_history, eng[0]["name"], eng[1]["name"],
-                      start_turn, gres, termination, variant)
+async def match(e1, e2, fen, output_game_file, variant, draw_option,
+                resign_option, repeat=2, pool=None, trace_option=None,
+                game_timeout=None) -> List[dict]:
+    """
+    Run an engine match between e1 and e2. Return the result of every
+    game with the score from e1 perspective, with the pgn text of the
+    game if output_game_file is set. The games are saved by the caller.
 
-        for i, e in enumerate(eng):
-            e['proc'].stdin.write('quit\n')
-            logging.debug(f'{e["name"]} > quit')
+    trace_option is {'mode': 'errors', 'size': 1000}, the engine lines of
+    a game are written to TRACE_FILE if the game failed or ended oddly
+    (mode errors), for all games (mode all) or never (mode off).
 
-        all_e1score.append(e1score)
+    A game that is not over after game_timeout seconds raises EngineError,
+    by default the limit is from the time controls, 0 is no limit.
+    """
+    all_games = []
+    pool = pool or _engine_pool
+    trace_option = trace_option or {'mode': 'errors', 'size': TRACE_SIZE}
+    if game_timeout is None:
+        game_timeout = get_game_timeout(e1, e2)
 
-    return all_e1score
+    # Start engine match, 2 games will be played.
+    for gn in range(repeat):
+        logging.info(f'Match game no. {gn + 1}')
+        logging.info(f'Test engine plays as {"first" if gn % 2 == 0 else "second"} engine.')
 
+        # Engines are started once and reused for the next games.
+        pe1, pe2 = await pool.get([e1, e2])
 
-def round_match(fen, e1, e2, output_game_file, repeat, draw_option,
-                resign_option, variant, posround=1) -> List[float]:
+        if gn % 2 == 0:
+            eng, proc = [e1, e2], [pe1, pe2]
+        else:
+            eng, proc = [e2, e1], [pe2, pe1]
+
+        trace = None
+        if trace_option['mode'] != 'off':
+            trace = Trace(trace_option['size'])
+        for e in proc:
+            e.trace = trace
+        title = f'game {gn + 1} {eng[0]["name"]} vs {eng[1]["name"]}, fen: {fen}'
+
+        t = time.perf_counter()
+        try:
+            game = await asyncio.wait_for(
+                play_game(eng, proc, gn, fen, variant, draw_option, resign_option),
+                game_timeout or None)
+        except (EngineError, ConnectionError, asyncio.TimeoutError) as ex:
+            # Do not reuse engines that misbehaved.
+            for e in proc:
+                e.failed = True
+            if isinstance(ex, asyncio.TimeoutError):
+                ex = EngineError(f'game {gn + 1} is not over after {game_timeout}s')
+            if trace is not None:
+                trace.write(TRACE_FILE, f'{title}, error: {ex}')
+            raise ex
+        finally:
+            for e in proc:
+                e.trace = None
+                await pool.release(e)
+
+        if trace is not None and (trace_option['mode'] == 'all' or is_odd_game(game)):
+            trace.write(TRACE_FILE, f'{title}, result: {game["gres"]} {{{game["termination"]}}}')
+
+        game['slot'] = pool.slot
+        game['duration'] = round(time.perf_counter() - t, 3)
+        if output_game_file is not None:
+            game['pgn'] = format_game(game['fen'], game['moves'], game['scores'],
+                                      game['depths'], eng[0]["name"], eng[1]["name"],
+                                      game['start_turn'], game['gres'], game['termination'],
+                                      variant)
+
+        all_games.append(game)
+
+    return all_games
+
+
+async def round_match(fen, e1, e2, output_game_file, repeat, draw_option,
+                      resign_option, variant, posround=1, pool=None,
+                      trace_option=None, game_timeout=None) -> List[List[dict]]:
     """
     Play a match between e1 and e2 using fen as starting position. By default
     2 games will be played color is reversed. If posround is more than 1, the
@@ -572,13 +1215,295 @@ def round_match(fen, e1, e2, output_game_file, repeat, draw_option,
     test_engine_score = []
 
     for _ in range(posround):
-        res = match(e1, e2, fen, output_game_file, variant,
-                    draw_option, resign_option, repeat=repeat)
+        res = await match(e1, e2, fen, output_game_file, variant,
+                          draw_option, resign_option, repeat=repeat, pool=pool,
+                          trace_option=trace_option, game_timeout=game_timeout)
         test_engine_score.append(res)
 
     return test_engine_score
 
 
+async def round_match_retry(fen, setting, pool=None):
+    """
+    Play round_match() from fen with the arguments in setting. If an engine
+    fails the game pair is played again with new engines, up to
+    setting['retries'] times. Return (result, failures, error), result is
+    None if the game pair could not be played.
+    """
+    setting = dict(setting)
+    retries = setting.pop('retries', 0)
+    failures = 0
+    while True:
+        try:
+            return await round_match(fen, **setting, pool=pool), failures, ''
+        except RETRY_ERRORS as ex:
+            failures += 1
+            logging.warning(f'game pair from {fen} failed ({failures}/{retries + 1}): {ex!r}')
+            if failures > retries:
+                return None, failures, repr(ex)
+
+
+def game_summary(res):
+    """
+    Return the games of a round_match() result with the number of plies
+    instead of the moves, the pgn text is kept for the writer of the pgn
+    file.
+    """
+    return [[{**{k: g[k] for k in ('e1score', 'gres', 'white', 'black', 'termination', 'fen',
+                                   'pgn', 'latency', 'slot', 'duration') if k in g},
+              'plies': len(g['moves'])}
+             for g in games] for games in res]
+
+
+def round_match_job(job_num, fen):
+    """
+    Run round_match_retry() from fen in the event loop of a worker process.
+    Return the job number, the games without the moves, the failures, the
+    error if the games could not be played and the spans of the job.
+    """
+    res, failures, error = _worker_loop.run_until_complete(
+        round_match_retry(fen, _match_setting))
+    spans = metrics.registry.snapshot()
+    metrics.registry.reset()
+    return job_num, None if res is None else game_summary(res), failures, error, spans
+
+
+def run_process(jobs, setting, concurrency, max_games, report, core_sets=None):
+    """
+    Play all jobs with concurrency worker processes. jobs is an iterator
+    of (job number, fen), report is called with the job number, the result,
+    the failures and the error of every completed job. At most 2 jobs per
+    worker are submitted at a time, the next jobs are read as jobs complete.
+    core_sets has the cores of every worker for its engines.
+
+    If a worker process dies, the workers are started again and its job
+    is played again, up to setting['retries'] times.
+    """
+    max_pending = 2 * concurrency
+    retries = setting.get('retries', 0)
+    requeued = collections.deque()  # (job number, fen, failures)
+    pending = {}  # future: (job number, fen, failures)
+    executor = None
+
+    try:
+        while True:
+            if executor is None:
+                slot_queue = multiprocessing.Queue()
+                for slot, cores in enumerate(core_sets or [None] * concurrency, 1):
+                    slot_queue.put((slot, cores))
+
+                # Use Python 3.8 or higher
+                executor = ProcessPoolExecutor(max_workers=concurrency,
+                                               initializer=init_worker,
+                                               initargs=(max_games, setting, slot_queue))
+
+            while len(pending) < max_pending:
+                if requeued:
+                    job = requeued.popleft()
+                else:
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    job = (*job, 0)
+                pending[executor.submit(round_match_job, job[0], job[1])] = job
+
+            if not pending:
+                break
+
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            broken = False
+            for future in done:
+                job_num, fen, failures = pending.pop(future)
+                try:
+                    job_num, res, job_failures, error, spans = future.result()
+                    metrics.registry.merge(spans)
+                    report(job_num, res, failures + job_failures, error)
+                except concurrent.futures.process.BrokenProcessPool as ex:
+                    broken = True
+                    failures += 1
+                    logging.warning(f'worker of game pair from {fen} died ({failures}/{retries + 1})')
+                    if failures > retries:
+                        report(job_num, None, failures, repr(ex))
+                    else:
+                        requeued.append((job_num, fen, failures))
+
+            if broken:
+                # The other running jobs are lost with the workers, they
+                # are played again without counting a failure.
+                requeued.extend(pending.values())
+                pending = {}
+                executor.shutdown(wait=False)
+                executor = None
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+async def run_async(jobs, setting, concurrency, max_games, report, core_sets=None):
+    """
+    Play all jobs in this process with concurrency games at the same time.
+    jobs is an iterator of (job number, fen), report is called with the
+    job number, the result, the failures and the error of every completed
+    job. Every game slot reads its next job when its game is over, it has
+    its own engines that run on its cores from core_sets.
+    """
+    core_sets = core_sets or [None] * concurrency
+    pools = [EnginePool(max_games, cores, slot) for slot, cores in enumerate(core_sets, 1)]
+
+    async def run(pool):
+        for job_num, fen in jobs:
+            res, failures, error = await round_match_retry(fen, setting, pool)
+            report(job_num, None if res is None else game_summary(res), failures, error)
+
+    try:
+        await asyncio.gather(*[run(pool) for pool in pools])
+    finally:
+        for pool in pools:
+            await pool.close()
+
+
+def get_slot_cores(affinity, reserve_cores, concurrency, e1, e2):
+    """
+    Return the cores of every game slot or None if the engines are not
+    pinned. affinity is auto or a list of cores like 2-7,10.
+    """
+    if affinity is None or affinity == 'off':
+        return None
+    if not hasattr(os, 'sched_setaffinity'):
+        logging.warning('affinity is only supported on Linux, the engines are not pinned')
+        return None
+
+    if affinity == 'auto':
+        cores = resources.get_affinity_cores(reserve_cores)
+    else:
+        cores = resources.parse_cores(affinity)
+        missing = set(cores) - os.sched_getaffinity(0)
+        if missing:
+            raise ValueError(f'cores {resources.format_cores(missing)} of -affinity are not available')
+
+    threads = max(int(e1['opt'].get('Threads', 1)), int(e2['opt'].get('Threads', 1)))
+    if concurrency * threads > len(cores):
+        logging.warning(f'{concurrency} slots of {threads} cores do not fit in cores '
+                        f'{resources.format_cores(cores)}, slots share their cores')
+
+    return resources.get_core_sets(cores, concurrency, threads)
+
+
+def percentile(values, p):
+    """
+    Return the p percentile of values, the nearest rank.
+    """
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+
+
+class LatencyMeter:
+    def __init__(self, warn_ms=OVERHEAD_WARN_MS):
+        """
+        Latencies of the moves in ms per engine and per game slot:
+        think: search time reported by the engine
+        overhead: time of the move less the reported search time
+        first_output: from the position sent to the first line of the engine
+        move_delay: from the last search info to the move
+        harness: from the move to the next position sent, time of duel.py
+        """
+        self.warn_ms = warn_ms
+        self.engines = {}  # name: {metric: [ms]}
+        self.slots = {}  # slot: [overhead ms]
+
+    def add_game(self, game):
+        for name, latency in game.get('latency', {}).items():
+            engine = self.engines.setdefault(name, {m: [] for m in LATENCY_METRICS})
+            for m, values in latency.items():
+                engine[m].extend(values)
+            self.slots.setdefault(game.get('slot'), []).extend(latency['overhead'])
+
+    def summary(self):
+        """
+        Return the p50, p90, p99 and max of every metric of every engine.
+        """
+        res = {}
+        for name, engine in self.engines.items():
+            res[name] = {m: {'moves': len(v), 'p50': round(percentile(v, 50), 3),
+                             'p90': round(percentile(v, 90), 3), 'p99': round(percentile(v, 99), 3),
+                             'max': round(max(v), 3)}
+                         for m, v in engine.items() if len(v)}
+        return res
+
+    def warnings(self):
+        """
+        Return the engines and slots with abnormal overhead.
+        """
+        res = []
+        for name, engine in self.engines.items():
+            if len(engine['overhead']) and percentile(engine['overhead'], 90) > self.warn_ms:
+                res.append(f'engine {name}: 90% of the moves have more than {self.warn_ms}ms overhead, '
+                           f'p90 {percentile(engine["overhead"], 90):0.1f}ms')
+
+        medians = {slot: percentile(v, 50) for slot, v in self.slots.items() if len(v)}
+        if len(medians) > 1:
+            median = percentile(list(medians.values()), 50)
+            for slot, m in sorted(medians.items(), key=lambda x: str(x[0])):
+                if m > SLOT_OVERHEAD_FACTOR * median and m > 1:
+                    res.append(f'slot {slot}: median overhead {m:0.1f}ms, all slots {median:0.1f}ms')
+        return res
+
+
+class MatchScore:
+    def __init__(self):
+        """
+        Running score of the test engine, updated with constant work per game.
+        """
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.failures = 0  # failed games and workers, their game pairs are played again
+        self.lost_pairs = 0  # game pairs that failed after all retries
+
+    def add(self, e1score):
+        if e1score == 1.0:
+            self.wins += 1
+        elif e1score == 0.5:
+            self.draws += 1
+        else:
+            self.losses += 1
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    @property
+    def perf(self):
+        return (self.wins + 0.5 * self.draws) / self.games if self.games else 0.0
+
+
+def print_latency(meter, jsonl=False):
+    """
+    Print the latencies of the moves of every engine and the engines and
+    slots with abnormal overhead.
+    """
+    summary, warnings = meter.summary(), meter.warnings()
+    for w in warnings:
+        logging.warning(f'overhead: {w}')
+    logging.info(f'latency: {summary}')
+
+    if jsonl:
+        print(json.dumps({'type': 'latency', 'engines': summary, 'warnings': warnings}))
+        return
+
+    if not summary:
+        return
+    print(f'{"Latency (ms)":28s} {"moves":>7s} {"p50":>8s} {"p90":>8s} {"p99":>8s} {"max":>8s}')
+    for name, engine in summary.items():
+        for m, v in engine.items():
+            print(f'{name + " " + m:28s} {v["moves"]:7d} {v["p50"]:8.1f} {v["p90"]:8.1f} '
+                  f'{v["p99"]:8.1f} {v["max"]:8.1f}')
+    for w in warnings:
+        print(f'Warning: {w}')
+
+
 def main():
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawTextHelpFormatter)
@@ -605,23 +1530,81 @@ def main():
                         metavar=('movecount=', 'score='),
                         help='Adjudicates game to a loss result. Example:\n'
                              '-resign movecount=10 score=900')
-    parser.add_argument('-pgnout', required=False,
+    parser.add_argument('-pgnout', nargs='+', required=False,
                         metavar='pgn_output_filename',
-                        help='pgn output filename')
+                        help='pgn output filename, other values like fi are ignored.\n'
+                             'The games are written by this process only, with a\n'
+                             '.gz or .zst filename the games are compressed.')
     parser.add_argument('-concurrency', required=False,
                         help='number of game to run in parallel, default=1',
                         type=int, default=1)
-    parser.add_argument('-variant', required=True, help='name of the variant')
+    parser.add_argument('-games', required=False,
+                        help='number of games per encounter, default=1',
+                        type=int, default=1)
+    parser.add_argument('-variant', required=False, default='normal',
+                        help='name of the variant, default=normal')
+    parser.add_argument('-overhead-warn', required=False, type=float, default=OVERHEAD_WARN_MS,
+                        help='flag engines with more overhead per move in ms than this for\n'
+                             f'10%% of their moves, default={OVERHEAD_WARN_MS}')
+    parser.add_argument('-deterministic', action='store_true',
+                        help='play every game with one engine thread and a cleared hash,\n'
+                             'the engines must search to a fixed depth or number of nodes')
+    parser.add_argument('-cache', required=False, default=None,
+                        help='sqlite file of the game pairs of deterministic matches, a game\n'
+                             'pair that was already played is read from it. Implies -deterministic')
+    parser.add_argument('-affinity', required=False, default=None,
+                        help='pin the engines of every game slot to their own cores (Linux).\n'
+                             'auto: the cores of this process less -reserve-cores,\n'
+                             'or a list of cores like 2-7,10. A slot gets as many cores\n'
+                             'as the Threads option of the engines.')
+    parser.add_argument('-reserve-cores', required=False, type=int, default=1,
+                        help='cores left for the optimizer and the system with -affinity auto,\n'
+                             'default=1')
     parser.add_argument('-each', nargs='*', action='append', required=False,
                         metavar=('tc=', 'option.<option_name>='),
                         help='This option is used to apply to both engnes.\n'
-                             'Example where tc is applied to each engine:\n'
-                             '-each tc=1+0.1')
+                             'tc, depth, nodes, proto and option.<option_name> are supported.\n'
+                             'Example where tc in seconds is applied to each engine:\n'
+                             '-each tc=0/60+0.1 proto=uci')
     parser.add_argument('-openings', nargs='*', action='append',
                         required=False,
                         metavar=('file=', 'format='),
                         help='Define start openings. Example:\n'
-                             '-openings file=start.fen format=epd')
+                             '-openings file=start.fen format=epd\n'
+                             '-openings file=start.pgn format=pgn order=random plies=8 start=1')
+    parser.add_argument('-srand', required=False, type=int, default=None,
+                        help='random seed for the order of openings, default=None\n'
+                             'Matches with the same seed play the same openings.')
+    parser.add_argument('-recycle', required=False, type=int, default=100,
+                        help='number of games after which an engine is restarted,\n'
+                             '0 to never restart a running engine, default=100')
+    parser.add_argument('-runner', required=False, default='async',
+                        choices=['async', 'process'],
+                        help='async: all games are driven by one event loop in this process\n'
+                             'process: every concurrent game has its own worker process\n'
+                             'default=async')
+    parser.add_argument('-game-timeout', required=False, type=float, default=None,
+                        help='wall-clock limit of a game in seconds, 0 for no limit.\n'
+                             f'default: the time of both engines for {GAME_TIMEOUT_MOVES} moves '
+                             f'+ {GAME_TIMEOUT_MARGIN}s,\n'
+                             f'{DEPTH_GAME_TIMEOUT}s for games at a fixed depth')
+    parser.add_argument('-retries', required=False, type=int, default=2,
+                        help='number of times a game pair is played again with new engines\n'
+                             'after an engine crashed, hung or a worker died, default=2')
+    parser.add_argument('-trace', required=False, default='errors',
+                        choices=['off', 'errors', 'all'],
+                        help='the last lines sent to and received from the engines in a game\n'
+                             'are kept in memory and written to log_duel_trace.txt\n'
+                             'errors: for games with an engine error, time forfeit or illegal move\n'
+                             'all: for all games, off: nothing is kept, default=errors')
+    parser.add_argument('-trace-size', required=False, type=int, default=TRACE_SIZE,
+                        help=f'number of engine lines kept per game, default={TRACE_SIZE}')
+    parser.add_argument('-jsonl', action='store_true',
+                        help='print the game and score lines as json, one object per line:\n'
+                             '{"type": "game", "game": 1, "white": "test", "black": "base",\n'
+                             ' "result": "1-0", "termination": "white mates black", "score": 1.0}\n'
+                             '{"type": "score", "name": "test", "opponent": "base",\n'
+                             ' "wins": 1, "losses": 0, "draws": 0, "score": 1.0, "games": 1}')
     parser.add_argument('-tournament', required=False, default='round-robin',
                         metavar='tour_type',
                         help='tournament type, default=round-robin')
@@ -641,89 +1624,217 @@ def main():
         for opt in args.each:
             for value in opt:
                 key = value.split('=')[0]
-                val = value.split('=')[1].strip()
+                val = value.split('=', 1)[1].strip()
                 each_engine_option.update({key: val})
 
-    # Update tc of e1/e2 from each.
-    if e1['tc'] == '' or e2['tc'] == '':
-        if 'tc' in each_engine_option:
-            for key, val in each_engine_option.items():
-                if key == 'tc':
-                    e1.update({key: val})
-                    e2.update({key: val})
-                    break
-
-    # Update depth of e1/e2 from each.
-    if e1['depth'] == 0 or e2['depth'] == 0:
-        if 'depth' in each_engine_option:
-            for key, val in each_engine_option.items():
-                if key == 'depth':
-                    e1.update({key: int(val)})
-                    e2.update({key: int(val)})
-                    break
-
-    # Exit if there are no tc or depth.
-    if e1['tc'] == '' or e2['tc'] == '':
-        if e1['depth'] == 0 or e2['depth'] == 0:
-            raise Exception('Error! tc or depth are not defined.')
+    # Update tc, depth, proto and options of e1/e2 from each, the values
+    # of an engine are not changed.
+    for e in [e1, e2]:
+        for key, val in each_engine_option.items():
+            if key == 'tc' and e['tc'] == '':
+                e.update({key: val})
+            elif key == 'depth' and e['depth'] == 0:
+                e.update({key: int(val)})
+            elif key == 'nodes' and e['nodes'] == 0:
+                e.update({key: int(val)})
+            elif key == 'proto' and e['proto'] is None:
+                e.update({key: val})
+            elif key.startswith('option.'):
+                e['opt'].setdefault(key.split('option.')[1], option_value(val))
+        if e['proto'] is None:
+            e.update({'proto': 'xboard'})
+
+    # Exit if there are no tc, depth or nodes.
+    for e in [e1, e2]:
+        if e['tc'] == '' and not is_fixed_search(e):
+            raise Exception('Error! tc, depth or nodes are not defined.')
+
+    deterministic = args.deterministic or args.cache is not None
+    if deterministic:
+        if not is_fixed_search(e1) or not is_fixed_search(e2):
+            raise Exception('Error! -deterministic and -cache require depth or nodes for both engines.')
+        for e in [e1, e2]:
+            e['deterministic'] = True
 
     # Start opening file
-    fen_file = None
+    fen_file, opening_option = None, {'format': 'epd', 'order': 'random', 'plies': 10000, 'start': 1}
     if args.openings is not None:
         for opt in args.openings:
             for value in opt:
-                if 'file=' in value:
-                    fen_file = value.split('=')[1]
+                key, val = value.split('=', 1)
+                if key == 'file':
+                    fen_file = val
+                else:
+                    opening_option.update({key: option_value(val)})
 
+    # Values like twosided=true are kept as string.
     draw_option = {'movenumber': None, 'movecount': None, 'score': None}
     if args.draw is not None:
         for opt in args.draw[0]:
             key = opt.split('=')[0]
-            val = int(opt.split('=')[1])
+            val = option_value(opt.split('=')[1])
             draw_option.update({key: val})
 
     resign_option = {'movecount': None, 'score': None}
     if args.resign is not None:
         for opt in args.resign[0]:
             key = opt.split('=')[0]
-            val = int(opt.split('=')[1])
+            val = option_value(opt.split('=')[1])
             resign_option.update({key: val})
 
-    is_random_startpos = True
+    is_random_startpos = opening_option['order'] == 'random'
+    if args.srand is not None:
+        random.seed(args.srand)
     posround = 1  # Number of times the same position is played
 
-    fens = get_fen_list(fen_file, is_random_startpos)
-
-    output_game_file = args.pgnout
+    output_game_file = None if args.pgnout is None else args.pgnout[0]
 
     # Start match
-    joblist = []
-    test_engine_score_list = []
-    total_games = max(1, args.rounds // args.repeat)
-
-    # Use Python 3.8 or higher
-    with ProcessPoolExecutor(max_workers=args.concurrency) as executor:
-        for i, fen in enumerate(fens if len(fens) else range(1000)):
-            if i >= total_games:
-                break
-            job = executor.submit(round_match, fen, e1, e2,
-                                  output_game_file, args.repeat,
-                                  draw_option, resign_option, args.variant,
-                                  posround)
-            joblist.append(job)
+    match_score = MatchScore()
+    total_games = max(1, args.rounds * args.games // args.repeat)
+
+    # Read only the positions needed from a compiled opening index.
+    with metrics.span('duel.opening_load'):
+        if fen_file is not None and opening_book.is_index(fen_file):
+            with opening_book.OpeningIndex(fen_file) as book:
+                fens = book.sample(total_games, seed=args.srand)
+        else:
+            fens = get_fen_list(fen_file, is_random_startpos, opening_option['format'],
+                                opening_option['plies'], opening_option['start'])
+
+    # The openings are played again if there are less openings than
+    # games, None is the start position of the variant. The jobs are
+    # created when the runner is ready for them.
+    jobs = ((i, fens[i % len(fens)] if len(fens) else None) for i in range(total_games))
+    setting = {'e1': e1, 'e2': e2, 'output_game_file': output_game_file,
+               'repeat': args.repeat, 'draw_option': draw_option,
+               'resign_option': resign_option, 'variant': args.variant,
+               'posround': posround,
+               'trace_option': {'mode': args.trace, 'size': args.trace_size},
+               'game_timeout': args.game_timeout, 'retries': args.retries}
+
+    # Game pairs that are in the cache are reported without playing them,
+    # the others are saved in the cache when they are reported.
+    # The key needs the engine files, without them nothing is cached.
+    cache = None
+    if args.cache is not None:
+        unknown = [e['cmd'] for e in (e1, e2) if game_cache.engine_file_hash(e['cmd']) is None]
+        if unknown:
+            logging.warning(f'engine file of {", ".join(unknown)} not found, the games are not cached')
+        else:
+            cache = game_cache.GameCache(args.cache)
+    cache_keys, cache_stats = {}, {'hits': 0, 'misses': 0}
+
+    def cached_jobs(jobs):
+        for job_num, fen in jobs:
+            key = game_cache.pair_key(fen, setting)
+            res = cache.get(key)
+            # Games cached without pgn are played again for the pgn file.
+            if res is not None and (output_game_file is None
+                                    or all('pgn' in g for games in res for g in games)):
+                cache_stats['hits'] += 1
+                report(job_num, res)
+                continue
+            cache_stats['misses'] += 1
+            cache_keys[job_num] = key
+            yield job_num, fen
+
+    if cache is not None:
+        jobs = cached_jobs(jobs)
+
+    latency_meter = LatencyMeter(args.overhead_warn)
+
+    def report(job_num, res, failures=0, error=''):
+        if res is not None and job_num in cache_keys:
+            # The latencies are of this run only.
+            cache.put(cache_keys.pop(job_num),
+                      [[{k: v for k, v in g.items() if k not in ('latency', 'slot', 'duration')} for g in games]
+                       for games in res])
+        match_score.failures += failures
+        if res is None:
+            match_score.lost_pairs += 1
+            if args.jsonl:
+                print(json.dumps({'type': 'error', 'pair': job_num + 1,
+                                  'failures': failures, 'error': error}))
+            else:
+                print(f'Game pair {job_num + 1} failed {failures} times: {error}')
+            return
+
+        games = res[0]
+        # Games from the same opening get consecutive numbers so
+        # that the caller can pair them.
+        first_num = job_num * args.repeat + 1
+        for num, g in enumerate(games, first_num):
+            match_score.add(g['e1score'])
+            latency_meter.add_game(g)
+            if pgn_writer is not None:
+                pgn_writer.put(g['pgn'])
+            if args.jsonl:
+                print(json.dumps({'type': 'game', 'game': num, 'white': g['white'],
+                                  'black': g['black'], 'result': g['gres'],
+                                  'termination': g['termination'], 'score': g['e1score'],
+                                  'fen': g.get('fen'), 'plies': g.get('plies'),
+                                  'duration': g.get('duration')}))
+            else:
+                print(f'Finished game {num} ({g["white"]} vs {g["black"]}): '
+                      f'{g["gres"]} {{{g["termination"]}}}')
+        if args.jsonl:
+            print(json.dumps({'type': 'score', 'name': e1['name'], 'opponent': e2['name'],
+                              'wins': match_score.wins, 'losses': match_score.losses,
+                              'draws': match_score.draws, 'score': match_score.perf,
+                              'games': match_score.games, 'failures': match_score.failures,
+                              'lost_pairs': match_score.lost_pairs}))
+        else:
+            print(f'Score of {e1["name"]} vs {e2["name"]}: '
+                  f'{match_score.wins} - {match_score.losses} - {match_score.draws} '
+                  f'[{match_score.perf:0.3f}] {match_score.games}')
+
+    # The games of all workers are written by one thread of this process.
+    pgn_writer = None
+    if output_game_file is not None:
+        pgn_writer = pgn_sink.PgnSink(output_game_file, index=False)
+
+    core_sets = get_slot_cores(args.affinity, args.reserve_cores, args.concurrency, e1, e2)
+    if core_sets is not None:
+        for slot, cores in enumerate(core_sets, 1):
+            logging.info(f'slot {slot}: cores {resources.format_cores(cores)}')
+            if args.jsonl:
+                print(json.dumps({'type': 'affinity', 'slot': slot, 'cores': cores}))
+            else:
+                print(f'Slot {slot}: cores {resources.format_cores(cores)}')
+
+    metrics.observe('duel.startup', time.perf_counter() - START_TIME)
+    try:
+        if args.runner == 'async':
+            # All games in this process, the engines are driven by one event loop.
+            asyncio.run(run_async(jobs, setting, args.concurrency, args.recycle, report,
+                                  core_sets))
+        else:
+            run_process(jobs, setting, args.concurrency, args.recycle, report, core_sets)
+    finally:
+        if pgn_writer is not None:
+            pgn_writer.close()
+        if cache is not None:
+            cache.close()
+
+    if cache is not None:
+        logging.info(f'cache {args.cache}: {cache_stats["hits"]} hits, {cache_stats["misses"]} misses')
+        if args.jsonl:
+            print(json.dumps({'type': 'cache', **cache_stats}))
+        else:
+            print(f'Cache: {cache_stats["hits"]} hits, {cache_stats["misses"]} misses')
 
-        for future in concurrent.futures.as_completed(joblist):
-            try:
-                test_engine_score = future.result()[0]
-                for s in test_engine_score:
-                    test_engine_score_list.append(s)
-                perf = mean(test_engine_score_list)
-                games = len(test_engine_score_list)
-                print(f'Score of {e1["name"]} vs {e2["name"]}: [{perf}] {games}')
-            except concurrent.futures.process.BrokenProcessPool as ex:
-                print(f'exception: {ex}')
-
-    logging.info(f'final test score: {mean(test_engine_score_list)}')
+    logging.info(f'final test score: {match_score.perf}, failures: {match_score.failures}, '
+                 f'lost game pairs: {match_score.lost_pairs}')
+
+    print_latency(latency_meter, args.jsonl)
+
+    # The spans of the games of all workers, read by chess_match.py.
+    metrics.observe('duel.total', time.perf_counter() - START_TIME)
+    if args.jsonl:
+        print(json.dumps({'type': 'metrics', 'spans': metrics.registry.snapshot()}))
+    if match_score.failures and not args.jsonl:
+        print(f'Failures: {match_score.failures}, lost game pairs: {match_score.lost_pairs}')
     print('Finished match')
 
 
@@ -0,0 +1,106 @@
+"""
+events.py
+
+Structured log events of the optimizer. An event has a name and fields and
+is formatted only when a handler writes it, so an event below the level of
+the log costs a level check even with hundreds of parameters:
+
+  events.debug(__file__, 'theta with limits', theta=theta)
+
+In the text log an event is the line
+  /path/spsa.py > theta with limits: theta: {'QueenValueOp': 0.81, ...}
+where the parameter dicts are written with their values only. With
+use_jsonl() the log is a json line per event with its fields:
+  {"time": 1700000000.1, "level": "DEBUG", "source": "/path/spsa.py",
+   "event": "theta with limits", "theta": {"QueenValueOp": 0.81, ...}}
+"""
+
+
+import json
+import logging
+
+
+LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING}
+
+
+def compact(value):
+    """
+    Return value with the parameter dicts like {'QueenValueOp': {'value':
+    0.81, 'min': ...}} reduced to their values {'QueenValueOp': 0.81}.
+    """
+    if isinstance(value, dict) and value and all(isinstance(v, dict) and 'value' in v
+                                                 for v in value.values()):
+        return {n: v['value'] for n, v in value.items()}
+    return value
+
+
+class Event:
+    def __init__(self, source, name, fields):
+        self.source = source
+        self.name = name
+        self.fields = fields
+
+    def __str__(self):
+        text = ', '.join(f'{k}: {compact(v)}' for k, v in self.fields.items())
+        return f'{self.source} > {self.name}: {text}' if text else f'{self.source} > {self.name}'
+
+
+def log(level, source, name, **fields):
+    logger = logging.getLogger()
+    if logger.isEnabledFor(level):
+        logger.log(level, Event(source, name, fields))
+
+
+def debug(source, name, **fields):
+    log(logging.DEBUG, source, name, **fields)
+
+
+def info(source, name, **fields):
+    log(logging.INFO, source, name, **fields)
+
+
+class JsonlHandler(logging.Handler):
+    def __init__(self, fn):
+        """
+        Append the log records to fn as json lines, the events with their
+        fields and the other records with their message.
+        """
+        super().__init__()
+        self.f = open(fn, 'a')
+
+    def emit(self, record):
+        try:
+            line = {'time': round(record.created, 3), 'level': record.levelname}
+            if isinstance(record.msg, Event):
+                line.update({'source': record.msg.source, 'event': record.msg.name})
+                line.update({k: compact(v) for k, v in record.msg.fields.items()})
+            else:
+                line['message'] = record.getMessage()
+            if record.exc_info:
+                line['exception'] = logging.Formatter().formatException(record.exc_info)
+            self.f.write(json.dumps(line, separators=(',', ':'), default=str) + '\n')
+            self.f.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def set_level(level):
+    """
+    Log the records of level, debug, info or warning, and above.
+    """
+    logging.getLogger().setLevel(LEVELS[level])
+
+
+def use_jsonl(fn):
+    """
+    Write the log to fn as json lines instead of the text log.
+    """
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.addHandler(JsonlHandler(fn))
@@ -0,0 +1,122 @@
+"""
+game_cache.py
+
+A persistent cache of the game pairs of deterministic matches. When both
+engines search to a fixed depth or number of nodes with one thread and a
+cleared hash, a game pair from an opening is the same every time it is
+played with the same engine files, options, parameters and limits. Such a
+game pair is read from the cache instead of being played again.
+
+The cache is an sqlite file with one row per game pair, the key is the
+sha256 of the engine files, options, limits, opening, colors and
+adjudication rules.
+"""
+
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from functools import lru_cache
+
+
+# Changed when the games of older versions should not be reused.
+CACHE_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def _file_hash(fn, mtime_ns, size):
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def file_hash(fn):
+    """
+    Return the sha256 of a file, it is read again only if it changed.
+    """
+    st = os.stat(fn)
+    return _file_hash(os.path.abspath(fn), st.st_mtime_ns, st.st_size)
+
+
+def engine_file_hash(cmd):
+    """
+    Return the sha256 of the engine file of cmd, a file or a program on
+    the PATH like duel.py starts it, or None if the file is not found.
+    The games of such an engine cannot be cached.
+    """
+    fn = cmd if os.path.isfile(cmd) else shutil.which(cmd)
+    if fn is None:
+        return None
+    return file_hash(fn)
+
+
+def option_key(value):
+    """
+    Return the value of an engine option in the key, an option with a
+    file like a parameter file is replaced by the sha256 of the file.
+    """
+    if isinstance(value, str) and os.path.isfile(value):
+        return f'sha256:{file_hash(value)}'
+    return value
+
+
+def engine_key(e):
+    """
+    Return the part of the key of the engine dict e from define_engine().
+    """
+    return {'file': engine_file_hash(e['cmd']), 'name': e['name'], 'proto': e['proto'],
+            'depth': e['depth'], 'nodes': e.get('nodes', 0),
+            'options': {k: option_key(v) for k, v in e['opt'].items()}}
+
+
+def pair_key(fen, setting):
+    """
+    Return the key of the game pair from fen with the round_match()
+    arguments in setting. The first engine is e1 in the first game and
+    the colors are reversed in the next games.
+    """
+    key = {'version': CACHE_VERSION, 'fen': fen,
+           'e1': engine_key(setting['e1']), 'e2': engine_key(setting['e2']),
+           'repeat': setting['repeat'], 'posround': setting['posround'],
+           'variant': setting['variant'], 'draw_option': setting['draw_option'],
+           'resign_option': setting['resign_option']}
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class GameCache:
+    def __init__(self, fn):
+        """
+        Open or create the cache file fn. Matches run in parallel can
+        share the file, sqlite locks it while a game pair is written.
+        """
+        self.fn = fn
+        self.conn = sqlite3.connect(fn, timeout=60)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS games '
+                          '(key TEXT PRIMARY KEY, games TEXT NOT NULL, created REAL NOT NULL)')
+        self.conn.commit()
+
+    def get(self, key):
+        """
+        Return the games of the key or None if they are not cached.
+        """
+        row = self.conn.execute('SELECT games FROM games WHERE key = ?', (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, key, games):
+        self.conn.execute('INSERT OR REPLACE INTO games (key, games, created) VALUES (?, ?, ?)',
+                          (key, json.dumps(games), time.time()))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
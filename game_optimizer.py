@@ -11,15 +11,28 @@ see the function set_parameters_from_string() in the example section.
 """
 
 from subprocess import Popen, PIPE
+import os
+import sys
+import time
 import random
 import argparse
 import copy
+import json
+import math
 import logging
 from pathlib import Path
 import yaml
 
 import spsa
 import utils
+import opening_book
+import pgn_sink
+import resources
+import metrics
+import control
+import distributed
+import calibration
+import events
 
 
 APP_NAME = 'Python SPSA Parameter Optimizer'
@@ -46,12 +59,75 @@ class game_optimizer:
 
         self.fcp = ''  # First or test engine setting
         self.scp = ''  # Second or base engine setting
+
+        # Engine options that read a parameter file. If not set every
+        # parameter is sent to the engine as an option.
+        self.test_param_option = None
+        self.base_param_option = None
+
+        # Engine options like Threads and Hash, used to admit concurrent games.
+        self.test_engine_option = {}
+        self.base_engine_option = {}
         self.param = ''  # Parameters to optimize
 
         self.tour_manager = ''
         self.tour_manager_options = ''
         self.tour_manager_eng_options = ''
 
+        # Options of the next match that can be changed by the minimizer
+        # between iterations, like the number of rounds.
+        self.match_option = {'rounds': 4, 'concurrency': 1}
+        self.repeat = 1
+        self.parallel_matches = 2
+
+        # Cores of every parallel match when the engines are pinned to
+        # cores, set from the machine section.
+        self.match_cores = None
+
+        # Openings sampled from a compiled opening index, every match gets
+        # only the positions it will play in opening_subset_file.
+        self.opening_index = None
+        self.opening_subset_file = 'match_openings.epd'
+
+        # Every match writes its games in its own file, the games are moved
+        # to the pgn file by a single writer after every accepted pair of
+        # matches.
+        # The writer stays in the parent process, see __getstate__().
+        self.save_games = False
+        self.pgn_writer = None
+        self.pid = os.getpid()  # the files of the matches of this optimizer
+        self.pgn_option = ''
+        self.iteration = None
+
+        # The match script and its options, run by the engine command or
+        # by the workers of the coordinator at address host:port if set.
+        # The matches are split in jobs of chunk_rounds games.
+        self.match_script = 'chess_match.py'
+        self.coordinator = None
+        self.coordinator_token = None
+        self.chunk_rounds = None
+
+        # The time control of the matches is scaled to the speed of the
+        # machine, the workers measure their own speed.
+        self.calibration = None
+
+    def get_setting(self):
+        """
+        Return the content of the setting file as a dict.
+        """
+        with open(self.setting_file) as f:
+            return yaml.safe_load(f)
+
+    def __getstate__(self):
+        """
+        The optimizer is sent to the match processes with goal_function(),
+        the pgn writer with its thread and queue is not. The games are
+        collected by the parent only.
+        """
+        state = self.__dict__.copy()
+        state['pgn_writer'] = None
+        return state
+
     def set_engine_command(self, command):
         """
         Set the name of the command used to run a minimatch against the
@@ -64,59 +140,163 @@ class game_optimizer:
         # Store the command name
         self.ENGINE_COMMAND = command
 
-    def launch_engine(self, base_theta, theta):
+    def set_match_option(self, **kwargs):
         """
-        Launch the match of the engine with parameters theta
+        Update the options of the next engine matches. This is called by the
+        minimizer before the matches of an iteration are started, and with
+        accepted after the 2 matches of a gradient.
+        """
+        # The games of the 2 matches are saved if both matches are used.
+        if 'accepted' in kwargs:
+            self.collect_games(kwargs.pop('accepted'))
+
+        self.match_option.update(kwargs)
+
+        if 'iteration' in kwargs:
+            self.iteration = kwargs['iteration']
+            if self.calibration is not None and self.coordinator is None:
+                self.calibration.refresh()
+
+        # Both matches of a gradient get the same seed, the openings are
+        # written once here before the matches are started.
+        if 'seed' in kwargs and self.opening_index is not None:
+            count = -(-self.match_option['rounds'] // self.repeat)
+            with opening_book.OpeningIndex(self.opening_index) as book:
+                epds = book.sample(count, seed=kwargs['seed'])
+            opening_book.write_epd(epds, self.opening_subset_file)
+
+    def match_job(self, base_theta, theta, num=0):
+        """
+        Return the match of the engine with parameters theta as a job of
+        match_arguments(), num is the number of the match in the iteration.
         """
 
-        # Each match will be started with a different seed,
-        # passed as a command line parameter
-        seed = random.randint(1, 100000000)  # a random seed
-
-        # Create the command line and the list of parameters
-        command = f'{self.ENGINE_COMMAND}'
-
-        if Path(self.tour_manager).suffix == '.exe':
-            args = f'--seed {seed} '
-        else:
-            args = ''
+        # The two matches of a gradient share the seed set by the minimizer
+        # so that they play the same openings with the same colors. The seed
+        # is passed as a command line parameter.
+        seed = self.match_option.get('seed')
+        if seed is None:
+            seed = random.randint(1, 100000000)  # a random seed
+
+        job = {'script': self.match_script, 'seed': seed, 'fcp': self.fcp, 'scp': self.scp,
+               'tour_manager': self.tour_manager, 'tour_manager_options': self.tour_manager_options,
+               'rounds': self.match_option['rounds'], 'concurrency': self.match_option['concurrency'],
+               'engine_options': self.tour_manager_eng_options,
+               'pgn': self.save_games, 'pgn_option': self.pgn_option,
+               'test_param': {name: value['value'] for name, value in theta.items()},
+               'base_param': {name: value['value'] for name, value in base_theta.items()},
+               'test_param_option': self.test_param_option,
+               'base_param_option': self.base_param_option,
+               'affinity': None, 'openings': None, 'tc_factor': None, 'calibration': None}
+        if self.match_cores is not None:
+            job['affinity'] = resources.format_cores(self.match_cores[num % len(self.match_cores)])
+        if self.calibration is not None:
+            job['tc_factor'] = self.calibration.factor()
+            job['calibration'] = self.calibration.job_setting()
+        return job
+
+    def launch_engine(self, base_theta, theta, num=0):
+        """
+        Launch the match of the engine with parameters theta, num is the
+        number of the match in the iteration.
+        """
+        job = self.match_job(base_theta, theta, num)
+        if self.coordinator is not None:
+            return self.launch_remote(job, num)
+
+        # Spans of this match, the spans of the match script are added.
+        match_metrics = metrics.Metrics()
+
+        # The parameters are written once per match in a file, the matches
+        # run in parallel have their own files.
+        with match_metrics.span('optimizer.param_files'):
+            test_param_file = write_param_file(theta, f'param_test_{os.getpid()}.txt')
+            base_param_file = write_param_file(base_theta, f'param_base_{os.getpid()}.txt')
+
+        openings_file = self.opening_subset_file if self.opening_index is not None else None
+        pgn_file = match_pgn_file(self.pid, num) if self.save_games else None
+        args = match_arguments(job, test_param_file, base_param_file, openings_file, pgn_file)
+        match_command = f'{self.ENGINE_COMMAND} {args}'
+        logging.info(f'{__file__} > match_command: {match_command}')
 
-        args += f'--fcp "{self.fcp}" '
-        args += f'--scp "{self.scp}" '
-        args += f'--cutechess-cli-path {self.tour_manager} '
-        args += f'--cutechess-cli-options "{self.tour_manager_options}" '
-        args += f'--cutechess-cli-engine-options "{self.tour_manager_eng_options}" '
+        # We use a subprocess to launch the match, the parameter files are
+        # deleted even if the match cannot be run or is interrupted.
+        t = time.perf_counter()
+        try:
+            process = Popen(match_command, shell=True, stdout=PIPE, text=True)
+            output = process.communicate()[0]
+        finally:
+            Path(test_param_file).unlink(missing_ok=True)
+            Path(base_param_file).unlink(missing_ok=True)
+        match_elapsed = time.perf_counter() - t
+        match_metrics.observe('optimizer.match_process', match_elapsed)
 
-        new_param, cnt = '"', 0
-        for name, value in theta.items():
-            cnt += 1
-            new_param += f'{name} {value["value"]} {value["min"]} {value["max"]} {value["factor"]}'
-            if cnt < len(theta):
-                new_param += ', '
-            else:
-                new_param += '"'
-
-        base_param, cnt = '"', 0
-        for name, value in base_theta.items():
-            cnt += 1
-            base_param += f'{name} {value["value"]} {value["min"]} {value["max"]} {value["factor"]}'
-            if cnt < len(theta):
-                base_param += ', '
-            else:
-                base_param += '"'
+        if process.returncode != 0:
+            raise Exception(f'There is problem in engine match process! return code: {process.returncode}')
 
-        match_command = f'{command} {args} --test-param {new_param} --base-param {base_param}'
-        logging.info(f'{__file__} > match_command: {match_command}')
+        # Return the score of the match and the game statistics.
+        with match_metrics.span('optimizer.parse'):
+            stats = get_match_stats(output)
+        stats['seed'] = job['seed']
 
-        # We use a subprocess to launch the match
-        process = Popen(match_command, stdout=PIPE, text=True)
-        output = process.communicate()[0]
+        # The start and stop of the match script is the time that it does
+        # not measure itself.
+        match_metrics.merge(stats['metrics'])
+        if 'match.total' in stats['metrics']:
+            match_metrics.observe('optimizer.spawn', match_elapsed - stats['metrics']['match.total']['sum'])
+        stats['metrics'] = match_metrics.snapshot()
 
-        if process.returncode != 0:
-            raise Exception('There is problem in engine match process!')
+        return stats
 
-        # Return the score of the match.
-        return float(output)
+    def launch_remote(self, job, num=0):
+        """
+        Play the match of job on the workers of the coordinator. With an
+        opening index the match is split in jobs of chunk_rounds games, each
+        with its own openings, otherwise the match is one job.
+        """
+        jobs = [job]
+        if self.opening_index is not None:
+            with open(self.opening_subset_file) as f:
+                openings = [line.strip() for line in f if line.strip() != '']
+            rounds = job['rounds']
+            chunk = self.chunk_rounds or rounds
+            chunk = max(self.repeat, chunk - chunk % self.repeat)  # keep the game pairs
+            jobs = [{**job, 'rounds': min(chunk, rounds - first),
+                     'openings': openings[first // self.repeat:
+                                          -(-min(first + chunk, rounds) // self.repeat)]}
+                    for first in range(0, rounds, chunk)]
+
+        match_metrics = metrics.Metrics()
+        t = time.perf_counter()
+        results = distributed.submit(self.coordinator, jobs, self.coordinator_token)
+        match_metrics.observe('optimizer.remote_match', time.perf_counter() - t)
+
+        # The results of the jobs are added, the games are numbered in
+        # the order of the jobs.
+        stats = {'wdl': [0, 0, 0], 'penta': [0, 0, 0, 0, 0], 'failures': 0, 'game_list': []}
+        for result in results:
+            if result['returncode'] != 0:
+                raise Exception(f'There is problem in remote match! return code: {result["returncode"]} '
+                                f'{result.get("error", "")}')
+            res = get_match_stats(result['output'])
+            stats['wdl'] = [a + b for a, b in zip(stats['wdl'], res['wdl'])]
+            stats['penta'] = [a + b for a, b in zip(stats['penta'], res['penta'])]
+            stats['failures'] += res['failures']
+            for g in res.get('game_list', []):
+                stats['game_list'].append({**g, 'game': len(stats['game_list']) + 1})
+            match_metrics.merge(res['metrics'])
+            if result.get('pgn') and self.save_games:
+                with open(match_pgn_file(self.pid, num), 'a') as f:
+                    f.write(result['pgn'])
+            logging.info(f'{__file__} > remote match of {result.get("worker")}: {result.get("seconds", 0):0.1f}s')
+
+        games = sum(stats['wdl'])
+        stats['score'] = (stats['wdl'][0] + stats['wdl'][1] / 2) / games if games else 0.5
+        set_match_variance(stats)
+        stats['seed'] = job['seed']
+        stats['metrics'] = match_metrics.snapshot()
+
+        return stats
 
     def goal_function(self, i, base_theta, **args):
         """
@@ -129,7 +309,7 @@ class game_optimizer:
         of the problem.
         """
 
-        logging.info(f'{__file__} > param suggestion from optimizer: {args}')
+        events.debug(__file__, 'param suggestion from optimizer', param=args)
 
         # Create the parameter vector
         theta = copy.deepcopy(args)
@@ -145,19 +325,21 @@ class game_optimizer:
         param = copy.deepcopy(theta)
         for k, v in param.items():
             param[k]['value'] = int(param[k]['value'] * v['factor'])
-        logging.info(f'{__file__} > new param for test engine: {param}')
+        events.debug(__file__, 'new param for test engine', param=param)
 
-        score = self.launch_engine(base_theta, param)
-        logging.info(f'{__file__} > match score: {score}')
+        stats = self.launch_engine(base_theta, param, i)
+        score = stats['score']
+        logging.info(f'{__file__} > match score: {score}, wdl: {stats.get("wdl")}, '
+                     f'penta: {stats.get("penta")}, failures: {stats.get("failures")}')
+        events.debug(__file__, 'match stats', stats=stats)
 
         result = -score + regularization
-        logging.info(f'{__file__} > regularization = {regularization}')
         logging.info(f'{__file__} > result = -score + regularization = -({score}) + {regularization} = {result}')
 
         # print(f'goal = {-result}, {"+ck" if i == 0 else "-ck"}')
         # logging.info(f'{__file__} > goal = -(result) = -({result}) = {-result}')
 
-        return result
+        return result, stats
 
     def set_parameters_from_string(self, s):
         """
@@ -215,6 +397,9 @@ class game_optimizer:
                         elif name2 == 'option':
                             for name3, value3 in value2.items():
                                 fcp += f' option.{name3}={value3} '
+                            self.test_engine_option = value2
+                        elif name2 == 'param_file_option':
+                            self.test_param_option = value2
 
                 elif name1 == 'base_engine':
                     for name2, value2 in value1.items():
@@ -226,6 +411,9 @@ class game_optimizer:
                         elif name2 == 'option':
                             for name3, value3 in value2.items():
                                 scp += f' option.{name3}={value3} '
+                            self.base_engine_option = value2
+                        elif name2 == 'param_file_option':
+                            self.base_param_option = value2
 
         self.fcp, self.scp = fcp.rstrip(), scp.rstrip()
 
@@ -275,16 +463,20 @@ class game_optimizer:
                                         self.tour_manager_eng_options += f'{name4}={value4} '
                                 elif name3 == 'cutechess_option':
                                     for name4, value4 in value3.items():
-                                        if name4 in ['tournament', 'concurrency', 'games', 'repeat', 'rounds', 'variant']:
+                                        if name4 == 'rounds':
+                                            # Sent per match as it can be changed by the minimizer.
+                                            self.match_option['rounds'] = int(value4)
+                                        elif name4 == 'concurrency':
+                                            # Sent per match as it is limited by set_concurrency().
+                                            self.match_option['concurrency'] = int(value4)
+                                        elif name4 in ['tournament', 'games', 'repeat', 'variant', 'cache']:
+                                            if name4 == 'repeat':
+                                                self.repeat = int(value4)
                                             self.tour_manager_options += f'-{name4} {value4} '
                                         elif name4 == 'pgnout':
-                                            pout = '-pgnout '
-                                            for name5, value5 in value4.items():
-                                                if name5 == 'file':
-                                                    pout += f'{value5} '
-                                                elif name5 == 'option':
-                                                    pout += f'{value5} '
-                                            self.tour_manager_options += f'{pout} '
+                                            self.set_pgn_output(value4)
+                                        elif name4 == 'openings' and 'index' in value4:
+                                            self.set_opening_index(value4)
                                         elif name4 == 'openings':
                                             opt = '-openings '
                                             for name5, value5 in value4.items():
@@ -303,6 +495,235 @@ class game_optimizer:
         logging.info(f'{__file__} > tour_manager: {self.tour_manager}, tour_manager_options: {self.tour_manager_options}, tour_manager_eng_options: {self.tour_manager_eng_options}')
 
 
+    def set_concurrency(self):
+        """
+        Limit the games per match so that the concurrent games of the
+        parallel matches fit in the cores and memory of the machine, given
+        the Threads and Hash of the engines. The machine section of the
+        setting file can set the budget, otherwise it is detected.
+
+        :return: a dict with the budget, the cost of a game and the result
+        """
+        with open(self.setting_file) as f:
+            dy = yaml.safe_load(f)
+            machine = dy.get('machine') or {}
+
+        budget = resources.get_budget(machine)
+        game_cost = resources.get_game_cost(self.test_engine_option,
+                                            self.base_engine_option,
+                                            machine.get('ponder', False))
+        requested = self.match_option['concurrency']
+        concurrency, matches = resources.admit(budget, game_cost, requested)
+
+        self.match_option['concurrency'] = concurrency
+        self.parallel_matches = matches
+
+        # The parallel matches get their own cores, the reserved cores are
+        # left for the optimizer and the system.
+        if machine.get('affinity', False):
+            cores = resources.get_affinity_cores(machine.get('reserve_cores', 1))
+            if cores is None:
+                logging.warning(f'{__file__} > affinity is only supported on Linux')
+            else:
+                self.match_cores = resources.split_cores(cores, matches)
+
+        info = {'budget': budget, 'game_cost': game_cost,
+                'requested_concurrency': requested, 'concurrency': concurrency,
+                'parallel_matches': matches, 'match_cores': self.match_cores}
+        logging.info(f'{__file__} > resources: {info}')
+
+        return info
+
+    def set_opening_index(self, openings):
+        """
+        Use the compiled index of the opening book. The index is compiled
+        if it does not exist or if the opening book is newer.
+
+        openings is the openings setting, example:
+        {'file': './startopening/2moves_v2.pgn', 'format': 'pgn',
+         'index': './startopening/2moves_v2.bin', 'plies': 10000}
+        """
+        index = Path(openings['index']).as_posix()
+        ignored = [name for name in ('order', 'start') if name in openings]
+        if ignored:
+            logging.warning(f'{__file__} > openings {", ".join(ignored)} not used with the index, '
+                            f'the openings are sampled from the index with the seed of the iteration')
+        if opening_book.is_stale(openings['file'], index):
+            print(f'compiling opening index {index} ...')
+            count = opening_book.compile_index(openings['file'], index,
+                                               openings.get('format'),
+                                               openings.get('plies', 10000))
+            logging.info(f'{__file__} > {count} positions saved in {index}')
+        self.opening_index = index
+
+    def set_calibration(self, setting):
+        """
+        Measure the speed of the machine to scale the time control of the
+        matches, it is measured again between iterations.
+
+        setting is the calibration setting, example:
+        {'benchmark': 'engine', 'nodes': 1000000, 'reference_speed': 1500000,
+         'interval': 600}
+        """
+        self.calibration = calibration.Calibration.from_setting(setting, self.scp)
+        self.calibration.measure()
+
+    def set_pgn_output(self, pgnout):
+        """
+        Start the writer of the games of all matches.
+
+        pgnout is the pgnout setting, example:
+        {'file': 'output_game.pgn', 'option': 'fi', 'compression': 'gzip',
+         'max_mb': 100, 'iterations_per_file': 1000}
+        """
+        self.pgn_option = pgnout.get('option', '')
+        self.save_games = True
+        self.pgn_writer = pgn_sink.PgnSink(pgnout['file'],
+                                           pgnout.get('compression'),
+                                           pgnout.get('max_mb'),
+                                           pgnout.get('iterations_per_file'))
+
+    def collect_games(self, accepted=True):
+        """
+        Move the games of the finished matches to the pgn file, the games
+        are recorded in the index with the current iteration. The games of
+        matches that are not accepted are deleted.
+        """
+        if self.pgn_writer is None:
+            return
+        text = ''
+        for num in range(2):
+            fn = Path(match_pgn_file(self.pid, num))
+            if not fn.exists():
+                continue
+            if accepted:
+                text += fn.read_text()
+            fn.unlink()
+        if text != '':
+            self.pgn_writer.put(text, self.iteration)
+
+    def close(self):
+        """
+        Write the queued games, the games of a pair of matches that was
+        interrupted are not accepted.
+        """
+        self.collect_games(accepted=False)
+        if self.pgn_writer is not None:
+            self.pgn_writer.close()
+
+
+def match_pgn_file(pid, num):
+    """
+    Return the pgn file of the match num of the iteration of the optimizer
+    with process id pid. The files of other runs in the same folder, or of
+    a run that was stopped, are never collected.
+    """
+    return f'match_games_{pid}_{num}.pgn'
+
+
+def write_param_file(theta, fn):
+    """
+    Write the parameter values of theta in fn, one "name value" per line.
+    Return the path of the file.
+    """
+    with open(fn, 'w') as f:
+        f.write(''.join(f'{name} {value["value"]}\n' for name, value in theta.items()))
+
+    return Path(fn).resolve().as_posix()
+
+
+def match_arguments(job, test_param_file, base_param_file, openings_file=None, pgn_file=None):
+    """
+    Return the command line arguments of the match script for job, a dict
+    from game_optimizer.match_job(), with the files of the parameters and
+    of the openings and games of the match.
+    """
+    args = f'--seed {job["seed"]} '
+
+    args += f'--fcp "{job["fcp"]}" '
+    args += f'--scp "{job["scp"]}" '
+    args += f'--cutechess-cli-path {job["tour_manager"]} '
+    tour_manager_options = f'{job["tour_manager_options"]} -rounds {job["rounds"]}'
+    tour_manager_options += f' -concurrency {job["concurrency"]}'
+    if openings_file is not None:
+        tour_manager_options += f' -openings file={openings_file} format=epd order=sequential'
+    if pgn_file is not None:
+        tour_manager_options += f' -pgnout {pgn_file} {job["pgn_option"]}'
+    args += f'--cutechess-cli-options "{tour_manager_options}" '
+    args += f'--cutechess-cli-engine-options "{job["engine_options"]}" '
+    if job['affinity'] is not None:
+        args += f'--affinity {job["affinity"]} '
+    if job.get('tc_factor') is not None:
+        args += f'--tc-factor {job["tc_factor"]} '
+
+    args += f'--test-param-file {test_param_file} --base-param-file {base_param_file} '
+    if job['test_param_option'] is not None:
+        args += f'--test-param-option {job["test_param_option"]} '
+    if job['base_param_option'] is not None:
+        args += f'--base-param-option {job["base_param_option"]} '
+
+    return args
+
+
+def get_match_stats(output):
+    """
+    Convert the output of the match script into a dict with the score, the
+    number of games and the variance of the score.
+
+    Example output:
+    0.625
+    wdl: 2 1 1
+    penta: 0 1 0 1 0
+    failures: 0
+    metrics: {"match.total": {"count": 1, "sum": 12.5, ...}, ...}
+
+    The variance is estimated from the pentanomial counts of the game pairs
+    when available, as the two games of a pair played from the same opening
+    are not independent. Otherwise it is estimated from the W/D/L counts.
+    """
+    stats = {'score': float(output.splitlines()[0]), 'wdl': [0, 0, 0],
+             'penta': [0, 0, 0, 0, 0], 'games': 0, 'failures': 0, 'metrics': {}}
+
+    for line in output.splitlines()[1:]:
+        if line.startswith('wdl:'):
+            stats['wdl'] = [int(v) for v in line.split(':')[1].split()]
+        elif line.startswith('penta:'):
+            stats['penta'] = [int(v) for v in line.split(':')[1].split()]
+        elif line.startswith('failures:'):
+            stats['failures'] = int(line.split(':')[1])
+        elif line.startswith('games:'):
+            stats['game_list'] = json.loads(line.split(':', 1)[1])
+        elif line.startswith('metrics:'):
+            stats['metrics'] = json.loads(line.split(':', 1)[1])
+
+    set_match_variance(stats)
+
+    return stats
+
+
+def set_match_variance(stats):
+    """
+    Set the games and the variance of the score of the match in stats
+    from the pentanomial or W/D/L counts.
+    """
+    stats['games'] = sum(stats['wdl'])
+    pairs = sum(stats['penta'])
+
+    # Variance of the mean score of the match
+    if pairs > 1:
+        points = [0.0, 0.25, 0.5, 0.75, 1.0]
+        mu = sum(n * x for n, x in zip(stats['penta'], points)) / pairs
+        pair_var = sum(n * (x - mu) ** 2 for n, x in zip(stats['penta'], points)) / pairs
+        stats['var'] = pair_var / pairs
+    elif stats['games'] > 1:
+        points = [1.0, 0.5, 0.0]
+        mu = sum(n * x for n, x in zip(stats['wdl'], points)) / stats['games']
+        game_var = sum(n * (x - mu) ** 2 for n, x in zip(stats['wdl'], points)) / stats['games']
+        stats['var'] = game_var / stats['games']
+
+    return stats
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         prog='%s %s' % (APP_NAME, APP_VERSION),
@@ -321,8 +742,62 @@ if __name__ == "__main__":
                         help='input min iteration to stop the optimizer when\n'
                              'the mean goal condition is meet, default=10000',
                         type=int, default=10000)
+    parser.add_argument('--target-snr', required=False,
+                        help='adapt the rounds per match so that the signal-to-noise\n'
+                             'ratio of the gradient is close to this value, default=None\n'
+                             '(the rounds from optimizer_setting.yml are used)',
+                        type=float, default=None)
+    parser.add_argument('--min-rounds', required=False,
+                        help='minimum rounds per match when --target-snr is set, default=4',
+                        type=int, default=4)
+    parser.add_argument('--max-rounds', required=False,
+                        help='maximum rounds per match when --target-snr is set, default=64',
+                        type=int, default=64)
+    parser.add_argument('--metrics-file', required=False,
+                        help='write the timing spans of every iteration to <name>.csv and\n'
+                             'to the Prometheus textfile <name>.prom, example: metrics',
+                        default=None)
+    parser.add_argument('--max-failures', required=False,
+                        help='number of times the matches of an iteration are played again\n'
+                             'after a match failed, then the iteration is skipped, default=3',
+                        type=int, default=3)
+    parser.add_argument('--results-file', required=False,
+                        help='save the iterations, matches and games in this sqlite file,\n'
+                             'example: results.sqlite, default=None',
+                        default=None)
+    parser.add_argument('--backend', required=False, choices=['engine', 'sim'], default='engine',
+                        help='engine: play the matches with the tournament manager and engines\n'
+                             'sim: simulate the games from an Elo model of the parameters,\n'
+                             'see the simulator section of optimizer_setting.yml, default=engine')
+    parser.add_argument('--coordinator', required=False, default=None,
+                        help='play the matches on the workers of distributed.py that connect\n'
+                             'to this address, example: 0.0.0.0:8650, default=None (local matches)')
+    parser.add_argument('--coordinator-token', required=False, default=os.environ.get('SPSA_TOKEN'),
+                        help='token that the workers must send, required unless the coordinator\n'
+                             'is on a loopback address like 127.0.0.1, default=$SPSA_TOKEN')
+    parser.add_argument('--chunk-rounds', required=False, type=int, default=None,
+                        help='with --coordinator and an opening index, split the matches in jobs\n'
+                             'of this number of games, default=None (one job per match)')
+    parser.add_argument('--control-port', required=False,
+                        help='serve the status and accept pause, resume, stop and concurrency\n'
+                             'requests on http://127.0.0.1:<port>, default=None (no server)',
+                        type=int, default=None)
+    parser.add_argument('--quiet', action='store_true',
+                        help='print a one-line summary of the iterations at most every\n'
+                             '--progress-interval seconds instead of the parameters of every match')
+    parser.add_argument('--progress-interval', required=False, type=float, default=10,
+                        help='seconds between two summaries of --quiet, default=10')
+    parser.add_argument('--log-level', required=False, choices=['debug', 'info', 'warning'], default='info',
+                        help='level of the log, debug adds the parameters and gradients of\n'
+                             'every step and the games of every match, default=info')
+    parser.add_argument('--log-format', required=False, choices=['text', 'jsonl'], default='text',
+                        help='text writes spsa_log.txt, jsonl writes spsa_log.jsonl with a\n'
+                             'json line per event, default=text')
 
     args = parser.parse_args()
+    events.set_level(args.log_level)
+    if args.log_format == 'jsonl':
+        events.use_jsonl('spsa_log.jsonl')
     iterations = args.iteration
 
     # Create the optimization object
@@ -335,8 +810,42 @@ if __name__ == "__main__":
 
     optimizer.get_cutechess_cli_options()
 
-    # Set the name of the script to run matches
-    optimizer.set_engine_command("python chess_match.py")
+    # Set the name of the script to run matches, the sim backend plays
+    # simulated games without engines.
+    if args.backend == 'sim':
+        optimizer.match_script = f'match_sim.py --setting-file {optimizer.setting_file}'
+    optimizer.set_engine_command(f'"{sys.executable}" {optimizer.match_script}')
+
+    # The matches are played by the workers of the coordinator.
+    if args.coordinator is not None:
+        if args.coordinator_token is None and not distributed.is_loopback(distributed.parse_address(args.coordinator)[0]):
+            parser.error(f'--coordinator {args.coordinator} needs --coordinator-token or SPSA_TOKEN')
+        distributed.serve(distributed.Coordinator(args.coordinator_token), args.coordinator)
+        optimizer.coordinator = args.coordinator
+        optimizer.coordinator_token = args.coordinator_token
+        optimizer.chunk_rounds = args.chunk_rounds
+        print(f'coordinator: {args.coordinator}, start the workers with:\n'
+              f'  python distributed.py worker --coordinator <this host>:{args.coordinator.rsplit(":", 1)[1]}'
+              f'{" --token <token>" if args.coordinator_token else ""}')
+
+    # The time control is scaled to the speed of the machine.
+    calibration_setting = optimizer.get_setting().get('calibration')
+    if calibration_setting is not None:
+        optimizer.set_calibration(calibration_setting)
+        print(f'{optimizer.calibration.benchmark} speed: {optimizer.calibration.speed:.0f} nodes/s, '
+              f'reference: {optimizer.calibration.reference_speed:.0f} nodes/s, '
+              f'tc factor: {optimizer.calibration.factor():.2f}')
+
+    # Admit only the concurrent games that fit in the machine.
+    res = optimizer.set_concurrency()
+    print(f'\nmachine: {res["budget"]["cores"]} cores, {res["budget"]["memory_mb"]} mb, '
+          f'for games: {res["budget"]["game_cores"]} cores, {res["budget"]["game_memory_mb"]} mb')
+    print(f'game: {res["game_cost"]["cores"]} cores, {res["game_cost"]["memory_mb"]} mb')
+    print(f'concurrency per match: {res["concurrency"]} (setting: {res["requested_concurrency"]}), '
+          f'parallel matches: {res["parallel_matches"]}')
+    if res['match_cores'] is not None:
+        for num, cores in enumerate(res['match_cores'], 1):
+            print(f'match {num} cores: {resources.format_cores(cores)}')
 
     print(f'\nparameters to be optimized = {optimizer.param}')
     theta0 = optimizer.set_parameters_from_string(optimizer.param)
@@ -345,13 +854,47 @@ if __name__ == "__main__":
     for k, v in theta0.items():
         theta0[k]['value'] = int(v['value']) / int(v['factor'])
 
+    # The control server changes the run between iterations.
+    optimizer_control = None
+    if args.control_port is not None:
+        # The concurrency of the matches on this machine is limited by its
+        # budget, the workers of a coordinator have their own.
+        max_concurrency = None
+        if optimizer.coordinator is None:
+            max_concurrency, _ = resources.admit(res['budget'], res['game_cost'], math.inf,
+                                                 optimizer.parallel_matches)
+        optimizer_control = control.Control(max_concurrency)
+        optimizer_control.set_status(concurrency=optimizer.match_option['concurrency'],
+                                     parallel_matches=optimizer.parallel_matches)
+        server = control.serve(optimizer_control, args.control_port)
+        print(f'control: http://127.0.0.1:{server.server_port}/status')
+
     # Create the SPSA minimizer with 10000 iterations...
     minimizer = spsa.SPSA_minimization(optimizer.goal_function, theta0,
                                        iterations,
                                        stop_all_mean_goal=args.stop_all_mean_goal,
                                        stop_best_mean_goal=args.stop_best_mean_goal,
-                                       stop_min_iter=args.stop_min_iter)
+                                       stop_min_iter=args.stop_min_iter,
+                                       options={'rounds': optimizer.match_option['rounds'],
+                                                'target_snr': args.target_snr,
+                                                'min_rounds': args.min_rounds,
+                                                'max_rounds': args.max_rounds,
+                                                'max_failures': args.max_failures,
+                                                'metrics_file': args.metrics_file,
+                                                'cores': res['budget']['cores'],
+                                                'control': optimizer_control,
+                                                'results_file': args.results_file,
+                                                'results_config': {'setting': optimizer.get_setting(),
+                                                                   'args': {k: v for k, v in vars(args).items()
+                                                                            if k != 'coordinator_token'}},
+                                                'quiet': args.quiet,
+                                                'progress_interval': args.progress_interval,
+                                                'parallel': optimizer.parallel_matches > 1},
+                                       set_match_option=optimizer.set_match_option)
 
     # Run it!
-    minimum = minimizer.run()
+    try:
+        minimum = minimizer.run()
+    finally:
+        optimizer.close()
     print(f'minimum = {minimum}')
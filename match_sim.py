@@ -0,0 +1,176 @@
+"""
+match_sim.py
+
+A match script like chess_match.py that simulates the games instead of
+running engines, to test and benchmark the optimizer on a machine without
+engines: python game_optimizer.py --backend sim
+
+It takes the arguments of chess_match.py and prints the same lines, the
+score, wdl, penta, failures, games and metrics. The result of a game is
+drawn from the expected score of the Elo difference of the test and base
+parameters, with the draw rate of the simulator section of the setting
+file. The second game of a pair played from the same opening is
+correlated with the first by pair_correlation, and the matches of a
+gradient with the same seed use the same random numbers.
+
+The Elo of the parameters is sum(-elo * ((value - best) / (max - min))^2)
+over the parameters, best and elo are set per parameter in the setting
+file, by default best is the middle of min and max and elo is 100.
+
+simulator:
+  draw_rate: 0.3
+  pair_correlation: -0.2
+  game_seconds: 0.5  # mean duration of a game, 0 for no wait
+  parameter:
+    QueenValueOp: {best: 950, elo: 100}
+"""
+
+
+import argparse
+import json
+import random
+import sys
+import time
+
+import yaml
+
+import metrics
+
+
+# Start of this process for the match.total span.
+START_TIME = time.perf_counter()
+
+# Elo lost by a parameter at a distance of max - min from its best value.
+DEFAULT_ELO = 100
+
+
+def read_param_file(fn):
+    """
+    Return the parameters of a file with one "name value" per line.
+    """
+    with open(fn) as f:
+        return {par[0]: int(par[1]) for par in (line.split() for line in f) if par}
+
+
+def parse_param(param):
+    """
+    Return the parameters of a string like "q 800 500 1200 1000, r 450 ...".
+    """
+    return {par.split()[0]: int(par.split()[1]) for par in param.split(',')}
+
+
+def get_option(options, name, default):
+    """
+    Return the value of -name in the tournament manager options.
+    """
+    words = options.split()
+    if f'-{name}' in words:
+        return int(words[words.index(f'-{name}') + 1])
+    return default
+
+
+class EloModel:
+    def __init__(self, setting):
+        """
+        The Elo of the parameters and the game model from the setting
+        file content.
+        """
+        sim = setting.get('simulator') or {}
+        self.draw_rate = sim.get('draw_rate', 0.3)
+        self.pair_correlation = sim.get('pair_correlation', 0.0)
+        self.game_seconds = sim.get('game_seconds', 0.0)
+        self.terms = {}
+        for name, p in setting['test_engine']['parameter_to_optimize'].items():
+            q = (sim.get('parameter') or {}).get(name) or {}
+            self.terms[name] = (q.get('best', (p['min'] + p['max']) / 2),
+                                q.get('elo', DEFAULT_ELO),
+                                (p['max'] - p['min']) or 1)
+
+    def elo(self, param):
+        return sum(-elo * ((param.get(name, best) - best) / span) ** 2
+                   for name, (best, elo, span) in self.terms.items())
+
+    def play(self, test, base, games, rng):
+        """
+        Return the points of the test engine in games games, 1, 0.5 or 0.
+        """
+        score = 1 / (1 + 10 ** ((self.elo(base) - self.elo(test)) / 400))
+
+        # The draws are taken from the middle of the game distribution so
+        # that wins and losses keep the expected score.
+        draw = min(self.draw_rate, 2 * min(score, 1 - score))
+        win = score - draw / 2
+        points, u = [], 0.0
+        for num in range(games):
+            if num % 2 == 1 and rng.random() < abs(self.pair_correlation):
+                u = u if self.pair_correlation > 0 else 1 - u
+            else:
+                u = rng.random()
+            points.append(1.0 if u < win else 0.5 if u < win + draw else 0.0)
+        return points
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Simulate an engine match with the arguments of chess_match.py.',
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--setting-file', required=False, default='optimizer_setting.yml',
+                        help='setting file with the parameters and the simulator section,\n'
+                             'default=optimizer_setting.yml')
+    parser.add_argument('--seed', required=False, type=int, default=0)
+    parser.add_argument('--fcp', required=True)
+    parser.add_argument('--scp', required=True)
+    parser.add_argument('--cutechess-cli-options', required=False, default='')
+    parser.add_argument('--test-param', required=False)
+    parser.add_argument('--base-param', required=False)
+    parser.add_argument('--test-param-file', required=False)
+    parser.add_argument('--base-param-file', required=False)
+    parser.add_argument('--tc-factor', required=False, type=float, default=None)
+
+    # The other options of chess_match.py are accepted and not used.
+    args, _ = parser.parse_known_args()
+
+    with open(args.setting_file) as f:
+        model = EloModel(yaml.safe_load(f))
+    test = read_param_file(args.test_param_file) if args.test_param_file else parse_param(args.test_param or '')
+    base = read_param_file(args.base_param_file) if args.base_param_file else parse_param(args.base_param or '')
+    test_name = args.fcp.split('name=')[1].split()[0]
+    base_name = args.scp.split('name=')[1].split()[0]
+
+    rounds = get_option(args.cutechess_cli_options, 'rounds', 4)
+    concurrency = get_option(args.cutechess_cli_options, 'concurrency', 1)
+    rng = random.Random(args.seed)
+    points = model.play(test, base, rounds, rng)
+
+    # The games are played in concurrency slots, the match takes the time
+    # of its games divided by the slots.
+    games, wdl, penta = [], [0, 0, 0], [0, 0, 0, 0, 0]
+    total_seconds = 0.0
+    for num, p in enumerate(points, 1):
+        seconds = model.game_seconds * (args.tc_factor or 1.0) * rng.uniform(0.5, 1.5)
+        total_seconds += seconds
+        metrics.observe('duel.play', seconds)
+        wdl[{1.0: 0, 0.5: 1, 0.0: 2}[p]] += 1
+        white, black = (test_name, base_name) if num % 2 == 1 else (base_name, test_name)
+        result = '1/2-1/2' if p == 0.5 else '1-0' if (p == 1.0) == (white == test_name) else '0-1'
+        games.append({'game': num, 'white': white, 'black': black, 'result': result,
+                      'termination': 'simulated', 'duration': round(seconds, 3)})
+        if args.tc_factor is not None:
+            games[-1]['tc_factor'] = args.tc_factor
+        if num % 2 == 0:
+            penta[int(2 * (p + points[num - 2]))] += 1
+    time.sleep(total_seconds / max(concurrency, 1))
+
+    print(f'{(wdl[0] + wdl[1] / 2) / max(len(points), 1):0.3f}')
+    print(f'wdl: {" ".join(str(v) for v in wdl)}')
+    print(f'penta: {" ".join(str(v) for v in penta)}')
+    print('failures: 0')
+    print(f'games: {json.dumps(games, separators=(",", ":"))}')
+    metrics.observe('match.total', time.perf_counter() - START_TIME)
+    print(f'metrics: {metrics.to_json(metrics.registry.snapshot())}')
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
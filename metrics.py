@@ -0,0 +1,155 @@
+"""
+metrics.py
+
+Named timing spans of the optimizer, the match script and duel.py. The
+durations of every span name are kept in a histogram. A process sends its
+histograms to its parent as json, the optimizer merges them per iteration
+and writes them to a csv file and to a Prometheus textfile.
+"""
+
+
+import json
+import math
+import os
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds of the histogram buckets in seconds, the last bucket is +Inf.
+BUCKETS = [0.01, 0.1, 1, 10, 60, 600]
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.buckets[i] += 1
+
+    def merge(self, h):
+        """
+        Add the histogram h, a dict from to_dict().
+        """
+        if h['count'] == 0:
+            return
+        self.count += h['count']
+        self.sum += h['sum']
+        self.min = min(self.min, h['min'])
+        self.max = max(self.max, h['max'])
+        self.buckets = [a + b for a, b in zip(self.buckets, h['buckets'])]
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'min': self.min if self.count else 0.0, 'max': self.max,
+                'buckets': self.buckets}
+
+
+class Metrics:
+    def __init__(self):
+        """
+        The histograms of the spans by name.
+        """
+        self.spans = {}
+
+    def observe(self, name, seconds):
+        self.spans.setdefault(name, Histogram()).observe(seconds)
+
+    @contextmanager
+    def span(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t)
+
+    def total(self, name):
+        """
+        Return the sum of the durations of the span name in seconds.
+        """
+        return self.spans[name].sum if name in self.spans else 0.0
+
+    def merge(self, snapshot):
+        """
+        Add the histograms of a snapshot() of another process.
+        """
+        for name, h in (snapshot or {}).items():
+            self.spans.setdefault(name, Histogram()).merge(h)
+
+    def snapshot(self):
+        return {name: h.to_dict() for name, h in self.spans.items()}
+
+    def reset(self):
+        self.spans = {}
+
+
+# The spans of this process
+registry = Metrics()
+
+
+def span(name):
+    return registry.span(name)
+
+
+def observe(name, seconds):
+    registry.observe(name, seconds)
+
+
+def to_json(snapshot):
+    return json.dumps(snapshot, separators=(',', ':'))
+
+
+def write_csv(fn, iteration, metrics, gauges):
+    """
+    Append a row per span of the iteration, count, sum, mean, min and
+    max in seconds and the count of every bucket, and a row per gauge
+    like games_per_hour with the value in sum.
+    """
+    new_file = not os.path.exists(fn)
+    with open(fn, 'a') as f:
+        if new_file:
+            f.write('iter,name,count,sum,mean,min,max,'
+                    + ','.join(f'le_{b}' for b in BUCKETS) + ',le_inf\n')
+        for name, h in sorted(metrics.spans.items()):
+            mean = h.sum / h.count if h.count else 0.0
+            f.write(f'{iteration},{name},{h.count},{h.sum:0.4f},{mean:0.4f},'
+                    f'{h.to_dict()["min"]:0.4f},{h.max:0.4f},'
+                    + ','.join(str(n) for n in h.buckets) + '\n')
+        for name, value in gauges.items():
+            f.write(f'{iteration},{name},1,{value:0.4f},{value:0.4f},{value:0.4f},{value:0.4f},'
+                    + ','.join('' for _ in range(len(BUCKETS) + 1)) + '\n')
+
+
+def write_prometheus(fn, metrics, gauges):
+    """
+    Write the histograms of all iterations and the gauges of the last
+    iteration in the Prometheus textfile format. The file is replaced at
+    once so that a collector never reads half a file.
+    """
+    lines = ['# HELP spsa_span_seconds Duration of the spans of the optimizer, the matches and the games.',
+             '# TYPE spsa_span_seconds histogram']
+    for name, h in sorted(metrics.spans.items()):
+        cumulative = 0
+        for bound, n in zip(BUCKETS + ['+Inf'], h.buckets):
+            cumulative += n
+            lines.append(f'spsa_span_seconds_bucket{{span="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'spsa_span_seconds_sum{{span="{name}"}} {h.sum:0.6f}')
+        lines.append(f'spsa_span_seconds_count{{span="{name}"}} {h.count}')
+    for name, value in gauges.items():
+        lines.append(f'# TYPE spsa_{name} gauge')
+        lines.append(f'spsa_{name} {value}')
+
+    tmp = f'{fn}.tmp'
+    with open(tmp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp, fn)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+mock_engine.py
+
+A chess engine for tests and benchmarks of duel.py and chess_match.py on
+machines without real engines. It speaks UCI or xboard, the protocol is
+taken from the first command, and plays random legal moves or, with the
+probability of its strength, the move that wins the most material.
+
+Its behavior is set with engine options, their defaults can be changed
+with the MOCK_ENGINE_OPTIONS environment variable, for example
+MOCK_ENGINE_OPTIONS="ThinkMs=5 StartupMs=200 InfoLines=10":
+
+  ThinkMs     time per move in ms, at most the time per move of the clock
+  StartupMs   time before the engine answers uci or protover
+  InfoLines   search info lines per move
+  Strength    percent of moves that win the most material, 0 to 100
+  ParamBest   best values of parameter options like "QueenValue=950 RookValue=550",
+              the strength is lowered by 100 * ((value - best) / ParamRange)^2
+              for every parameter option that is set
+  ParamRange  see ParamBest
+  ParamFile   file with one "name value" per line, read as options
+  CrashRate   per mille of moves after which the engine exits
+  HangRate    per mille of moves after which the engine stops answering
+  CrashAfter  exit after this number of moves, 0 never
+  HangAfter   stop answering after this number of moves, 0 never
+  Seed        seed of the moves and failures, 0 for a random seed
+
+Usage in duel.py: -engine cmd=mock_engine.py name=test proto=uci option.Strength=60
+"""
+
+
+import os
+import random
+import sys
+import time
+
+import chessboard
+
+
+PIECE_VALUES = {'p': 100, 'n': 300, 'b': 300, 'r': 500, 'q': 900, 'k': 0}
+
+# name: (type, default, min, max)
+OPTIONS = {
+    'ThinkMs': ('spin', 10, 0, 100000),
+    'StartupMs': ('spin', 0, 0, 100000),
+    'InfoLines': ('spin', 1, 0, 1000),
+    'Strength': ('spin', 50, 0, 100),
+    'ParamBest': ('string', '', None, None),
+    'ParamRange': ('spin', 200, 1, 100000),
+    'ParamFile': ('string', '', None, None),
+    'CrashRate': ('spin', 0, 0, 1000),
+    'HangRate': ('spin', 0, 0, 1000),
+    'CrashAfter': ('spin', 0, 0, 100000),
+    'HangAfter': ('spin', 0, 0, 100000),
+    'Seed': ('spin', 0, 0, 2 ** 31),
+    'Hash': ('spin', 16, 1, 65536),
+    'Threads': ('spin', 1, 1, 512),
+}
+
+
+class MockEngine:
+    def __init__(self, options):
+        self.options = {name: o[1] for name, o in OPTIONS.items()}
+        self.params = {}  # parameter options that are not engine options
+        for name, value in options.items():
+            self.set_option(name, value)
+        self.rng = random.Random(self.options['Seed'] or None)
+        self.board = chessboard.Board()
+        self.moves = 0
+
+    def out(self, line):
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+    def set_option(self, name, value):
+        if name in OPTIONS:
+            self.options[name] = value if OPTIONS[name][0] == 'string' else int(float(value))
+            if name == 'Seed':
+                self.rng = random.Random(self.options['Seed'] or None)
+            elif name == 'ParamFile' and value and os.path.isfile(value):
+                with open(value) as f:
+                    for par in (line.split() for line in f):
+                        if len(par) >= 2:
+                            self.set_option(par[0], par[1])
+        else:
+            try:
+                self.params[name] = float(value)
+            except ValueError:
+                pass
+
+    def strength(self):
+        """
+        Return the probability of a material move, lowered by the distance
+        of the parameters from their best values.
+        """
+        s = self.options['Strength'] / 100
+        for item in self.options['ParamBest'].split():
+            name, best = item.split('=')
+            if name in self.params:
+                s -= ((self.params[name] - float(best)) / self.options['ParamRange']) ** 2
+        return min(max(s, 0.0), 1.0)
+
+    def choose(self):
+        """
+        Return the move and its score in cp from the side to move.
+        """
+        moves = self.board.legal_moves()
+        gains = []
+        for m in moves:
+            target = self.board.board[m[1]]
+            gain = PIECE_VALUES[target.lower()] if target != '.' else 0
+            if m[2]:
+                gain += PIECE_VALUES[m[2]] - PIECE_VALUES['p']
+            gains.append(gain)
+
+        material = sum((1 if p.isupper() else -1) * PIECE_VALUES[p.lower()]
+                       for p in self.board.board if p != '.')
+        material = material if self.board.white else -material
+
+        if self.rng.random() < self.strength():
+            best = max(gains)
+            move = self.rng.choice([m for m, g in zip(moves, gains) if g == best])
+            # With more material the checks are tried, a mate is played.
+            if material + best >= PIECE_VALUES['r']:
+                move = self.find_mate(moves) or move
+        else:
+            move = self.rng.choice(moves)
+
+        return move, material + gains[moves.index(move)]
+
+    def find_mate(self, moves):
+        for m in moves:
+            self.board.push(m)
+            mate = self.board.is_check() and not self.board.legal_moves()
+            self.board.pop()
+            if mate:
+                return m
+        return None
+
+    def think(self, budget_ms):
+        """
+        Search for the move, print the info lines and return the move, the
+        score and the time in ms.
+        """
+        self.moves += 1
+        failures = [('CrashAfter', 'CrashRate', self.crash), ('HangAfter', 'HangRate', self.hang)]
+        for after, rate, fail in failures:
+            if self.moves == self.options[after] or self.rng.random() * 1000 < self.options[rate]:
+                fail()
+
+        think_ms = min(self.options['ThinkMs'], budget_ms) if budget_ms is not None else self.options['ThinkMs']
+        start = time.perf_counter()
+        move, score = self.choose()
+        lines = self.options['InfoLines']
+        for depth in range(1, lines + 1):
+            time.sleep(max(0.0, start + think_ms * depth / lines / 1000 - time.perf_counter()))
+            self.info(depth, score, int(1000 * (time.perf_counter() - start)), move)
+        time.sleep(max(0.0, start + think_ms / 1000 - time.perf_counter()))
+        return move, score, int(1000 * (time.perf_counter() - start))
+
+    def crash(self):
+        sys.stdout.flush()
+        os._exit(3)
+
+    def hang(self):
+        while True:
+            time.sleep(3600)
+
+    def startup(self):
+        time.sleep(self.options['StartupMs'] / 1000)
+
+
+class UciMock(MockEngine):
+    def handshake(self):
+        self.startup()
+        self.out('id name mock_engine')
+        self.out('id author spsa')
+        for name, (kind, default, minv, maxv) in OPTIONS.items():
+            if kind == 'spin':
+                self.out(f'option name {name} type spin default {self.options[name]} min {minv} max {maxv}')
+            else:
+                self.out(f'option name {name} type string default {self.options[name] or "<empty>"}')
+        self.out('option name Clear Hash type button')
+        self.out('uciok')
+
+    def info(self, depth, score, ms, move):
+        self.out(f'info depth {depth} score cp {score} time {ms} nodes {1000 * depth} '
+                 f'pv {chessboard.move_to_uci(move)}')
+
+    def command(self, line):
+        parts = line.split()
+        if parts[0] == 'isready':
+            self.out('readyok')
+        elif parts[0] == 'setoption' and 'name' in parts:
+            i = parts.index('name')
+            j = parts.index('value') if 'value' in parts else len(parts)
+            self.set_option(' '.join(parts[i + 1:j]), ' '.join(parts[j + 1:]))
+        elif parts[0] == 'ucinewgame':
+            self.board = chessboard.Board()
+        elif parts[0] == 'position':
+            i = parts.index('moves') if 'moves' in parts else len(parts)
+            fen = chessboard.START_FEN if parts[1] == 'startpos' else ' '.join(parts[2:i])
+            self.board = chessboard.Board(fen)
+            for m in parts[i + 1:]:
+                self.board.push(m)
+        elif parts[0] == 'go':
+            self.go(parts[1:])
+
+    def go(self, limits):
+        values = {k: int(v) for k, v in zip(limits[0::2], limits[1::2]) if v.lstrip('-').isdigit()}
+        budget = values.get('movetime')
+        side = 'w' if self.board.white else 'b'
+        if f'{side}time' in values:
+            budget = values[f'{side}time'] // 30 + values.get(f'{side}inc', 0)
+        move, score, ms = self.think(budget)
+        self.out(f'bestmove {chessboard.move_to_uci(move)}')
+
+
+class XboardMock(MockEngine):
+    def __init__(self, options):
+        super().__init__(options)
+        self.force = True
+        self.time_cs = None
+        self.inc_ms = 0
+        self.st_ms = None
+
+    def handshake(self):
+        self.startup()
+        self.out('feature done=0')
+        self.out('feature myname="mock_engine" setboard=1 ping=1 usermove=0 sigint=0 smp=1')
+        for name, (kind, default, minv, maxv) in OPTIONS.items():
+            if kind == 'spin':
+                self.out(f'feature option="{name} -spin {self.options[name]} {minv} {maxv}"')
+            else:
+                self.out(f'feature option="{name} -string {self.options[name]}"')
+        self.out('feature done=1')
+
+    def info(self, depth, score, ms, move):
+        self.out(f'{depth} {score} {ms // 10} {1000 * depth} {chessboard.move_to_uci(move)}')
+
+    def command(self, line):
+        parts = line.split()
+        cmd = parts[0]
+        if cmd == 'ping':
+            self.out(f'pong {parts[1]}')
+        elif cmd == 'new':
+            self.board = chessboard.Board()
+            self.force = False
+            self.st_ms = None
+        elif cmd == 'setboard':
+            self.board = chessboard.Board(line.split(' ', 1)[1])
+        elif cmd == 'force':
+            self.force = True
+        elif cmd == 'go':
+            self.force = False
+            self.play()
+        elif cmd == 'option' and '=' in line:
+            name, value = line.split(' ', 1)[1].split('=', 1)
+            self.set_option(name.strip(), value.strip())
+        elif cmd == 'time':
+            self.time_cs = int(parts[1])
+        elif cmd == 'level' and len(parts) >= 4:
+            self.inc_ms = int(float(parts[3]) * 1000)
+        elif cmd == 'st':
+            self.st_ms = int(float(parts[1]) * 1000)
+        elif cmd in ['xboard', 'protover', 'post', 'nopost', 'otim', 'sd', 'nps', 'easy', 'hard',
+                     'random', 'computer', 'variant', 'cores', 'memory', 'result', 'accepted', 'rejected']:
+            pass
+        else:
+            try:
+                self.board.push_uci(cmd)
+            except (ValueError, IndexError):
+                self.out(f'Illegal move: {cmd}')
+                return
+            if not self.force:
+                self.play()
+
+    def play(self):
+        if self.board.outcome() is not None:
+            return
+        budget = self.st_ms
+        if budget is None and self.time_cs is not None:
+            budget = self.time_cs * 10 // 30 + self.inc_ms
+        move, score, ms = self.think(budget)
+        self.board.push(move)
+        self.out(f'move {chessboard.move_to_uci(move)}')
+
+
+def main():
+    options = dict(item.split('=', 1) for item in os.environ.get('MOCK_ENGINE_OPTIONS', '').split())
+    engine = None
+    for line in sys.stdin:
+        line = line.strip()
+        if line == '':
+            continue
+        if line == 'quit':
+            break
+        if engine is None:
+            if line == 'uci':
+                engine = UciMock(options)
+            elif line == 'xboard':
+                engine = XboardMock(options)
+                continue
+            else:
+                continue
+        if line == 'uci' or line.startswith('protover'):
+            engine.handshake()
+        else:
+            engine.command(line)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+opening_book.py
+
+Compile PGN or EPD opening books into a binary index of start positions
+and sample openings from it.
+
+Usage:
+  python opening_book.py --input startopening/2moves_v2.pgn --output startopening/2moves_v2.bin
+
+The index holds the unique start positions of the book as EPD strings.
+The file is memory-mapped so that a random opening can be read without
+loading the book.
+
+Index layout:
+  8 bytes  magic b'SPSAOPN1'
+  4 bytes  number of positions n, little endian
+  4 bytes  x (n + 1) offsets of the positions in the data block
+  data     the EPD strings encoded in ascii
+"""
+
+
+import argparse
+import mmap
+import random
+import struct
+from pathlib import Path
+
+import chessboard
+
+
+MAGIC = b'SPSAOPN1'
+
+
+def read_pgn_openings(fn, plies=10000):
+    """
+    Return the start positions as FEN of the games in the pgn file fn.
+    At most plies moves of every game are played.
+    """
+    fens = []
+    fen, movetext = chessboard.START_FEN, []
+
+    def end_of_game():
+        board = chessboard.Board(fen)
+        for san in get_san_moves(' '.join(movetext))[:plies]:
+            board.push_san(san)
+        fens.append(board.fen())
+
+    with open(fn) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                if movetext:
+                    end_of_game()
+                    fen, movetext = chessboard.START_FEN, []
+                if line.startswith('[FEN '):
+                    fen = line.split('"')[1]
+            elif line != '':
+                movetext.append(line)
+        if movetext:
+            end_of_game()
+
+    return fens
+
+
+def get_san_moves(movetext):
+    """
+    Return the SAN moves of a pgn movetext without move numbers, comments,
+    variations, NAGs and result.
+    """
+    moves = []
+    depth = 0
+    text = movetext.replace('{', ' { ').replace('}', ' } ').replace('(', ' ( ').replace(')', ' ) ')
+    for token in text.split():
+        if token in ('{', '('):
+            depth += 1
+        elif token in ('}', ')'):
+            depth -= 1
+        elif depth > 0 or token.startswith('$') or token in ('1-0', '0-1', '1/2-1/2', '*'):
+            continue
+        else:
+            token = token.split('.')[-1]  # 1.e4, 1... or 12.
+            if token != '':
+                moves.append(token)
+    return moves
+
+
+def read_epd_openings(fn):
+    """
+    Return the positions of an epd file as FEN.
+    """
+    fens = []
+    with open(fn) as f:
+        for line in f:
+            line = line.strip()
+            if line == '':
+                continue
+            # Drop the EPD operations like "bm e4; id x;" after the 4 fields.
+            fen = ' '.join(line.split(';')[0].split()[0:6])
+            fens.append(chessboard.Board(fen).fen())
+    return fens
+
+
+def compile_index(infn, outfn, fmt=None, plies=10000):
+    """
+    Write the unique positions of the opening book infn to the index outfn.
+    Positions are compared by their EPD, the first occurence is kept.
+    Return the number of positions in the index.
+    """
+    if fmt is None:
+        fmt = 'pgn' if Path(infn).suffix.lower() == '.pgn' else 'epd'
+
+    if fmt == 'pgn':
+        fens = read_pgn_openings(infn, plies)
+    else:
+        fens = read_epd_openings(infn)
+
+    unique, seen = [], set()
+    for fen in fens:
+        epd = ' '.join(fen.split()[0:4])
+        if epd not in seen:
+            seen.add(epd)
+            unique.append(epd.encode('ascii'))
+
+    offsets, pos = [], 0
+    for epd in unique:
+        offsets.append(pos)
+        pos += len(epd)
+    offsets.append(pos)
+
+    with open(outfn, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(unique)))
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        for epd in unique:
+            f.write(epd)
+
+    return len(unique)
+
+
+def is_index(fn):
+    with open(fn, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def is_stale(infn, outfn):
+    """
+    Return True if the index outfn does not exist or is older than the
+    opening book infn.
+    """
+    return not Path(outfn).exists() or Path(outfn).stat().st_mtime < Path(infn).stat().st_mtime
+
+
+class OpeningIndex:
+    """
+    Random access to the positions of a compiled index. Example:
+
+    with OpeningIndex('2moves_v2.bin') as book:
+        epds = book.sample(4, seed=1)
+    """
+    def __init__(self, fn):
+        self.fn = fn
+        self.file = open(fn, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[0:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{fn} is not an opening index')
+        self.count = struct.unpack_from('<I', self.mm, len(MAGIC))[0]
+        self.offset_start = len(MAGIC) + 4
+        self.data_start = self.offset_start + 4 * (self.count + 1)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start, end = struct.unpack_from('<2I', self.mm, self.offset_start + 4 * i)
+        return self.mm[self.data_start + start: self.data_start + end].decode('ascii')
+
+    def sample(self, n, seed=None):
+        """
+        Return n random positions, without repetition if the index is
+        large enough.
+        """
+        rng = random.Random(seed)
+        if n <= self.count:
+            return [self[i] for i in rng.sample(range(self.count), n)]
+        return [self[rng.randrange(self.count)] for _ in range(n)]
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_epd(epds, fn):
+    with open(fn, 'w') as f:
+        for epd in epds:
+            f.write(f'{epd}\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--input', required=True,
+                        help='opening book in pgn or epd format')
+    parser.add_argument('--output', required=True,
+                        help='index file to create')
+    parser.add_argument('--format', required=False, choices=['pgn', 'epd'],
+                        help='format of the opening book, default is from the file extension')
+    parser.add_argument('--plies', required=False, type=int, default=10000,
+                        help='maximum number of plies read from pgn games, default=10000')
+
+    args = parser.parse_args()
+
+    count = compile_index(args.input, args.output, args.format, args.plies)
+    print(f'{count} unique positions saved in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
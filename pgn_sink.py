@@ -0,0 +1,220 @@
+"""
+pgn_sink.py
+
+A single writer for the games of concurrent matches. Games are put on a
+queue and a writer thread appends them to the pgn file in batches, so that
+games of concurrent matches are never interleaved.
+
+The file can be compressed with gzip or zstd (requires the zstandard
+package) and rotated when it is larger than max_mb or every
+iterations_per_file iterations. Every batch is written as a complete gzip
+member or zstd frame, and an index file <pgn file>.idx records for every
+batch its file, iteration, byte offset, byte size and number of games.
+A batch can then be read with read_batch() without reading the file.
+"""
+
+
+import gzip
+import queue
+import threading
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIONS = ['none', 'gzip', 'zstd']
+SUFFIX = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Maximum number of queued games written in one batch.
+MAX_BATCH = 256
+
+
+def get_compression(fn):
+    """
+    Return the compression of a file from its suffix.
+    """
+    suffix = Path(fn).suffix.lower()
+    if suffix == '.gz':
+        return 'gzip'
+    if suffix == '.zst':
+        return 'zstd'
+    return 'none'
+
+
+def compress(data, compression):
+    if compression == 'gzip':
+        return gzip.compress(data)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def count_games(text):
+    return text.count('[Event ')
+
+
+class PgnSink:
+    def __init__(self, fn, compression=None, max_mb=None, iterations_per_file=None,
+                 index=True):
+        """
+        fn is the pgn file like output_game.pgn, the suffix of the
+        compression is added if it is missing. compression is none, gzip
+        or zstd, by default it is taken from the suffix of fn. If the
+        file is rotated the files are numbered like output_game_0001.pgn.
+        Without index the batches are not recorded in the index file.
+        """
+        self.compression = compression or get_compression(fn)
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f'compression {self.compression} is not one of {COMPRESSIONS}')
+        if self.compression == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression requires the zstandard package, pip install zstandard')
+
+        path = Path(fn)
+        if SUFFIX[self.compression] and path.suffix.lower() == SUFFIX[self.compression]:
+            path = path.with_suffix('')
+        self.path = path
+        self.index_file = Path(f'{path}{SUFFIX[self.compression]}.idx') if index else None
+
+        self.max_bytes = None if max_mb is None else int(max_mb * 1024 * 1024)
+        self.iterations_per_file = iterations_per_file
+        self.rotate = self.max_bytes is not None or iterations_per_file is not None
+        self.part = 0
+        self.part_iteration = None
+        self.current_file = None
+        self.open_part(None)
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def part_file(self, part):
+        if not self.rotate:
+            return Path(f'{self.path}{SUFFIX[self.compression]}')
+        return Path(f'{self.path.with_suffix("")}_{part:04d}{self.path.suffix}{SUFFIX[self.compression]}')
+
+    def open_part(self, iteration):
+        """
+        Select the file of the next batch, a new file is started when the
+        current one is full or belongs to an older iteration group. The
+        numbering continues after the files of an earlier run.
+        """
+        if self.current_file is None:
+            while self.rotate and self.part_file(self.part + 1).exists():
+                self.part += 1
+            self.part = max(1, self.part)
+        elif self.rotate:
+            size = self.current_file.stat().st_size if self.current_file.exists() else 0
+            full = self.max_bytes is not None and size >= self.max_bytes
+            new_group = (self.iterations_per_file is not None and iteration is not None
+                         and self.part_iteration is not None
+                         and iteration // self.iterations_per_file != self.part_iteration // self.iterations_per_file)
+            if full or new_group:
+                self.part += 1
+                self.part_iteration = None
+
+        self.current_file = self.part_file(self.part)
+        if self.part_iteration is None:
+            self.part_iteration = iteration
+
+    def put(self, text, iteration=None):
+        """
+        Queue the pgn text of one or more games of an iteration.
+        """
+        self.queue.put((text, iteration))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            while len(batch) < MAX_BATCH:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self.write_batch(batch)
+            if stop:
+                return
+
+    def write_batch(self, batch):
+        """
+        Write the games of every iteration in the batch as one block.
+        """
+        iterations = []
+        for _, iteration in batch:
+            if iteration not in iterations:
+                iterations.append(iteration)
+
+        for iteration in iterations:
+            text = ''.join(t for t, it in batch if it == iteration)
+            self.open_part(iteration)
+            data = compress(text.encode(), self.compression)
+            with open(self.current_file, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+
+            if self.index_file is None:
+                continue
+            new_index = not self.index_file.exists()
+            with open(self.index_file, 'a') as f:
+                if new_index:
+                    f.write('file,iteration,offset,bytes,games\n')
+                f.write(f'{self.current_file.name},{"" if iteration is None else iteration},'
+                        f'{offset},{len(data)},{count_games(text)}\n')
+
+    def close(self):
+        """
+        Write the queued games and stop the writer thread.
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_index(index_file):
+    """
+    Return the batches of an index file as dicts.
+    """
+    batches = []
+    with open(index_file) as f:
+        header = f.readline().strip().split(',')
+        for line in f:
+            batch = dict(zip(header, line.strip().split(',')))
+            for k in ('offset', 'bytes', 'games'):
+                batch[k] = int(batch[k])
+            batches.append(batch)
+    return batches
+
+
+def read_batch(index_file, batch):
+    """
+    Return the pgn text of a batch of the index.
+    """
+    fn = Path(index_file).parent / batch['file']
+    with open(fn, 'rb') as f:
+        f.seek(batch['offset'])
+        data = f.read(batch['bytes'])
+    return decompress(data, get_compression(fn)).decode()
@@ -0,0 +1,391 @@
+"""
+replay.py
+
+Replay of the optimizer on a model of recorded matches, to compare
+settings of the SPSA algorithm without playing engine games.
+
+A response model is fitted from the matches of a results file of
+game_optimizer.py (--results-file): the Elo of a parameter set is the sum
+of a quadratic per parameter, fitted by weighted least squares on the Elo
+differences of the recorded matches. The minimizer is then run against the
+model, a match being simulated game by game with the draw rate of the
+recorded games, the games of the 2 matches of a gradient using the same
+random numbers like the same openings.
+
+Every variant is run with the same seeds and its convergence is printed,
+the Elo gained from the starting parameters at some iterations.
+
+Usage:
+  python replay.py --results-file results.sqlite --iteration 2000 --repeats 10
+      --variant "name=default" --variant "name=fast a=2.0 alpha=0.602"
+"""
+
+
+import argparse
+import copy
+import csv
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import spsa
+import utils
+
+
+APP_NAME = 'SPSA Replay'
+APP_VERSION = '0.1.0'
+
+# The SPSA options that a variant can set.
+VARIANT_OPTIONS = ['a', 'c', 'alpha', 'gamma', 'A', 'rounds', 'target_snr', 'min_rounds', 'max_rounds']
+
+# Iterations of the convergence table, in percent of the iterations.
+CHECKPOINTS = [10, 25, 50, 100]
+
+# Weight in games of the prior that every standardized term of the model
+# has no Elo, a match of a few games cannot move the fit far from it.
+DEFAULT_RIDGE = 1000
+
+
+def elo_from_score(score, games):
+    """
+    Return the Elo difference of a score, a score of 0 or 1 is limited to
+    half a game from it.
+    """
+    limit = 0.5 / max(games, 1)
+    score = min(max(score, limit), 1 - limit)
+    return -400 * math.log10(1 / score - 1)
+
+
+def score_from_elo(elo):
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def solve(a, b):
+    """
+    Return x of the linear system a x = b by Gaussian elimination with
+    partial pivoting, a is a list of rows.
+    """
+    n = len(b)
+    m = [row[:] + [v] for row, v in zip(a, b)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if m[col][col] == 0:
+            continue
+        for r in range(col + 1, n):
+            f = m[r][col] / m[col][col]
+            for k in range(col, n + 1):
+                m[r][k] -= f * m[col][k]
+    x = [0.0] * n
+    for r in reversed(range(n)):
+        if m[r][r] != 0:
+            x[r] = (m[r][n] - sum(m[r][k] * x[k] for k in range(r + 1, n))) / m[r][r]
+    return x
+
+
+class ResponseModel:
+    def __init__(self, param, coef, draw_rate=0.3, games_per_round=1.0, sampled=None):
+        """
+        param has the value, min, max and factor of every parameter like
+        in optimizer_setting.yml. coef has the Elo of every parameter as
+        (b, c) of b * x + c * x^2, where x is the value scaled from min to
+        max to 0 to 1. sampled has the (low, high) x of every parameter in
+        the recorded matches, the model is not used for the best values
+        outside of it.
+        """
+        self.param = param
+        self.coef = coef
+        self.draw_rate = draw_rate
+        self.games_per_round = games_per_round
+        self.sampled = sampled or {name: (0.0, 1.0) for name in coef}
+        self.residual = None  # Elo, weighted by the games of the matches
+        self.points = 0  # matches of the fit
+        self.match_option = {'rounds': 4, 'seed': None}
+        self.theta0 = None  # the start of the minimizer, for the regularization
+
+    def scale(self, name, value):
+        p = self.param[name]
+        return (value - p['min']) / ((p['max'] - p['min']) or 1)
+
+    def elo(self, values):
+        """
+        Return the Elo of the parameter values, a dict of engine values.
+        """
+        elo = 0.0
+        for name, (b, c) in self.coef.items():
+            x = self.scale(name, values[name])
+            elo += b * x + c * x * x
+        return elo
+
+    def best(self):
+        """
+        Return the parameter values of the highest Elo within the range of
+        the recorded matches.
+        """
+        values = {}
+        for name, (b, c) in self.coef.items():
+            low, high = self.sampled[name]
+            candidates = [low, high]
+            if c < 0:
+                candidates.append(min(max(-b / (2 * c), low), high))
+            x = max(candidates, key=lambda v: b * v + c * v * v)
+            p = self.param[name]
+            values[name] = p['min'] + x * (p['max'] - p['min'])
+        return values
+
+    @classmethod
+    def fit(cls, param, records, ridge=DEFAULT_RIDGE):
+        """
+        Fit the model on records, a list of dicts with the test and base
+        parameter values, the score and the games of a match. The Elo
+        difference of a match is weighted by its games. The terms are
+        standardized to a weighted mean square of 1 and ridge, in games, is
+        added to the diagonal, so that a term that the matches hardly
+        changed keeps an Elo near 0 instead of a large one fitted on noise.
+        """
+        names = list(param)
+        n = 2 * len(names)
+        model = cls(param, {})
+        rows, ys, ws = [], [], []
+        sampled = {}
+        for r in records:
+            row = []
+            for name in names:
+                xt, xb = model.scale(name, r['test'][name]), model.scale(name, r['base'][name])
+                row += [xt - xb, xt * xt - xb * xb]
+                low, high = sampled.get(name, (xt, xt))
+                sampled[name] = (min(low, xt, xb), max(high, xt, xb))
+            rows.append(row)
+            ys.append(elo_from_score(r['score'], r['games']))
+            ws.append(r['games'])
+
+        total = sum(ws)
+        scale = [math.sqrt(sum(w * row[i] ** 2 for row, w in zip(rows, ws)) / total) or 1.0
+                 for i in range(n)]
+        ata = [[0.0] * n for _ in range(n)]
+        atb = [0.0] * n
+        for row, y, w in zip(rows, ys, ws):
+            z = [v / s for v, s in zip(row, scale)]
+            for i in range(n):
+                atb[i] += w * z[i] * y
+                for j in range(n):
+                    ata[i][j] += w * z[i] * z[j]
+        for i in range(n):
+            ata[i][i] += ridge
+        x = [v / s for v, s in zip(solve(ata, atb), scale)]
+
+        model = cls(param, {name: (x[2 * k], x[2 * k + 1]) for k, name in enumerate(names)},
+                    sampled={name: sampled.get(name, (0.0, 1.0)) for name in names})
+        model.points = len(rows)
+        model.residual = math.sqrt(sum(w * (y - sum(a * b for a, b in zip(row, x))) ** 2
+                                       for row, y, w in zip(rows, ys, ws)) / total)
+        return model
+
+    def set_match_option(self, **kwargs):
+        self.match_option.update(kwargs)
+
+    def goal_function(self, i, base_theta, **theta):
+        """
+        The goal of a simulated match, see game_optimizer.goal_function().
+        The games of the 2 matches of a gradient use the same random
+        numbers as they have the same seed.
+        """
+        test = {name: int(v['value'] * v['factor']) for name, v in theta.items()}
+        base = {name: v['value'] for name, v in base_theta.items()}
+        score = score_from_elo(self.elo(test) - self.elo(base))
+
+        # The draws are taken from the middle of the game distribution so
+        # that wins and losses keep the expected score.
+        draw = min(self.draw_rate, 2 * min(score, 1 - score))
+        win = score - draw / 2
+        rng = random.Random(self.match_option.get('seed'))
+        games = max(1, round(self.match_option['rounds'] * self.games_per_round))
+        wdl = [0, 0, 0]
+        for _ in range(games):
+            u = rng.random()
+            wdl[0 if u < win else 1 if u < win + draw else 2] += 1
+
+        points = [1.0, 0.5, 0.0]
+        mean = sum(n * p for n, p in zip(wdl, points)) / games
+        var = sum(n * (p - mean) ** 2 for n, p in zip(wdl, points)) / games / games
+        regularization = utils.regulizer(utils.difference(theta, self.theta0), 0.01, 0.5)
+
+        return -mean + regularization, {'score': mean, 'wdl': wdl, 'games': games, 'var': var}
+
+
+def load_run(fn, run_id=None):
+    """
+    Return the parameters, the matches and the games per round of a run of
+    the results file fn, the last run by default.
+    """
+    conn = sqlite3.connect(fn)
+    if run_id is None:
+        row = conn.execute('SELECT id, config FROM runs ORDER BY id DESC LIMIT 1').fetchone()
+    else:
+        row = conn.execute('SELECT id, config FROM runs WHERE id = ?', (run_id,)).fetchone()
+    if row is None:
+        raise ValueError(f'no run {run_id or ""} in {fn}')
+    run_id, config = row[0], json.loads(row[1])
+    param = config['setting']['test_engine']['parameter_to_optimize']
+
+    records, ratios = [], []
+    draws = games = 0
+    for theta, perturbation, score, g, d, rounds in conn.execute(
+            'SELECT e.theta, e.perturbation, e.score, e.games, e.draws, i.rounds FROM evaluations e '
+            'LEFT JOIN iterations i ON i.run_id = e.run_id AND i.iter = e.iter '
+            'WHERE e.run_id = ? AND e.score IS NOT NULL AND e.games > 0', (run_id,)):
+        test, delta = json.loads(theta), json.loads(perturbation)
+        records.append({'test': test, 'base': {n: test[n] - delta[n] for n in test},
+                        'score': score, 'games': g})
+        draws += d or 0
+        games += g
+        if rounds:
+            ratios.append(g / rounds)
+    conn.close()
+
+    return param, records, draws / games if games else 0.3, statistics.median(ratios) if ratios else 1.0
+
+
+def get_theta0(param):
+    """
+    Return the start of the minimizer like game_optimizer.py, the values
+    divided by their factor.
+    """
+    theta0 = utils.apply_limits(copy.deepcopy(param), is_factor=False)
+    for name, v in theta0.items():
+        theta0[name] = {'value': int(v['value']) / int(v['factor']), 'min': int(v['min']),
+                        'max': int(v['max']), 'factor': int(v['factor'])}
+    return theta0
+
+
+def run_variant(model, options, iterations, seed, plot_file):
+    """
+    Run the minimizer with options against the model, return the Elo of
+    the parameters of every iteration from the plot data.
+    """
+    theta0 = get_theta0(model.param)
+    model.theta0 = theta0
+    model.match_option = {'rounds': options.get('rounds', 4), 'seed': None}
+    random.seed(seed)
+    minimizer = spsa.SPSA_minimization(model.goal_function, copy.deepcopy(theta0), iterations,
+                                       options={**options, 'parallel': False,
+                                                'plot_data_file': plot_file},
+                                       set_match_option=model.set_match_option)
+    with open(os.devnull, 'w') as f, redirect_stdout(f):
+        minimizer.run()
+
+    with open(plot_file) as f:
+        return [model.elo({n: float(row[n]) for n in model.param}) for row in csv.DictReader(f)]
+
+
+def parse_variant(text):
+    """
+    Return the name and the options of a variant like "name=fast a=2.0".
+    """
+    name, options = None, {}
+    for item in text.split():
+        key, value = item.split('=', 1)
+        if key == 'name':
+            name = value
+        elif key in VARIANT_OPTIONS:
+            options[key] = int(value) if key in ['rounds', 'min_rounds', 'max_rounds'] else float(value)
+        else:
+            raise ValueError(f'unknown variant option {key}, options are {", ".join(VARIANT_OPTIONS)}')
+    return name or text, options
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (APP_NAME, APP_VERSION),
+        description='Run the SPSA minimizer on a model of the matches of a results file\n'
+                    'to compare algorithm settings without engine games.',
+        epilog='%(prog)s', formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--results-file', required=True,
+                        help='results file of game_optimizer.py --results-file')
+    parser.add_argument('--run', required=False, type=int, default=None,
+                        help='run id in the results file, default=the last run')
+    parser.add_argument('--iteration', required=False, type=int, default=1000,
+                        help='iterations of every run of the minimizer, default=1000')
+    parser.add_argument('--repeats', required=False, type=int, default=5,
+                        help='runs of every variant with different seeds, default=5')
+    parser.add_argument('--rounds', required=False, type=int, default=None,
+                        help='games per match, default=the median rounds of the run')
+    parser.add_argument('--variant', required=False, action='append', default=None,
+                        help='a variant of the minimizer options, can be repeated, example:\n'
+                             '--variant "name=slow a=0.5 c=0.05"\n'
+                             f'options: {", ".join(VARIANT_OPTIONS)}, default: one variant\n'
+                             'with the default options')
+    parser.add_argument('--seed', required=False, type=int, default=1,
+                        help='seed of the first run of every variant, default=1')
+    parser.add_argument('--output', required=False, default=None,
+                        help='write the Elo of every iteration to this csv file')
+    parser.add_argument('--ridge', required=False, type=float, default=DEFAULT_RIDGE,
+                        help='weight in games of the prior that a parameter has no Elo,\n'
+                             f'default={DEFAULT_RIDGE}')
+
+    args = parser.parse_args()
+
+    param, records, draw_rate, games_per_round = load_run(args.results_file, args.run)
+    if not records:
+        print(f'No match in {args.results_file}.')
+        return 1
+    model = ResponseModel.fit(param, records, args.ridge)
+    model.draw_rate, model.games_per_round = draw_rate, games_per_round
+
+    print(f'model from {len(records)} matches, draw rate: {draw_rate:0.3f}')
+    theta0_values = {n: v['value'] for n, v in param.items()}
+    best = model.best()
+    for name, (b, c) in model.coef.items():
+        print(f'  {name}: elo {b:+0.1f} x {c:+0.1f} x^2, best: {best[name]:0.0f}')
+    print(f'elo of the best parameters over the start: {model.elo(best) - model.elo(theta0_values):+0.1f}, '
+          f'fit residual: {model.residual:0.1f} elo over {model.points} matches')
+
+    variants = [parse_variant(v) for v in args.variant or ['name=default']]
+    elo0 = model.elo(theta0_values)
+    rows = []
+
+    print(f'\n{"variant":20s} {"it/s":>8s} ' + ' '.join(f'{f"@{p}%":>8s}' for p in CHECKPOINTS)
+          + f' {"sd":>6s}')
+    with tempfile.TemporaryDirectory() as tmp:
+        logging.disable(logging.INFO)
+        try:
+            for name, options in variants:
+                if args.rounds is not None:
+                    options.setdefault('rounds', args.rounds)
+                gains, t = [], time.perf_counter()
+                for rep in range(args.repeats):
+                    elos = run_variant(model, options, args.iteration, args.seed + rep,
+                                       os.path.join(tmp, 'plot_data.csv'))
+                    gains.append([e - elo0 for e in elos])
+                    rows += [[name, rep + 1, it, f'{g:0.2f}'] for it, g in enumerate(gains[-1], 1)]
+                speed = args.repeats * args.iteration / (time.perf_counter() - t)
+
+                at = [statistics.mean(g[max(0, len(g) * p // 100 - 1)] for g in gains)
+                      for p in CHECKPOINTS]
+                sd = statistics.stdev(g[-1] for g in gains) if len(gains) > 1 else 0.0
+                print(f'{name:20s} {speed:8.0f} ' + ' '.join(f'{v:+8.1f}' for v in at) + f' {sd:6.1f}')
+        finally:
+            logging.disable(logging.NOTSET)
+
+    print(f'\nElo gained from the start parameters, mean of {args.repeats} runs of '
+          f'{args.iteration} iterations, sd of the last iteration.')
+
+    if args.output is not None:
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['variant', 'run', 'iter', 'elo'])
+            writer.writerows(rows)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+resources.py
+
+Admission control of concurrent games from the Threads and Hash options of
+the engines and the cores and memory of the machine, and the cores of the
+game slots when the engines are pinned to cores.
+"""
+
+
+import os
+
+
+# Memory used by an engine besides its hash, in mb.
+ENGINE_OVERHEAD_MB = 32
+
+
+def get_cores():
+    """
+    Return the number of cores this process can use.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_memory_mb():
+    """
+    Return the physical memory in mb or None if it is not known.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        pass
+
+    # Windows
+    try:
+        import ctypes
+
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+        return status.ullTotalPhys // (1024 * 1024)
+    except (AttributeError, OSError):
+        return None
+
+
+def get_budget(machine=None):
+    """
+    Return the cores and memory in mb that can be used by the games.
+
+    machine is the machine setting, all keys are optional, example:
+    {'cores': 8, 'memory_mb': 16000, 'reserve_cores': 1, 'reserve_memory_mb': 1024}
+    cores and memory_mb are detected if not given. The reserve is left for
+    the optimizer, the tournament manager and the system.
+    """
+    machine = machine or {}
+    cores = machine.get('cores') or get_cores()
+    memory_mb = machine.get('memory_mb') or get_memory_mb()
+    reserve_cores = machine.get('reserve_cores', 1)
+    reserve_memory_mb = machine.get('reserve_memory_mb', 1024)
+
+    budget = {'cores': cores, 'memory_mb': memory_mb,
+              'game_cores': max(1, cores - reserve_cores),
+              'game_memory_mb': None}
+    if memory_mb is not None:
+        budget['game_memory_mb'] = max(0, memory_mb - reserve_memory_mb)
+
+    return budget
+
+
+def get_game_cost(test_option, base_option, ponder=False):
+    """
+    Return the cores and memory in mb used by one game between the engines
+    with the options test_option and base_option like {'Threads': 2, 'Hash': 64}.
+    Without ponder only the engine to move is searching.
+    """
+    test_threads = int(test_option.get('Threads', 1))
+    base_threads = int(base_option.get('Threads', 1))
+    cores = test_threads + base_threads if ponder else max(test_threads, base_threads)
+
+    memory_mb = (int(test_option.get('Hash', 16)) + int(base_option.get('Hash', 16))
+                 + 2 * ENGINE_OVERHEAD_MB)
+
+    return {'cores': cores, 'memory_mb': memory_mb}
+
+
+def admit(budget, game_cost, concurrency, matches=2):
+    """
+    Return (concurrency, matches): the games per match and the number of
+    matches run in parallel that fit in the budget. concurrency is the
+    requested games per match.
+    """
+    games = budget['game_cores'] // game_cost['cores']
+    if budget['game_memory_mb'] is not None:
+        games = min(games, budget['game_memory_mb'] // game_cost['memory_mb'])
+    games = max(1, games)
+
+    # The matches are run one at a time if there is room for one game only.
+    if games < matches:
+        matches = 1
+
+    return max(1, min(concurrency, games // matches)), matches
+
+
+def parse_cores(text):
+    """
+    Return the cores of a list like "2-5,8" as [2, 3, 4, 5, 8].
+    """
+    cores = []
+    for part in str(text).split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = part.split('-')
+            cores.extend(range(int(first), int(last) + 1))
+        elif part:
+            cores.append(int(part))
+    return cores
+
+
+def format_cores(cores):
+    """
+    Return cores like [2, 3, 4, 5, 8] as "2-5,8".
+    """
+    parts = []
+    for c in sorted(cores):
+        if parts and c == parts[-1][1] + 1:
+            parts[-1][1] = c
+        else:
+            parts.append([c, c])
+    return ','.join(f'{a}' if a == b else f'{a}-{b}' for a, b in parts)
+
+
+def get_affinity_cores(reserve_cores=1):
+    """
+    Return the cores this process can use less the first reserve_cores,
+    which are left for the optimizer, the tournament manager and the
+    system. Return None if the cores of a process cannot be set, it is
+    only supported on Linux.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    cores = sorted(os.sched_getaffinity(0))
+    return cores[reserve_cores:] or cores[-1:]
+
+
+def split_cores(cores, parts):
+    """
+    Split cores in parts lists of consecutive cores, one per parallel
+    match. The lists are the same if there are fewer cores than parts.
+    """
+    size = len(cores) // parts
+    if size == 0:
+        return [cores] * parts
+    return [cores[i * size:(i + 1) * size] for i in range(parts)]
+
+
+def get_core_sets(cores, slots, cores_per_slot=1):
+    """
+    Return the cores of every game slot, both engines of a game use the
+    cores of its slot as only the engine to move is searching. If there
+    are not enough cores, the slots share the core sets.
+    """
+    cores_per_slot = max(1, min(cores_per_slot, len(cores)))
+    count = len(cores) // cores_per_slot
+    sets = [cores[i * cores_per_slot:(i + 1) * cores_per_slot] for i in range(count)]
+    return [sets[slot % count] for slot in range(slots)]
@@ -0,0 +1,154 @@
+"""
+results_store.py
+
+An sqlite file with the results of the optimizer runs, to answer questions
+like which iterations had time losses without reading the logs. The rows
+of an iteration are written at once after the iteration.
+
+  runs         a row per optimizer run with its configuration
+  iterations   a row per iteration, the mean goals, games and parameters
+  evaluations  a row per match, the parameters, the perturbation, the
+               score, W/D/L, pentanomial counts and timings
+  games        a row per game, the opening, result, termination, plies,
+               duration and the time control factor of the machine
+
+Example:
+  SELECT DISTINCT iter FROM games WHERE termination LIKE '%time%';
+"""
+
+
+import hashlib
+import json
+import sqlite3
+import time
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    config_hash TEXT NOT NULL,
+    config TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS iterations (
+    run_id INTEGER NOT NULL,
+    iter INTEGER NOT NULL,
+    mean_best_goal REAL,
+    mean_all_goal REAL,
+    rounds INTEGER,
+    games INTEGER,
+    snr REAL,
+    seed INTEGER,
+    failures INTEGER,
+    duration REAL,
+    games_per_hour REAL,
+    theta TEXT,
+    PRIMARY KEY (run_id, iter)
+);
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL,
+    iter INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    num INTEGER NOT NULL,
+    seed INTEGER,
+    goal REAL,
+    score REAL,
+    wins INTEGER,
+    draws INTEGER,
+    losses INTEGER,
+    penta TEXT,
+    games INTEGER,
+    failures INTEGER,
+    duration REAL,
+    play_time REAL,
+    error TEXT,
+    theta TEXT,
+    perturbation TEXT
+);
+CREATE TABLE IF NOT EXISTS games (
+    evaluation_id INTEGER NOT NULL,
+    run_id INTEGER NOT NULL,
+    iter INTEGER NOT NULL,
+    game INTEGER,
+    white TEXT,
+    black TEXT,
+    result TEXT,
+    termination TEXT,
+    opening TEXT,
+    plies INTEGER,
+    duration REAL,
+    tc_factor REAL
+);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (config_hash);
+CREATE INDEX IF NOT EXISTS evaluations_iter ON evaluations (run_id, iter);
+CREATE INDEX IF NOT EXISTS games_iter ON games (run_id, iter);
+CREATE INDEX IF NOT EXISTS games_termination ON games (termination);
+'''
+
+
+class ResultsStore:
+    def __init__(self, fn, config):
+        """
+        Open or create the results file fn and add a run with config, a
+        json serializable dict like the setting file and the command line
+        options. Runs with the same config have the same config_hash.
+        """
+        self.fn = fn
+        self.conn = sqlite3.connect(fn, timeout=60)
+        self.conn.executescript(SCHEMA)
+        text = json.dumps(config, sort_keys=True, default=str)
+        config_hash = hashlib.sha256(text.encode()).hexdigest()
+        with self.conn:
+            cur = self.conn.execute('INSERT INTO runs (started, config_hash, config) VALUES (?, ?, ?)',
+                                    (time.time(), config_hash, text))
+        self.run_id = cur.lastrowid
+
+    def add_iteration(self, iteration, evaluations):
+        """
+        Write an iteration and its evaluations in one transaction.
+
+        iteration is a dict with the columns of the iterations table, theta
+        is a dict of the parameter values. evaluations is a list of dicts
+        with the columns of the evaluations table, wdl, and game_list, the
+        games of the match from chess_match.py.
+        """
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO iterations (run_id, iter, mean_best_goal, mean_all_goal, rounds, '
+                'games, snr, seed, failures, duration, games_per_hour, theta) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (self.run_id, iteration['iter'], iteration.get('mean_best_goal'),
+                 iteration.get('mean_all_goal'), iteration.get('rounds'), iteration.get('games'),
+                 iteration.get('snr'), iteration.get('seed'), iteration.get('failures'),
+                 iteration.get('duration'), iteration.get('games_per_hour'),
+                 json.dumps(iteration.get('theta'))))
+
+            for e in evaluations:
+                wdl = e.get('wdl') or [None, None, None]
+                cur = self.conn.execute(
+                    'INSERT INTO evaluations (run_id, iter, attempt, num, seed, goal, score, wins, draws, '
+                    'losses, penta, games, failures, duration, play_time, error, theta, perturbation) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (self.run_id, iteration['iter'], e['attempt'], e['num'], e.get('seed'),
+                     e.get('goal'), e.get('score'), wdl[0], wdl[1], wdl[2],
+                     json.dumps(e.get('penta')), e.get('games'), e.get('failures'),
+                     e.get('duration'), e.get('play_time'), e.get('error'),
+                     json.dumps(e.get('theta')), json.dumps(e.get('perturbation'))))
+                self.conn.executemany(
+                    'INSERT INTO games (evaluation_id, run_id, iter, game, white, black, result, '
+                    'termination, opening, plies, duration, tc_factor) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [(cur.lastrowid, self.run_id, iteration['iter'], g.get('game'), g.get('white'),
+                      g.get('black'), g.get('result'), g.get('termination'), g.get('fen'),
+                      g.get('plies'), g.get('duration'), g.get('tc_factor'))
+                     for g in e.get('game_list') or []])
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
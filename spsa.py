@@ -11,9 +11,13 @@ import logging
 import copy
 import multiprocessing
 import time
+import os
 from pathlib import Path
 
 import utils
+import metrics
+import results_store
+import events
 
 
 logging.basicConfig(format='%(asctime)s : %(message)s', level=logging.INFO,
@@ -28,7 +32,7 @@ class SPSA_minimization:
 
     def __init__(self, f, theta0, max_iter, constraints=None, options={},
                  stop_all_mean_goal=-0.95, stop_best_mean_goal=-0.95,
-                 stop_min_iter=10000):
+                 stop_min_iter=10000, set_match_option=None):
         """
         The constructor of a SPSA_minimization object.
 
@@ -54,6 +58,19 @@ class SPSA_minimization:
                 Optional settings of the SPSA algorithm parameters. Default
                 values taken from the reference articles are used if not
                 present in options.
+            set_match_option (function, optional) :
+                A function called with keyword arguments like iteration=5,
+                rounds=8 or seed=1234 before the evaluations of a gradient
+                are started.
+                The seed is common to the two evaluations of a gradient.
+                After the two evaluations it is called with accepted=True,
+                or accepted=False if one of them failed and they are not
+                used.
+
+        The function f may return the goal alone or a tuple (goal, stats)
+        where stats is a dict with the number of games and the variance of
+        the goal, see update_rounds(). If f raises an exception the matches
+        are played again, see approximate_gradient().
         """
 
         # Store the arguments
@@ -87,9 +104,31 @@ class SPSA_minimization:
 
         self.A = options.get("A", max_iter / 10.0)
 
+        # Games per evaluation. If target_snr is set, the rounds are
+        # adapted so that the signal-to-noise ratio of the difference of
+        # the two evaluations of a gradient is close to target_snr.
+        self.set_match_option = set_match_option
+        self.rounds = options.get("rounds", None)
+        self.target_snr = options.get("target_snr", None)
+        self.min_rounds = options.get("min_rounds", 4)
+        self.max_rounds = options.get("max_rounds", 64)
+        self.unit_var_avg = None  # variance of a one-game evaluation
+        self.diff2_avg = None  # (f1 - f2)^2
+        self.var_sum_avg = None  # var(f1) + var(f2)
+        self.snr = 0.0
+        self.iter_rounds = self.rounds
+        self.iter_games = 0
+        self.pair_seed = None
+
+        # A failed match is played again with a new seed. After max_failures
+        # failures the gradient of the iteration is zero.
+        self.max_failures = options.get("max_failures", 3)
+        self.iter_failures = 0
+
         # This optimizer requires 2 engine matches to get the gradient.
         # We start the parallel match at iteration equals iter_parallel_start.
-        self.iter_parallel_start = 2
+        # The matches are never run in parallel if the parallel option is False.
+        self.iter_parallel_start = 2 if options.get("parallel", True) else math.inf
 
         # After every match the goal or score of an engine match is saved.
         # It is save in all_goal_history and best_goal_history.
@@ -98,9 +137,48 @@ class SPSA_minimization:
         self.stop_min_iter = stop_min_iter
 
         # Save param, value and best mean goal and total mean goal
-        self.plot_data_file = 'plot_data.csv'
+        self.plot_data_file = options.get("plot_data_file", 'plot_data.csv')
         self.init_plot_output()
 
+        # Timing spans of every iteration, with the spans of the matches.
+        # If metrics_file is set they are written to <metrics_file>.csv and
+        # <metrics_file>.prom with the games per hour and the use of the cores.
+        self.metrics_file = options.get("metrics_file", None)
+        self.cores = options.get("cores", None) or os.cpu_count() or 1
+        self.iter_metrics = metrics.Metrics()
+        self.total_metrics = metrics.Metrics()
+        if self.metrics_file is not None:
+            Path(f'{self.metrics_file}.csv').unlink(missing_ok=True)
+
+        # The iterations, matches and games are saved in the sqlite file
+        # results_file, with results_config as the configuration of the run.
+        self.results = None
+        if options.get("results_file") is not None:
+            self.results = results_store.ResultsStore(options["results_file"],
+                                                      options.get("results_config", {}))
+        self.iter_evaluations = []
+
+        # A control.Control to pause, stop or change the games per match
+        # between two iterations, its status is updated after every iteration.
+        self.control = options.get("control", None)
+
+        # In quiet mode the console gets a one-line summary at most every
+        # progress_interval seconds instead of the parameters of every match.
+        self.quiet = options.get("quiet", False)
+        self.progress_interval = options.get("progress_interval", 10)
+        self.progress_time = None
+
+    def __getstate__(self):
+        """
+        The minimizer is sent to the match processes with evaluate_goal(),
+        the results file and the control server stay in the parent.
+        """
+        state = self.__dict__.copy()
+        state['results'] = None
+        state['control'] = None
+        state['options'] = {k: v for k, v in self.options.items() if k != 'control'}
+        return state
+
     def init_plot_output(self):
         """
         Delete existing csv output file and add headers.
@@ -109,7 +187,7 @@ class SPSA_minimization:
         csvoutfn.unlink(missing_ok=True)
 
         with open(self.plot_data_file, 'a') as f:
-            f.write('iter,bestmeangoal,bestallgoal,')
+            f.write('iter,bestmeangoal,bestallgoal,rounds,games,snr,seed,failures,')
             for i, k in enumerate(list(self.theta0.keys())):
                 if i < len(self.theta0) - 1:
                     f.write(f'{k},')
@@ -132,17 +210,30 @@ class SPSA_minimization:
         theta = self.theta0
 
         while True:
+            if self.control is not None:
+                request = self.control.next_iteration()
+                if request['stop']:
+                    print('Stop optimization on request!')
+                    logging.info(f'{__file__} > stop on request after iter {k}')
+                    break
+                if request['concurrency'] is not None and self.set_match_option is not None:
+                    self.out(f'concurrency per match: {request["concurrency"]}')
+                    logging.info(f'{__file__} > concurrency per match: {request["concurrency"]}')
+                    self.set_match_option(concurrency=request['concurrency'])
+
             k = k + 1
 
             self.iter = k
-            print(f'starting iter {k} ...')
+            self.out(f'starting iter {k} ...')
+            t_iter = time.perf_counter()
+            self.iter_metrics = metrics.Metrics()
 
             if self.constraints is not None:
                 theta = self.constraints(theta)
 
-            print('current param:')
+            self.out('current param:')
             for name, value in utils.true_param(theta).items():
-                print(f'  {name}: {value["value"]}')
+                self.out(f'  {name}: {value["value"]}')
 
             c_k = self.c / (k ** self.gamma)
             a_k = self.a / ((k + self.A) ** self.alpha)
@@ -151,13 +242,13 @@ class SPSA_minimization:
             # print(f'  ak: {a_k:0.5f}')
 
             # Run the engine match here to get the gradient
-            print('Run engine match ...')
+            self.out('Run engine match ...')
             gradient = self.approximate_gradient(theta, c_k, k)
 
             # For SPSA we update with a small step (theta = theta - a_k * gradient)
             if is_spsa:
                 theta = utils.linear_combinaison(1.0, theta, -a_k, gradient)
-                logging.info(f'{__file__} > theta from spsa: {theta}')
+                events.debug(__file__, 'theta from spsa', theta=theta)
                 # print(f'new param after application of gradient:')
                 # for n, v in theta.items():
                 #     print(f'  {n}: {int(v["value"] * v["factor"])}')
@@ -173,46 +264,56 @@ class SPSA_minimization:
 
             # Apply parameter limits
             theta = utils.apply_limits(theta)
-            logging.info(f'{__file__} > theta with limits: {theta}')
+            events.debug(__file__, 'theta with limits', theta=theta)
             # print(f'new param after application of limits:')
             # for n, v in theta.items():
             #     print(f'  {n}: {int(v["value"] * v["factor"])}')
 
-            # We then move to the point which gives the best average of goal
-            (avg_goal, avg_theta) = self.average_best_evals(30)
-            logging.info(f'{__file__} > avg_theta from average_best_evals: {avg_theta}')
+            # We then move to the point which gives the best average of goal.
+            # There is none yet if the matches of the first iterations failed.
+            if self.best_count > 0:
+                (avg_goal, avg_theta) = self.average_best_evals(30)
+                events.debug(__file__, 'avg_theta from average_best_evals', avg_theta=avg_theta)
 
-            theta = utils.linear_combinaison(0.98, theta, 0.02, avg_theta)
-            logging.info(f'{__file__} > theta with avg_theta: {theta}')
+                theta = utils.linear_combinaison(0.98, theta, 0.02, avg_theta)
+                events.debug(__file__, 'theta with avg_theta', theta=theta)
             # print(f'new param after application of best average param:')
             # for n, v in theta.items():
             #     print(f'  {n}: {int(v["value"] * v["factor"])}')
 
             # Apply parameter limits
             theta = utils.apply_limits(theta)  # This is the best param.
-            logging.info(f'{__file__} > best param: {theta}')
             # print(f'new param after application of limits:')
             # for n, v in theta.items():
             #     print(f'  {n}: {int(v["value"] * v["factor"])}')
 
             # Log best param values
-            for kv, vv in theta.items():
-                logging.info(f'<best> iter: {k}, param: {kv}, value: {int(vv["value"]*vv["factor"])}')
-            print('best param:')
-            for n, v in theta.items():
-                print(f'  {n}: {int(v["value"] * v["factor"])}')
-
-            mean_all_goal, _ = self.average_evaluations(30)
-            print(f'mean all goal: {mean_all_goal}')
-
-            mean_best_goal, _ = self.average_best_evals(30)
-            print(f'mean best goal: {mean_best_goal}')
+            best_param = {n: int(v['value'] * v['factor']) for n, v in theta.items()}
+            events.info(__file__, 'best param', iter=k, param=best_param)
+            self.out('best param:')
+            for n, v in best_param.items():
+                self.out(f'  {n}: {v}')
+
+            mean_all_goal = SPSA_minimization.BAD_GOAL
+            if self.history_count > 0:
+                mean_all_goal, _ = self.average_evaluations(30)
+            self.out(f'mean all goal: {mean_all_goal}')
+
+            mean_best_goal = SPSA_minimization.BAD_GOAL
+            if self.best_count > 0:
+                mean_best_goal, _ = self.average_best_evals(30)
+            self.out(f'mean best goal: {mean_best_goal}')
 
             # Save data in csv for plotting.
             plot_data = {}
             plot_data.update({'iter': k})
             plot_data.update({'meanbestgoal': mean_best_goal})
             plot_data.update({'meanallgoal': mean_all_goal})
+            plot_data.update({'rounds': self.iter_rounds})
+            plot_data.update({'games': self.iter_games})
+            plot_data.update({'snr': f'{self.snr:0.3f}'})
+            plot_data.update({'seed': self.pair_seed})
+            plot_data.update({'failures': self.iter_failures})
             plot_theta = utils.true_param(theta)
             for name, value in plot_theta.items():
                 plot_data.update({name: value["value"]})
@@ -226,9 +327,30 @@ class SPSA_minimization:
                     else:
                         f.write(f'{value},')
 
-            print(f'done iter {k} / {self.max_iter}')
+            iter_time = time.perf_counter() - t_iter
+            gauges = self.write_metrics(k, iter_time)
+            if self.results is not None:
+                self.results.add_iteration({'iter': k, 'mean_best_goal': mean_best_goal,
+                                            'mean_all_goal': mean_all_goal, 'rounds': self.iter_rounds,
+                                            'games': self.iter_games, 'snr': self.snr,
+                                            'seed': self.pair_seed, 'failures': self.iter_failures,
+                                            'duration': iter_time,
+                                            'games_per_hour': gauges['games_per_hour'],
+                                            'theta': {n: v['value'] for n, v in plot_theta.items()}},
+                                           self.iter_evaluations)
+            if self.control is not None:
+                self.control.set_status(iteration=k, max_iter=self.max_iter,
+                                        games=self.iter_games, rounds=self.iter_rounds,
+                                        failures=self.iter_failures,
+                                        games_per_hour=round(gauges['games_per_hour'], 1),
+                                        mean_all_goal=mean_all_goal, mean_best_goal=mean_best_goal,
+                                        theta={n: v['value'] for n, v in plot_theta.items()})
+
+            self.out(f'done iter {k} / {self.max_iter}')
             logging.info(f'{__file__} > done iter {k} / {self.max_iter}')
-            print('=========================================')
+            self.out('=========================================')
+            self.progress(k, iter_time, gauges['games_per_hour'], mean_best_goal, mean_all_goal,
+                          last=k >= self.max_iter)
 
             # Stopping rule 1: Average goal and iteration meet the
             # stop_all_mean_goal and stop_min_iter criteria.
@@ -247,8 +369,76 @@ class SPSA_minimization:
                 print('Stop opimization due to max iteration!')
                 break
 
+        if self.results is not None:
+            self.results.close()
+
         return utils.true_param(theta)
 
+    def out(self, *args):
+        """
+        Print to the console unless in quiet mode.
+        """
+        if not self.quiet:
+            print(*args)
+
+    def progress(self, k, iter_time, games_per_hour, mean_best_goal, mean_all_goal, last=False):
+        """
+        In quiet mode print a one-line summary of iteration k, at most every
+        progress_interval seconds, and for the first and last iterations.
+        """
+        if not self.quiet:
+            return
+        now = time.monotonic()
+        if not last and self.progress_time is not None and now - self.progress_time < self.progress_interval:
+            return
+        self.progress_time = now
+        print(f'iter {k}/{self.max_iter}, {iter_time:0.1f}s/iter, {games_per_hour:0.0f} games/h, '
+              f'rounds: {self.iter_rounds}, failures: {self.iter_failures}, '
+              f'mean best goal: {mean_best_goal:0.5f}, mean all goal: {mean_all_goal:0.5f}', flush=True)
+
+    def write_metrics(self, k, iter_time):
+        """
+        Add the spans of the optimizer to the spans of iteration k, then
+        write them with the games per hour and the use of the cores by the
+        games, the time of the games divided by the time of the cores.
+        Return the gauges.
+        """
+        self.iter_metrics.observe('spsa.iteration', iter_time)
+        self.iter_metrics.observe('spsa.math', iter_time - self.iter_metrics.total('spsa.matches'))
+        self.total_metrics.merge(self.iter_metrics.snapshot())
+
+        gauges = {'games_per_hour': self.iter_games * 3600 / iter_time,
+                  'core_utilization': self.iter_metrics.total('duel.play') / (iter_time * self.cores)}
+        logging.info(f'{__file__} > iter {k} metrics: {gauges}, '
+                     f'spans: { {n: round(h.sum, 3) for n, h in self.iter_metrics.spans.items()} }')
+
+        if self.metrics_file is not None:
+            metrics.write_csv(f'{self.metrics_file}.csv', k, self.iter_metrics, gauges)
+            metrics.write_prometheus(f'{self.metrics_file}.prom', self.total_metrics,
+                                     {**gauges, 'iteration': k})
+
+        return gauges
+
+    def add_evaluation(self, attempt, num, theta_i, theta, goal, stats):
+        """
+        Keep the result of match num of the iteration for the results file,
+        the perturbation is theta_i - theta in engine values.
+        """
+        if self.results is None:
+            return
+        spans = stats.get('metrics') or {}
+        true_i, true = utils.true_param(theta_i), utils.true_param(theta)
+        self.iter_evaluations.append({
+            'attempt': attempt, 'num': num, 'seed': stats.get('seed', self.pair_seed),
+            'goal': goal, 'score': stats.get('score'), 'wdl': stats.get('wdl'),
+            'penta': stats.get('penta'), 'games': stats.get('games'),
+            'failures': stats.get('failures'), 'error': stats.get('error'),
+            'duration': spans.get('optimizer.match_process', {}).get('sum'),
+            'play_time': spans.get('duel.play', {}).get('sum'),
+            'theta': {n: v['value'] for n, v in true_i.items()},
+            'perturbation': {n: true_i[n]['value'] - true[n]['value'] for n in true_i},
+            'game_list': stats.get('game_list')})
+
     def evaluate_goal(self, theta, old_theta, i, res, iter):
         """
         Return the evaluation of the goal function f at point theta.
@@ -264,20 +454,24 @@ class SPSA_minimization:
 
         base_theta = utils.true_param(old_theta)
 
-        v = self.f(i, base_theta, **theta)
+        # A failed match returns the goal None and the error.
+        try:
+            v = self.f(i, base_theta, **theta)
+        except Exception as ex:
+            logging.exception(f'{__file__} > match {i + 1} failed')
+            v = (None, {'error': repr(ex)})
+        stats = {}
+        if isinstance(v, tuple):
+            v, stats = v
 
-        # Store the value in history. This is only stored if iter is below
-        # iter_parallel_start, otherwise we store the history after the
-        # parallel matches are both finished.
-        self.history_eval[self.history_count % 1000] = v
-        self.history_theta[self.history_count % 1000] = theta
-        self.history_count += 1
+        # The history is stored by approximate_gradient() once both
+        # evaluations of the gradient are done.
 
         # Todo: Improve method to return values.
         if iter < self.iter_parallel_start:
-            return v  # Run match one at a time
+            return v, stats  # Run match one at a time
 
-        res[i] = v  # Run matches in parallel
+        res[i] = (v, stats)  # Run matches in parallel
 
     def approximate_gradient(self, theta, c, iter):
         """
@@ -296,14 +490,27 @@ class SPSA_minimization:
 
         logging.info(f'{__file__} > current_goal: {current_goal}')
 
-        print(f'current optimizer mean goal: {current_goal:0.5f} (low is better, lowest: -1.0, highest: 1.0)')
+        self.out(f'current optimizer mean goal: {current_goal:0.5f} (low is better, lowest: -1.0, highest: 1.0)')
         # print(f'Sample, optimizer goal = -(engine match score) or -(3.0 pts/4 games) or -0.75')
 
         bernouilli = self.create_bernouilli(theta)
 
+        if self.set_match_option is not None:
+            self.set_match_option(iteration=iter)
+            if self.rounds is not None:
+                self.set_match_option(rounds=self.rounds)
+
+        self.iter_rounds = self.rounds
+        self.iter_games = 0
+        self.iter_failures = 0
+        self.pair_seed = None
+        self.iter_evaluations = []
+        skipped = False
         count = 0
+        attempt = 0
         while True:
-            logging.info(f'{__file__} Apply bernouilli term to theta, theta={theta}, c={c}, bernouilli={bernouilli}')
+            attempt += 1
+            events.debug(__file__, 'apply bernouilli term to theta', theta=theta, c=c, bernouilli=bernouilli)
             # Calculate two evaluations of f at points M + c * bernouilli and
             # M - c * bernouilli to estimate the gradient. We do not want to
             # use a null gradient, so we loop until the two functions evaluations
@@ -311,81 +518,98 @@ class SPSA_minimization:
             # random generator for the two function evaluations, to reduce the
             # variance of the gradient if the evaluations use simulations (like
             # in games).
+
+            # Common random numbers: both evaluations get the same seed so
+            # that the matches are played with the same openings and colors.
+            # A new seed is drawn when the matches are run again.
+            seed = random.randint(1, 100000000)
+            if self.set_match_option is not None:
+                self.set_match_option(seed=seed)
+            self.pair_seed = seed
+
             state = random.getstate()
+
             theta1 = utils.linear_combinaison(1.0, theta, c, bernouilli)
-            logging.info(f'{__file__} theta1: {theta1}')
+            events.debug(__file__, 'theta1', theta1=theta1)
 
             # Apply parameter limits
-            logging.info(f'{__file__} > Apply limits to theta1 before sending to engine')
             theta1 = utils.apply_limits(theta1)
-            logging.info(f'{__file__} theta1 with limits: {theta1}')
-            logging.info(f'{__file__} > run 1st match with theta1: {theta1}')
+            events.debug(__file__, 'run 1st match with theta1 with limits', theta1=theta1)
 
             random.setstate(state)
             theta2 = utils.linear_combinaison(1.0, theta, -c, bernouilli)
-            logging.info(f'{__file__} theta2: {theta2}')
+            events.debug(__file__, 'theta2', theta2=theta2)
 
             # Apply parameter limits
-            logging.info(f'{__file__} > Apply limits to theta2 before sending to engine')
             theta2 = utils.apply_limits(theta2)
-            logging.info(f'{__file__} theta2 with limits: {theta2}')
-            logging.info(f'{__file__} > run 2nd match with theta2: {theta2}')
+            events.debug(__file__, 'run 2nd match with theta2 with limits', theta2=theta2)
 
-            # Run the 2 matches in parallel after iteration 1.
-            manager = multiprocessing.Manager()
-            res = manager.dict()
+            # Run the 2 matches in parallel after iteration 1, the match
+            # processes return their results in a shared dict.
+            if iter < self.iter_parallel_start:
+                res = {}
+            else:
+                manager = multiprocessing.Manager()
+                res = manager.dict()
             thetas = [theta1, theta2]
 
+            t_matches = time.perf_counter()
             if iter < self.iter_parallel_start:
-                print('Run match 1 ...')
+                self.out('Run match 1 ...')
                 true_param = utils.true_param(theta1)
-                print('test_engine param:')
+                self.out('test_engine param:')
                 for (name, val), (name1, val1) in zip(true_param.items(), true_theta.items()):
-                    print(f'  {name}: {val["value"]}, ({val["value"] - val1["value"]:+})')
+                    self.out(f'  {name}: {val["value"]}, ({val["value"] - val1["value"]:+})')
 
-                print('base_engine param:')
+                self.out('base_engine param:')
                 for name, val in utils.true_param(theta).items():
-                    print(f'  {name}: {val["value"]}')
+                    self.out(f'  {name}: {val["value"]}')
 
                 t1 = time.perf_counter()
-                f1 = self.evaluate_goal(theta1, theta, 0, res, iter)
+                f1, stats1 = self.evaluate_goal(theta1, theta, 0, res, iter)
                 logging.info(f'f1 elapse: {time.perf_counter() - t1:0.2f}s')
-                print(f'Done match 1!, elapse: {time.perf_counter() - t1:0.2f}sec')
-                print(f'goal after match 1: {f1:0.5f}')
+                self.out(f'Done match 1!, elapse: {time.perf_counter() - t1:0.2f}sec')
+                if f1 is None:
+                    self.out(f'match 1 failed: {stats1["error"]}')
+                else:
+                    self.out(f'goal after match 1: {f1:0.5f}')
 
                 # Run match 2
-                print('Run match 2 ...')
+                self.out('Run match 2 ...')
                 true_param = utils.true_param(theta2)
-                print('test_engine param:')
+                self.out('test_engine param:')
                 for (name, val), (name1, val1) in zip(true_param.items(), true_theta.items()):
-                    print(f'  {name}: {val["value"]}, ({val["value"] - val1["value"]:+})')
+                    self.out(f'  {name}: {val["value"]}, ({val["value"] - val1["value"]:+})')
 
-                print('base_engine param:')
+                self.out('base_engine param:')
                 for name, val in utils.true_param(theta).items():
-                    print(f'  {name}: {val["value"]}')
+                    self.out(f'  {name}: {val["value"]}')
 
                 t1 = time.perf_counter()
-                f2 = self.evaluate_goal(theta2, theta, 1, res, iter)
+                f2, stats2 = self.evaluate_goal(theta2, theta, 1, res, iter)
                 logging.info(f'f2 elapse: {time.perf_counter() - t1:0.2f}s')
-                print(f'Done match 2!, elapse: {time.perf_counter() - t1:0.2f}sec')
-                print(f'goal after match 2: {f2:0.5f}')
+                self.out(f'Done match 2!, elapse: {time.perf_counter() - t1:0.2f}sec')
+                if f2 is None:
+                    self.out(f'match 2 failed: {stats2["error"]}')
+                else:
+                    self.out(f'goal after match 2: {f2:0.5f}')
 
-                print('Done engine match!')
+                self.out('Done engine match!')
             else:
-                print('Run 2 matches in parallel ...')
+                self.out('Run 2 matches in parallel ...')
                 t1 = time.perf_counter()
                 jobs = []
                 for i in range(2):
-                    print(f'Run match {i + 1} ...')
+                    self.out(f'Run match {i + 1} ...')
 
                     true_param = utils.true_param(thetas[i])
-                    print('test_engine param:')
+                    self.out('test_engine param:')
                     for (name, val), (name1, val1) in zip(true_param.items(), true_theta.items()):
-                        print(f'  {name}: {val["value"]}, ({val["value"] - val1["value"]:+})')
+                        self.out(f'  {name}: {val["value"]}, ({val["value"] - val1["value"]:+})')
 
-                    print('base_engine param:')
+                    self.out('base_engine param:')
                     for name, val in utils.true_param(theta).items():
-                        print(f'  {name}: {val["value"]}')
+                        self.out(f'  {name}: {val["value"]}')
 
                     p = multiprocessing.Process(target=self.evaluate_goal, args=(thetas[i], theta, i, res, iter))
                     jobs.append(p)
@@ -394,27 +618,61 @@ class SPSA_minimization:
                 for num, proc in enumerate(jobs):
                     proc.join()
 
-                    # If match is done in parallel, update the history count, eval and theta here.
-                    self.history_eval[self.history_count % 1000] = res.values()[num]
-                    self.history_theta[self.history_count % 1000] = thetas[num]
-                    self.history_count += 1
+                    # A match process that died has no result.
+                    if num not in res:
+                        res[num] = (None, {'error': f'match process exit code {proc.exitcode}'})
 
-                    print(f'Done match {num + 1}!, elapse: {time.perf_counter() - t1:0.2f}sec')
+                    self.out(f'Done match {num + 1}!, elapse: {time.perf_counter() - t1:0.2f}sec')
 
                 logging.info(f'parallel elapse: {time.perf_counter() - t1:0.2f}s')
 
-                print('Done engine match!')
+                self.out('Done engine match!')
 
-                f1, f2 = res.values()[0], res.values()[1]
+                (f1, stats1), (f2, stats2) = res[0], res[1]
+                manager.shutdown()
+
+            self.iter_metrics.observe('spsa.matches', time.perf_counter() - t_matches)
+            for num, (f, stats) in enumerate([(f1, stats1), (f2, stats2)]):
+                self.add_evaluation(attempt, num, thetas[num], theta, f, stats)
+            for stats in (stats1, stats2):
+                self.iter_metrics.merge(stats.pop('metrics', None))
 
             logging.info(f'{__file__} > f1: {f1}, f2: {f2}')
-            print(f'optimizer goal after match 1: {f1:0.5f} (low is better)')
-            print(f'optimizer goal after match 2: {f2:0.5f} (low is better)')
+            events.debug(__file__, 'match stats', stats1=stats1, stats2=stats2)
+
+            # The matches of a gradient are played again with a new seed
+            # when one of them failed, as both must use the same openings.
+            if f1 is None or f2 is None:
+                self.iter_failures += 1
+                if self.set_match_option is not None:
+                    self.set_match_option(accepted=False)
+                logging.warning(f'{__file__} > match failed, failures: {self.iter_failures}/{self.max_failures}')
+                if self.iter_failures >= self.max_failures:
+                    self.out('Too many failed matches, skip the gradient of this iteration.')
+                    f1 = f2 = 0.0
+                    skipped = True
+                    break
+                self.out('A match failed, launch new matches ...')
+                continue
+
+            # Both evaluations are done, their goals are kept in the history
+            # and the games of the matches are saved.
+            for f, theta_i in [(f1, theta1), (f2, theta2)]:
+                self.history_eval[self.history_count % 1000] = f
+                self.history_theta[self.history_count % 1000] = theta_i
+                self.history_count += 1
+            if self.set_match_option is not None:
+                self.set_match_option(accepted=True)
+
+            self.iter_failures += stats1.get('failures', 0) + stats2.get('failures', 0)
+            self.iter_games += stats1.get('games', 0) + stats2.get('games', 0)
+            self.out(f'optimizer goal after match 1: {f1:0.5f} (low is better)')
+            self.out(f'optimizer goal after match 2: {f2:0.5f} (low is better)')
 
             if f1 != f2:
                 break
 
-            print('perf is the same in match 1 and 2, launch new matches ...')
+            self.out('perf is the same in match 1 and 2, launch new matches ...')
 
             count = count + 1
             logging.info(f'{__file__} > f1 and f2 are the same, try the engine match again. num_tries = {count}')
@@ -423,25 +681,36 @@ class SPSA_minimization:
                 logging.info(f'{__file__} > too many evaluation to find a gradient, function seems flat')
                 break
 
+        # The noise of the gradient is estimated from the accepted pair only,
+        # the pairs played again because f1 == f2 would add zero differences.
+        if not skipped:
+            self.update_rounds(f1, f2, stats1, stats2)
+
         # Update the gradient
         gradient = copy.deepcopy(theta)
+        if skipped:
+            for name in gradient:
+                gradient[name]['value'] = 0.0
+            logging.info(f'{__file__} > gradient skipped after {self.iter_failures} failed matches')
+            return gradient
+
         # print(f'Basic gradient after 2 engine matches:')
         for name, value in theta.items():
             gradient[name]['value'] = (f1 - f2) / (2.0 * c * bernouilli[name]['value'])
             # print(f'  {name}: {gradient[name]["value"]}')
-            logging.info(f'{__file__} > {name} gradient: {gradient}')
+        events.debug(__file__, 'gradient', gradient=gradient)
 
         if (f1 > current_goal) and (f2 > current_goal):
             logging.info(f'{__file__} > function seems not decreasing')
             gradient = utils.linear_combinaison(0.1, gradient)
 
-            print('Modify the gradient because the results of engine matches\n'
+            self.out('Modify the gradient because the results of engine matches\n'
                   'did not improve when using the new param. But we will not\n'
                   're-run the engine matches.')
 
-            print('Modified gradient at alpha=0.1:')
+            self.out('Modified gradient at alpha=0.1:')
             for n, v in gradient.items():
-                print(f'  {n}: {v["value"]}')
+                self.out(f'  {n}: {v["value"]}')
 
         # For the correction factor used in the running average for the gradient,
         # see the paper "Adam: A Method For Stochastic Optimization, Kingma and Lei Ba"
@@ -470,11 +739,64 @@ class SPSA_minimization:
             self.best_theta[self.best_count % 1000] = theta2
             self.best_count += 1
 
-        logging.info(f'{__file__} > final gradient: {gradient}')
+        events.debug(__file__, 'final gradient', gradient=gradient)
         
         # Return the estimation of the new gradient
         return gradient
 
+    def update_rounds(self, f1, f2, stats1, stats2):
+        """
+        Update the number of rounds of the next evaluations from the noise
+        of the last two evaluations.
+
+        stats1 and stats2 hold the number of games and the variance of the
+        goal ('games' and 'var'). As E[(f1 - f2)^2] = d^2 + var(f1) + var(f2)
+        where d is the true difference, running averages of (f1 - f2)^2 and
+        of var(f1) + var(f2) give an estimate of d^2. The signal-to-noise
+        ratio of the gradient is then d / sqrt(var(f1) + var(f2)), and the
+        variance of an evaluation is inversely proportional to its games.
+        """
+        if not (stats1.get('games') and stats2.get('games')):
+            return
+        if 'var' not in stats1 or 'var' not in stats2:
+            return
+
+        beta = 0.9
+        unit_var = 0.5 * (stats1['var'] * stats1['games'] + stats2['var'] * stats2['games'])
+        var_sum = stats1['var'] + stats2['var']
+        diff2 = (f1 - f2) ** 2
+
+        if self.unit_var_avg is None:
+            self.unit_var_avg, self.var_sum_avg, self.diff2_avg = unit_var, var_sum, diff2
+        else:
+            self.unit_var_avg = beta * self.unit_var_avg + (1 - beta) * unit_var
+            self.var_sum_avg = beta * self.var_sum_avg + (1 - beta) * var_sum
+            self.diff2_avg = beta * self.diff2_avg + (1 - beta) * diff2
+
+        signal2 = self.diff2_avg - self.var_sum_avg
+        self.snr = math.sqrt(signal2 / self.var_sum_avg) if signal2 > 0 and self.var_sum_avg > 0 else 0.0
+
+        if self.target_snr is None or self.rounds is None:
+            return
+
+        # Without a signal estimate the rounds are kept, the noise of the
+        # first gradients would otherwise send them to max_rounds.
+        if signal2 <= 0:
+            return
+
+        # Games needed so that sqrt(2 * unit_var / games) = d / target_snr
+        games = 2.0 * self.unit_var_avg * self.target_snr ** 2 / signal2
+
+        # The rounds move at most by a factor of 2 per gradient, a noisy
+        # estimate changes them step by step.
+        games = max(self.rounds / 2, min(2 * self.rounds, games))
+        rounds = 2 * math.ceil(games / 2)  # keep the game pairs complete
+        rounds = max(self.min_rounds, min(self.max_rounds, rounds))
+
+        if rounds != self.rounds:
+            logging.info(f'{__file__} > rounds: {self.rounds} -> {rounds}, snr: {self.snr:0.3f}')
+        self.rounds = rounds
+
     def create_bernouilli(self, m):
         """
         Create a random direction to estimate the stochastic gradient.
@@ -585,9 +907,9 @@ class SPSA_minimization:
 
         p = utils.hadamard_product(previous_g, gradient)
 
-        print(f'gradient = {gradient}')
-        print(f'old_g = {previous_g}')
-        print(f'p = {p}')
+        self.out(f'gradient = {gradient}')
+        self.out(f'old_g = {previous_g}')
+        self.out(f'p = {p}')
 
         g = {}
         eta = {}
@@ -606,9 +928,9 @@ class SPSA_minimization:
 
             g[name] = gradient[name]
 
-        print(f'g       = {g}')
-        print(f'eta     = {eta}')
-        print(f'delta   = {delta}')
+        self.out(f'g       = {g}')
+        self.out(f'eta     = {eta}')
+        self.out(f'delta   = {delta}')
 
         # store the current g and delta for the next call of the RPROP algorithm
         self.rprop_previous_g     = g
@@ -617,8 +939,8 @@ class SPSA_minimization:
         # calculate the update for the current RPROP
         s = utils.hadamard_product(delta, utils.sign(g))
 
-        print(f'sign(g)  = {utils.sign(g)}')
-        print(f's        = {s}')
+        self.out(f'sign(g)  = {utils.sign(g)}')
+        self.out(f's        = {s}')
 
         return s
 
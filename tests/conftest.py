@@ -0,0 +1,20 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The modules of the optimizer are at the root of the repository.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def engine_cfg():
+    """
+    Return a function that returns the engine dict of duel.define_engine()
+    of mock_engine.py searching to depth 1 without think time.
+    """
+    def make(name, proto='uci', depth=1, **options):
+        return {'proc': None, 'cmd': (ROOT / 'mock_engine.py').as_posix(), 'name': name,
+                'opt': {'ThinkMs': 0, **options}, 'tc': '', 'depth': depth, 'nodes': 0, 'proto': proto}
+    return make
@@ -0,0 +1,40 @@
+import random
+
+import pytest
+
+import bench_adjudication
+import duel
+
+
+OPTIONS = [({'movecount': 4, 'score': 400}, {'movenumber': 40, 'movecount': 4, 'score': 5}),
+           ({'movecount': 3, 'score': 300}, {'movenumber': 34, 'movecount': 8, 'score': 20}),
+           ({'movecount': 1, 'score': 0}, {'movenumber': 0, 'movecount': 0, 'score': 0})]
+
+
+@pytest.mark.parametrize('resign_option, draw_option', OPTIONS)
+def test_incremental_is_the_full_scan(resign_option, draw_option):
+    rng = random.Random(1)
+    for _ in range(5):
+        scores = bench_adjudication.score_stream(600, rng)
+        assert bench_adjudication.run_incremental(scores, resign_option, draw_option) == \
+            bench_adjudication.run_scan(scores, resign_option, draw_option)
+
+
+def test_resign_after_movecount_moves():
+    adjudicator = duel.Adjudicator({'movecount': 2, 'score': 400}, {'movenumber': 100, 'movecount': 4, 'score': 5})
+    for ply in range(40):
+        adjudicator.add(10 if ply % 2 == 0 else -10)
+    assert adjudicator.adjudicate_win(1)[0] is False
+    for ply in range(40, 52):
+        adjudicator.add(500 if ply % 2 == 0 else -500)
+        decision = adjudicator.adjudicate_win(1)
+    assert decision == (True, '1-0', 1.0)
+
+
+def test_draw_from_movenumber():
+    adjudicator = duel.Adjudicator({'movecount': 2, 'score': None}, {'movenumber': 10, 'movecount': 2, 'score': 5})
+    for ply in range(19):
+        adjudicator.add(0)
+    assert adjudicator.adjudicate_draw()[0] is False
+    adjudicator.add(0)
+    assert adjudicator.adjudicate_draw() == (True, '1/2-1/2', 0.5)
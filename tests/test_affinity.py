@@ -0,0 +1,64 @@
+import asyncio
+import os
+
+import pytest
+
+import duel
+import resources
+
+
+linux_only = pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason='affinity is only supported on Linux')
+
+
+def test_parse_and_format_cores():
+    assert resources.parse_cores('2-5,8') == [2, 3, 4, 5, 8]
+    assert resources.parse_cores(' 0 , 3-4 ') == [0, 3, 4]
+    assert resources.format_cores([8, 2, 3, 4, 5]) == '2-5,8'
+    assert resources.format_cores([1, 3]) == '1,3'
+    assert resources.parse_cores(resources.format_cores([0, 1, 2, 6, 7, 9])) == [0, 1, 2, 6, 7, 9]
+
+
+def test_split_cores():
+    assert resources.split_cores([0, 1, 2, 3, 4], 2) == [[0, 1], [2, 3]]
+    # The matches share the cores if there are not enough.
+    assert resources.split_cores([5], 2) == [[5], [5]]
+
+
+def test_core_sets_of_slots():
+    assert resources.get_core_sets([0, 1, 2, 3], 4) == [[0], [1], [2], [3]]
+    assert resources.get_core_sets([0, 1, 2, 3], 2, cores_per_slot=2) == [[0, 1], [2, 3]]
+    # More slots than core sets: the slots share the sets in turn.
+    assert resources.get_core_sets([0, 1, 2], 4, cores_per_slot=2) == [[0, 1], [0, 1]] * 2
+    assert resources.get_core_sets([4], 2, cores_per_slot=8) == [[4], [4]]
+
+
+@linux_only
+def test_slot_cores(engine_cfg):
+    e1, e2 = engine_cfg('test', Threads=2), engine_cfg('base')
+    assert duel.get_slot_cores(None, 1, 2, e1, e2) is None
+    assert duel.get_slot_cores('off', 1, 2, e1, e2) is None
+
+    core = sorted(os.sched_getaffinity(0))[0]
+    # The slots share the core as the engines have 2 threads.
+    assert duel.get_slot_cores(str(core), 0, 2, e1, e2) == [[core], [core]]
+    assert duel.get_slot_cores('auto', 0, 1, e1, e2)[0][0] in os.sched_getaffinity(0)
+
+    missing = max(os.sched_getaffinity(0)) + 1
+    with pytest.raises(ValueError):
+        duel.get_slot_cores(f'{core},{missing}', 0, 2, e1, e2)
+
+
+@linux_only
+def test_engines_run_on_the_cores_of_their_slot(engine_cfg):
+    core = sorted(os.sched_getaffinity(0))[-1]
+
+    async def start():
+        pool = duel.EnginePool(max_games=1, cores=[core], slot=1)
+        try:
+            engines = await pool.get([engine_cfg('test'), engine_cfg('base')])
+            return [os.sched_getaffinity(e.proc.pid) for e in engines]
+        finally:
+            await pool.close()
+            await asyncio.sleep(0.2)
+
+    assert asyncio.run(start()) == [{core}, {core}]
@@ -0,0 +1,32 @@
+import asyncio
+
+import duel
+
+
+def setting(e1, e2):
+    return {'e1': e1, 'e2': e2, 'output_game_file': None, 'repeat': 2,
+            'draw_option': {'movenumber': None, 'movecount': None, 'score': None},
+            'resign_option': {'movecount': None, 'score': None}, 'variant': 'normal',
+            'posround': 1, 'trace_option': {'mode': 'off', 'size': 100},
+            'game_timeout': None, 'retries': 0}
+
+
+def test_async_runner_plays_all_jobs_in_this_process(engine_cfg):
+    reports = {}
+
+    def report(job_num, res, failures=0, error=''):
+        reports[job_num] = (res, failures, error)
+
+    jobs = iter([(i, None) for i in range(4)])
+    asyncio.run(duel.run_async(jobs, setting(engine_cfg('test'), engine_cfg('base')),
+                               2, 100, report))
+
+    assert sorted(reports) == [0, 1, 2, 3]
+    for res, failures, error in reports.values():
+        assert failures == 0 and error == ''
+        [games] = res
+        assert [(g['white'], g['black']) for g in games] == [('test', 'base'), ('base', 'test')]
+        assert all(g['plies'] > 0 for g in games)
+    # Both game slots played.
+    assert {g['slot'] for res, _, _ in reports.values() for g in res[0]} == {1, 2}
+
@@ -0,0 +1,67 @@
+import pytest
+
+import calibration
+
+
+@pytest.mark.parametrize('tc, factor, scaled', [
+    ('0/5+0.05', 2, '0/10+0.1'),
+    ('40/60', 0.5, '40/30'),
+    ('3:00+1', 1.5, '270+1.5'),
+    ('10', 1, '10'),
+    ('0/5+0.05', 1 / 3, '0/1.667+0.01667'),
+])
+def test_scale_tc(tc, factor, scaled):
+    assert calibration.scale_tc(tc, factor) == scaled
+
+
+def test_scale_engine_options():
+    options = 'tc=0/5+0.05 st=2 depth=8 option.Hash=64'
+    assert calibration.scale_engine_options(options, 2) == 'tc=0/10+0.1 st=4 depth=8 option.Hash=64'
+    assert calibration.scale_engine_options('tc=inf nodes=1000', 2) == 'tc=inf nodes=1000'
+
+
+def test_factor_within_limits(monkeypatch):
+    speeds = iter([1000.0] * calibration.REPEAT + [100.0] * calibration.REPEAT)
+    monkeypatch.setattr(calibration, 'cpu_speed', lambda: next(speeds))
+    c = calibration.Calibration('cpu', reference_speed=2000.0)
+    assert c.factor() == 2.0
+    c.measure()
+    assert c.factor() == calibration.MAX_FACTOR
+
+
+def fail(*args):
+    raise RuntimeError('no engine')
+
+
+def test_engine_failure_without_reference_uses_cpu(monkeypatch):
+    monkeypatch.setattr(calibration, 'engine_speed', fail)
+    monkeypatch.setattr(calibration, 'cpu_speed', lambda: 500.0)
+    c = calibration.Calibration('engine', 'cmd=engine name=base proto=uci')
+    c.measure()
+    assert c.benchmark == 'cpu'
+    assert c.reference_speed == 500.0
+    assert c.job_setting()['benchmark'] == 'cpu'
+
+
+def test_engine_failure_with_engine_reference_fails(monkeypatch):
+    monkeypatch.setattr(calibration, 'engine_speed', fail)
+    monkeypatch.setattr(calibration, 'cpu_speed', lambda: 500.0)
+    c = calibration.Calibration('engine', 'cmd=engine name=base proto=uci', reference_speed=1e6)
+    with pytest.raises(RuntimeError):
+        c.measure()
+
+
+def test_refresh_keeps_the_last_speed(monkeypatch):
+    monkeypatch.setattr(calibration, 'engine_speed', lambda cmd, nodes: 1e6)
+    c = calibration.Calibration('engine', 'cmd=engine name=base proto=uci', interval=0)
+    c.measure()
+    monkeypatch.setattr(calibration, 'engine_speed', fail)
+    c.refresh()
+    assert c.speed == 1e6
+    assert c.benchmark == 'engine'
+
+
+def test_engine_benchmark_needs_uci():
+    c = calibration.Calibration('engine', 'cmd=engine name=base proto=xboard', reference_speed=1.0)
+    with pytest.raises(RuntimeError):
+        c.run_benchmark()
@@ -0,0 +1,30 @@
+import pytest
+
+from chess_match import MATCH_TIMEOUT_MARGIN, MATCH_TIMEOUT_MOVES, get_match_timeout
+
+
+# Time of a game of MATCH_TIMEOUT_MOVES moves of both engines at 0/5+0.05.
+GAME = 2 * (5 + 0.05 * MATCH_TIMEOUT_MOVES)
+
+
+@pytest.mark.parametrize('options, duel, games', [
+    # cutechess-cli plays -games per round, -repeat does not add games.
+    ('-rounds 8 -repeat -concurrency 2', False, 8),
+    ('-rounds 8 -games 2 -repeat -concurrency 2', False, 16),
+    # duel.py plays rounds * games games in pairs of repeat games.
+    ('-rounds 8 -repeat 2 -concurrency 2', True, 8),
+    ('-rounds 8 -games 2 -repeat 2 -concurrency 2', True, 16),
+    ('-rounds 1 -repeat 2 -concurrency 2', True, 2),
+])
+def test_timeout_games(options, duel, games):
+    assert get_match_timeout(options, 'tc=0/5+0.05', duel) == pytest.approx(
+        -(-games // 2) * GAME + MATCH_TIMEOUT_MARGIN)
+
+
+def test_timeout_of_minutes_tc():
+    assert get_match_timeout('-rounds 1', 'tc=40/1:30') == 2 * 90 + MATCH_TIMEOUT_MARGIN
+
+
+@pytest.mark.parametrize('engine_options', ['depth=8', 'tc=inf', 'nodes=1000 option.Hash=16'])
+def test_no_timeout_without_tc(engine_options):
+    assert get_match_timeout('-rounds 8', engine_options) is None
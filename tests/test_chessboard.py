@@ -0,0 +1,24 @@
+import pytest
+
+import chessboard
+
+
+# Node counts from the perft results of the chess programming wiki.
+@pytest.mark.parametrize('fen, depth, nodes', [
+    (chessboard.START_FEN, 1, 20),
+    (chessboard.START_FEN, 2, 400),
+    (chessboard.START_FEN, 3, 8902),
+    # Kiwipete: castling, en passant and promotions.
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 1, 48),
+    ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1', 2, 2039),
+    ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', 3, 2812),
+    ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1', 2, 264),
+])
+def test_perft(fen, depth, nodes):
+    assert chessboard.perft(chessboard.Board(fen), depth) == nodes
+
+
+def test_perft_restores_the_board():
+    board = chessboard.Board()
+    chessboard.perft(board, 2)
+    assert board.fen() == chessboard.START_FEN
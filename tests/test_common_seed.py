@@ -0,0 +1,59 @@
+import spsa
+
+
+class Recorder:
+    """
+    Goal function that records the seed of every evaluation, the matches
+    of the attempts in fail fail once.
+    """
+    def __init__(self, fail=()):
+        self.option = {}
+        self.calls = []  # (attempt, match, seed)
+        self.fail = set(fail)
+        self.attempt = 0
+
+    def set_match_option(self, **kwargs):
+        if 'seed' in kwargs:
+            self.attempt += 1
+        self.option.update(kwargs)
+
+    def goal(self, i, base_theta, **theta):
+        self.calls.append((self.attempt, i, self.option['seed']))
+        if i == 1 and self.attempt in self.fail:
+            raise RuntimeError('match failed')
+        return -0.5 + 0.1 * (i - 0.5), {'games': 4, 'var': 0.01}
+
+
+def run(recorder, tmp_path, iterations=3):
+    theta0 = {'x': {'value': 1.0, 'min': 0, 'max': 2, 'factor': 1}}
+    minimizer = spsa.SPSA_minimization(recorder.goal, theta0, iterations,
+                                       options={'parallel': False, 'rounds': 4,
+                                                'plot_data_file': str(tmp_path / 'plot_data.csv')},
+                                       set_match_option=recorder.set_match_option)
+    minimizer.run()
+
+
+def seeds_by_attempt(recorder):
+    seeds = {}
+    for attempt, i, seed in recorder.calls:
+        seeds.setdefault(attempt, []).append(seed)
+    return seeds
+
+
+def test_both_matches_of_a_gradient_share_the_seed(tmp_path):
+    recorder = Recorder()
+    run(recorder, tmp_path)
+    seeds = seeds_by_attempt(recorder)
+    assert len(seeds) == 3
+    for pair in seeds.values():
+        assert len(pair) == 2 and pair[0] == pair[1]
+    assert len({pair[0] for pair in seeds.values()}) == 3
+
+
+def test_failed_pair_is_played_again_with_a_new_seed(tmp_path):
+    recorder = Recorder(fail=[2])
+    run(recorder, tmp_path, iterations=2)
+    seeds = seeds_by_attempt(recorder)
+    assert len(seeds) == 3
+    assert seeds[2][0] == seeds[2][1]
+    assert seeds[3][0] == seeds[3][1] != seeds[2][0]
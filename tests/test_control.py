@@ -0,0 +1,109 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+import control
+import spsa
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(max_concurrency=None):
+        c = control.Control(max_concurrency)
+        s = control.serve(c, 0)
+        servers.append(s)
+        return c, f'http://127.0.0.1:{s.server_port}'
+
+    yield start
+    for s in servers:
+        s.shutdown()
+        s.server_close()
+
+
+def request(url, data=None):
+    """
+    Return the code and the json of the reply, data is posted as json.
+    """
+    body = None if data is None else json.dumps(data).encode()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body), timeout=10) as f:
+            return f.status, json.loads(f.read())
+    except urllib.error.HTTPError as ex:
+        return ex.code, json.loads(ex.read())
+
+
+def test_status_and_requests(server):
+    c, url = server(max_concurrency=4)
+    c.set_status(state='running', iteration=3)
+    assert request(f'{url}/status') == (200, {'state': 'running', 'iteration': 3, 'max_concurrency': 4})
+
+    code, status = request(f'{url}/pause', {})
+    assert code == 200 and status['state'] == 'pausing'
+    assert not c.resumed.is_set()
+    assert request(f'{url}/resume', {})[1]['state'] == 'running'
+
+    code, status = request(f'{url}/concurrency', {'concurrency': 3})
+    assert code == 200 and status['next_concurrency'] == 3
+    assert request(f'{url}/stop', {})[1]['state'] == 'stopping'
+    assert c.next_iteration() == {'stop': True, 'concurrency': 3}
+    assert request(f'{url}/status')[1]['state'] == 'stopped'
+
+
+def test_invalid_requests(server):
+    c, url = server(max_concurrency=4)
+    # The games per match must fit in the machine budget.
+    code, reply = request(f'{url}/concurrency', {'concurrency': 5})
+    assert code == 400 and 'above 4' in reply['error']
+    assert request(f'{url}/concurrency', {'concurrency': 0})[0] == 400
+    assert request(f'{url}/concurrency', {'concurrency': '2'})[0] == 400
+    assert request(f'{url}/concurrency', [2])[0] == 400
+    assert request(f'{url}/unknown', {})[0] == 404
+    assert request(f'{url}/unknown')[0] == 404
+    assert c.concurrency is None
+
+
+def test_paused_optimizer_waits_for_resume():
+    c = control.Control()
+    c.pause()
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (c.next_iteration(), done.set()))
+    thread.start()
+    assert not done.wait(0.2)
+    assert c.get_status()['state'] == 'paused'
+    c.resume()
+    assert done.wait(5)
+    thread.join()
+    assert c.get_status()['state'] == 'running'
+
+
+def test_optimizer_applies_the_requests(tmp_path):
+    c = control.Control(max_concurrency=8)
+    options = {}
+    iterations = []
+
+    def goal(i, base_theta, **theta):
+        if len(iterations) == 2:
+            c.set_concurrency(6)
+        if len(iterations) == 4:
+            c.stop()
+        iterations.append(options.get('concurrency'))
+        return -0.5 + 0.1 * (i - 0.5), {'games': 4, 'var': 0.01}
+
+    theta0 = {'x': {'value': 1.0, 'min': 0, 'max': 2, 'factor': 1}}
+    minimizer = spsa.SPSA_minimization(goal, theta0, 10,
+                                       options={'parallel': False, 'rounds': 4, 'control': c,
+                                                'plot_data_file': str(tmp_path / 'plot_data.csv')},
+                                       set_match_option=lambda **kwargs: options.update(kwargs))
+    minimizer.run()
+
+    # The requests of iteration 2 are applied after it, the optimizer
+    # stops after the iteration of the stop request.
+    assert iterations == [None, None, None, None, 6, 6]
+    status = c.get_status()
+    assert status['state'] == 'stopped'
+    assert status['iteration'] == 3 and status['concurrency'] == 6
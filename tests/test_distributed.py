@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+import distributed
+
+
+class Submission:
+    """
+    Coordinator.submit() of jobs in a thread, it waits for the results.
+    """
+    def __init__(self, coordinator, jobs):
+        self.results = None
+        self.thread = threading.Thread(target=self.run, args=(coordinator, jobs), daemon=True)
+        self.thread.start()
+
+    def run(self, coordinator, jobs):
+        self.results = coordinator.submit(jobs)
+
+    def wait(self):
+        self.thread.join(timeout=5)
+        assert not self.thread.is_alive()
+        return self.results
+
+
+def result(value):
+    return {'returncode': 0, 'output': value}
+
+
+def test_results_in_order():
+    coordinator = distributed.Coordinator()
+    submission = Submission(coordinator, ['a', 'b'])
+    worker = object()
+    (id_a, job_a), (id_b, job_b) = coordinator.take(worker), coordinator.take(worker)
+    assert (job_a, job_b) == ('a', 'b')
+    coordinator.finish(id_b, result('b'), worker)
+    coordinator.finish(id_a, result('a'), worker)
+    assert submission.wait() == [result('a'), result('b')]
+    assert coordinator.jobs == {} and coordinator.running == {}
+
+
+def test_lost_job_is_queued_again():
+    coordinator = distributed.Coordinator()
+    submission = Submission(coordinator, ['a'])
+    old, new = object(), object()
+    job_id, _ = coordinator.take(old)
+    coordinator.lose(job_id, 'test', old)
+
+    assert coordinator.take(new) == (job_id, 'a')
+    assert coordinator.jobs[job_id]['tries'] == 2
+
+    # The old worker no longer holds the job, its result is not used.
+    coordinator.finish(job_id, result('old'), old)
+    coordinator.lose(job_id, 'test', old)
+    assert coordinator.jobs[job_id]['result'] is None
+    assert list(coordinator.waiting) == []
+
+    coordinator.finish(job_id, result('new'), new)
+    assert submission.wait() == [result('new')]
+
+
+def test_job_fails_after_max_requeues():
+    coordinator = distributed.Coordinator()
+    submission = Submission(coordinator, ['a'])
+    for _ in range(distributed.MAX_REQUEUES):
+        worker = object()
+        job_id, _ = coordinator.take(worker)
+        coordinator.lose(job_id, 'test', worker)
+    [res] = submission.wait()
+    assert res['returncode'] == -1
+    assert f'lost {distributed.MAX_REQUEUES} times' in res['error']
+
+
+def test_heartbeat_of_the_holder_only():
+    coordinator = distributed.Coordinator()
+    Submission(coordinator, ['a'])
+    worker = object()
+    job_id, _ = coordinator.take(worker)
+    coordinator.heartbeat(job_id, object())
+    assert list(coordinator.running) == [(job_id, worker)]
+
+
+def test_authorize():
+    assert distributed.Coordinator().authorize({})
+    coordinator = distributed.Coordinator(token='secret')
+    assert coordinator.authorize({'token': 'secret'})
+    assert not coordinator.authorize({'token': 'wrong'})
+    assert not coordinator.authorize({})
+
+
+def test_serve_needs_token_off_loopback():
+    with pytest.raises(ValueError):
+        distributed.serve(distributed.Coordinator(), '0.0.0.0:0')
+
+
+def test_run_job_only_runs_match_scripts():
+    res = distributed.run_job({'script': 'rm -rf /'})
+    assert res['returncode'] == -1
+    assert 'not a match script' in res['error']
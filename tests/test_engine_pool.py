@@ -0,0 +1,89 @@
+import asyncio
+
+import duel
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_engines_kept_across_games(engine_cfg):
+    async def games():
+        pool = duel.EnginePool(max_games=3)
+        e1, e2 = engine_cfg('test'), engine_cfg('base')
+        started = []
+        try:
+            for _ in range(3):
+                engines = await pool.get([e1, e2])
+                started.append([id(e) for e in engines])
+                for e in engines:
+                    await pool.release(e)
+            return started, [e for engines in pool.idle.values() for e in engines]
+        finally:
+            await pool.close()
+
+    started, idle = run(games())
+    assert started[0] == started[1] == started[2]
+    # The engines are stopped after max_games games.
+    assert idle == []
+
+
+def test_engine_recycled_after_max_games(engine_cfg):
+    async def games():
+        pool = duel.EnginePool(max_games=2)
+        e1 = engine_cfg('test')
+        try:
+            engines = []
+            for _ in range(3):
+                [e] = await pool.get([e1])
+                engines.append(e)
+                await pool.release(e)
+            return engines
+        finally:
+            await pool.close()
+
+    first, second, third = run(games())
+    assert first is second
+    assert third is not first
+    assert not first.is_alive()
+
+
+def test_failed_or_dead_engine_is_replaced(engine_cfg):
+    async def games():
+        pool = duel.EnginePool(max_games=0)
+        e1 = engine_cfg('test')
+        try:
+            [failed] = await pool.get([e1])
+            failed.failed = True
+            await pool.release(failed)
+            [dead] = await pool.get([e1])
+            await pool.release(dead)
+            dead.kill()
+            await dead.proc.wait()
+            [new] = await pool.get([e1])
+            alive = new.is_alive()
+            await pool.release(new)
+            return failed, dead, new, alive
+        finally:
+            await pool.close()
+
+    failed, dead, new, alive = run(games())
+    assert new is not failed and new is not dead
+    assert alive
+
+
+def test_concurrent_games_use_their_own_engines(engine_cfg):
+    async def games():
+        pool = duel.EnginePool()
+        e1 = engine_cfg('test')
+        try:
+            a, b = await asyncio.gather(pool.get([e1]), pool.get([e1]))
+            for e in a + b:
+                await pool.release(e)
+            return a[0], b[0], len(pool.idle[a[0].key])
+        finally:
+            await pool.close()
+
+    a, b, idle = run(games())
+    assert a is not b
+    assert idle == 2
@@ -0,0 +1,110 @@
+import json
+import logging
+
+import pytest
+
+import events
+import spsa
+
+
+THETA = {'QueenValueOp': {'value': 0.81, 'min': 700, 'max': 1100, 'factor': 1000},
+         'RookValueOp': {'value': 0.5, 'min': 400, 'max': 700, 'factor': 1000}}
+
+
+class Counted:
+    """
+    A field that counts how many times it is formatted.
+    """
+    def __init__(self):
+        self.formatted = 0
+
+    def __repr__(self):
+        self.formatted += 1
+        return 'counted'
+
+
+@pytest.fixture
+def root_logger():
+    """
+    Return the root logger, its level and handlers are restored after the test.
+    """
+    logger = logging.getLogger()
+    level, handlers = logger.level, list(logger.handlers)
+    yield logger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        if handler not in handlers:
+            handler.close()
+    for handler in handlers:
+        logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def test_compact():
+    assert events.compact(THETA) == {'QueenValueOp': 0.81, 'RookValueOp': 0.5}
+    assert events.compact({'a': 1}) == {'a': 1}
+    assert events.compact({}) == {}
+    assert events.compact([1, 2]) == [1, 2]
+    assert str(events.Event('spsa.py', 'theta', {'theta': THETA, 'c': 2})) == \
+        "spsa.py > theta: theta: {'QueenValueOp': 0.81, 'RookValueOp': 0.5}, c: 2"
+    assert str(events.Event('spsa.py', 'start', {})) == 'spsa.py > start'
+
+
+def test_debug_event_is_formatted_only_when_written(root_logger, tmp_path):
+    handler = logging.FileHandler(tmp_path / 'log.txt')
+    root_logger.addHandler(handler)
+    field = Counted()
+
+    events.set_level('info')
+    events.debug('spsa.py', 'theta', theta=field)
+    assert field.formatted == 0
+
+    events.set_level('debug')
+    events.debug('spsa.py', 'theta', theta=field)
+    handler.flush()
+    assert field.formatted > 0
+    assert (tmp_path / 'log.txt').read_text() == 'spsa.py > theta: theta: counted\n'
+
+
+def test_jsonl_log(root_logger, tmp_path):
+    events.use_jsonl(tmp_path / 'log.jsonl')
+    assert [type(h) for h in root_logger.handlers] == [events.JsonlHandler]
+    events.set_level('info')
+    events.info('spsa.py', 'best param', iter=3, param=THETA)
+    logging.warning('match %d failed', 2)
+    events.debug('spsa.py', 'not written')
+
+    lines = [json.loads(line) for line in (tmp_path / 'log.jsonl').read_text().splitlines()]
+    assert len(lines) == 2
+    assert {k: v for k, v in lines[0].items() if k != 'time'} == {
+        'level': 'INFO', 'source': 'spsa.py', 'event': 'best param', 'iter': 3,
+        'param': {'QueenValueOp': 0.81, 'RookValueOp': 0.5}}
+    assert lines[1]['level'] == 'WARNING' and lines[1]['message'] == 'match 2 failed'
+
+
+def run_minimizer(tmp_path, iterations, **options):
+    def goal(i, base_theta, **theta):
+        return -0.5 + 0.1 * (i - 0.5), {'games': 4, 'var': 0.01}
+
+    theta0 = {'x': {'value': 1.0, 'min': 0, 'max': 2, 'factor': 1}}
+    minimizer = spsa.SPSA_minimization(goal, theta0, iterations,
+                                       options={'parallel': False, 'rounds': 4,
+                                                'plot_data_file': str(tmp_path / 'plot_data.csv'), **options})
+    minimizer.run()
+
+
+def test_quiet_console(tmp_path, capsys):
+    run_minimizer(tmp_path, 5, quiet=True, progress_interval=3600)
+    lines = capsys.readouterr().out.splitlines()
+    # The first and the last iterations are always summarized.
+    assert [line.split(',')[0] for line in lines if line.startswith('iter ')] == ['iter 1/5', 'iter 5/5']
+    assert not any(line.startswith('starting iter') for line in lines)
+
+    run_minimizer(tmp_path, 3, quiet=True, progress_interval=0)
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split(',')[0] for line in lines if line.startswith('iter ')] == ['iter 1/3', 'iter 2/3', 'iter 3/3']
+
+    run_minimizer(tmp_path, 2)
+    lines = capsys.readouterr().out.splitlines()
+    assert 'starting iter 1 ...' in lines
+    assert not any(line.startswith('iter ') for line in lines)
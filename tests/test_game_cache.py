@@ -0,0 +1,85 @@
+import json
+import shutil
+import subprocess
+import sys
+
+from conftest import ROOT
+
+import game_cache
+
+
+EPD = '''rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq -
+rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR b KQkq -
+'''
+
+
+def setting(e1, e2):
+    return {'e1': e1, 'e2': e2, 'repeat': 2, 'posround': 1, 'variant': 'normal',
+            'draw_option': {}, 'resign_option': {}}
+
+
+def test_key_changes_with_engine_file_and_options(tmp_path, engine_cfg):
+    engine = tmp_path / 'engine.py'
+    shutil.copy(ROOT / 'mock_engine.py', engine)
+    e1 = dict(engine_cfg('test', QueenValue=900), cmd=engine.as_posix())
+    e2 = engine_cfg('base')
+    fen = EPD.splitlines()[0]
+    key = game_cache.pair_key(fen, setting(e1, e2))
+
+    assert game_cache.pair_key(fen, setting(e1, e2)) == key
+    assert game_cache.pair_key(fen, setting(e2, e1)) != key
+    assert game_cache.pair_key(EPD.splitlines()[1], setting(e1, e2)) != key
+    assert game_cache.pair_key(fen, setting(dict(e1, opt={'QueenValue': 950}), e2)) != key
+    assert game_cache.pair_key(fen, setting(dict(e1, depth=2), e2)) != key
+
+    engine.write_text(engine.read_text() + '\n# changed\n')
+    assert game_cache.pair_key(fen, setting(e1, e2)) != key
+
+
+def test_parameter_file_is_hashed(tmp_path):
+    params = tmp_path / 'params.txt'
+    params.write_text('QueenValue 900\n')
+    first = game_cache.option_key(params.as_posix())
+    assert first.startswith('sha256:')
+    params.write_text('QueenValue 950\n')
+    assert game_cache.option_key(params.as_posix()) != first
+    assert game_cache.option_key('Hash') == 'Hash'
+
+
+def test_engine_not_found():
+    assert game_cache.engine_file_hash('no_such_engine_file') is None
+
+
+def test_get_and_put(tmp_path):
+    games = [{'gres': '1-0', 'moves': ['e4', 'e5']}, {'gres': '0-1', 'moves': ['d4']}]
+    with game_cache.GameCache((tmp_path / 'cache.sqlite').as_posix()) as cache:
+        assert cache.get('key') is None
+        cache.put('key', games)
+    with game_cache.GameCache((tmp_path / 'cache.sqlite').as_posix()) as cache:
+        assert cache.get('key') == games
+
+
+def test_second_match_is_read_from_the_cache(tmp_path):
+    (tmp_path / 'openings.epd').write_text(EPD)
+    mock = (ROOT / 'mock_engine.py').as_posix()
+
+    def run():
+        output = subprocess.run(
+            [sys.executable, (ROOT / 'duel.py').as_posix(), '-rounds', '4', '-repeat', '2',
+             '-concurrency', '2', '-srand', '1', '-jsonl', '-cache', 'cache.sqlite',
+             '-openings', f'file={tmp_path / "openings.epd"}', 'format=epd', 'order=sequential',
+             '-engine', f'cmd={mock}', 'name=test', 'proto=uci',
+             '-engine', f'cmd={mock}', 'name=base', 'proto=uci',
+             '-each', 'depth=1', 'option.ThinkMs=0', 'option.Seed=1'],
+            cwd=tmp_path, stdout=subprocess.PIPE, text=True, timeout=120).stdout
+        lines = [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+        games = sorted((g['game'], g['result']) for g in lines if g['type'] == 'game')
+        return games, next(line for line in lines if line['type'] == 'cache')
+
+    games, stats = run()
+    assert len(games) == 4
+    assert stats['hits'] == 0 and stats['misses'] == 2
+
+    cached_games, stats = run()
+    assert stats['hits'] == 2 and stats['misses'] == 0
+    assert cached_games == games
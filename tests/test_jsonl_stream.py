@@ -0,0 +1,52 @@
+import json
+import subprocess
+import sys
+
+from conftest import ROOT
+
+import chess_match
+
+
+EPD = '''rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq -
+rnbqkbnr/pppppppp/8/8/3P4/8/PPP1PPPP/RNBQKBNR b KQkq -
+'''
+
+
+def test_duel_streams_json_lines(tmp_path):
+    (tmp_path / 'openings.epd').write_text(EPD)
+    mock = (ROOT / 'mock_engine.py').as_posix()
+    output = subprocess.run(
+        [sys.executable, (ROOT / 'duel.py').as_posix(), '-rounds', '4', '-repeat', '2',
+         '-concurrency', '2', '-srand', '1', '-jsonl',
+         '-openings', f'file={tmp_path / "openings.epd"}', 'format=epd',
+         '-engine', f'cmd={mock}', 'name=test', 'proto=uci',
+         '-engine', f'cmd={mock}', 'name=base', 'proto=uci',
+         '-each', 'depth=1', 'option.ThinkMs=0'],
+        cwd=tmp_path, stdout=subprocess.PIPE, text=True, timeout=120).stdout
+
+    lines = [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+    types = [line['type'] for line in lines]
+    assert types.count('game') == 4
+    assert 'score' in types and 'metrics' in types
+
+    result = chess_match.MatchResult('test', 'base')
+    for line in output.splitlines():
+        result.add_line(line)
+    assert sorted(g['game'] for g in result.games) == [1, 2, 3, 4]
+    assert sum(result.wdl) == 4
+    assert sum(result.penta) == 2
+    assert result.score != ''
+    assert 'duel.total' in result.spans
+
+
+def test_cutechess_lines():
+    result = chess_match.MatchResult('test', 'base')
+    for line in ['Finished game 1 (test vs base): 1-0 {White mates}',
+                 'Finished game 2 (base vs test): 1/2-1/2 {Draw by repetition}',
+                 'Score of test vs base: 1 - 0 - 1  [0.750] 2']:
+        result.add_line(line)
+    assert result.score == '0.750'
+    assert result.wdl == [1, 1, 0]
+    assert result.penta == [0, 0, 0, 1, 0]
+    assert result.games[1] == {'game': 2, 'white': 'base', 'black': 'test', 'result': '1/2-1/2',
+                               'termination': 'Draw by repetition'}
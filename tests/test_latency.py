@@ -0,0 +1,67 @@
+import asyncio
+
+import duel
+
+
+def game(slot, overhead, think=10.0):
+    moves = len(overhead)
+    return {'slot': slot, 'latency': {
+        'test': {'think': [think] * moves, 'overhead': overhead, 'first_output': [1.0] * moves,
+                 'move_delay': [0.5] * moves, 'harness': [0.1] * moves}}}
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 11))
+    assert duel.percentile(values, 50) == 5
+    assert duel.percentile(values, 90) == 9
+    assert duel.percentile(values, 99) == 10
+    assert duel.percentile([3], 50) == 3
+
+
+def test_summary_per_engine():
+    meter = duel.LatencyMeter()
+    meter.add_game(game(1, [1.0, 2.0]))
+    meter.add_game(game(1, [3.0, 4.0]))
+    summary = meter.summary()
+    assert summary['test']['overhead'] == {'moves': 4, 'p50': 2.0, 'p90': 4.0, 'p99': 4.0, 'max': 4.0}
+    assert summary['test']['think']['p50'] == 10.0
+    assert meter.warnings() == []
+
+
+def test_engine_with_overhead_is_reported():
+    meter = duel.LatencyMeter(warn_ms=20)
+    meter.add_game(game(1, [25.0] * 10))
+    warnings = meter.warnings()
+    assert len(warnings) == 1 and warnings[0].startswith('engine test:')
+
+
+def test_slow_slot_is_reported():
+    meter = duel.LatencyMeter(warn_ms=100)
+    for slot in [1, 2, 3]:
+        meter.add_game(game(slot, [2.0] * 10))
+    meter.add_game(game(4, [10.0] * 10))
+    assert meter.warnings() == ['slot 4: median overhead 10.0ms, all slots 2.0ms']
+
+
+def test_every_move_is_measured(engine_cfg):
+    e1, e2 = engine_cfg('test', ThinkMs=5, Seed=1), engine_cfg('base', Seed=2)
+
+    async def play():
+        pool = duel.EnginePool()
+        try:
+            return await duel.match(e1, e2, None, None, 'normal',
+                                    {'movenumber': None, 'movecount': None, 'score': None},
+                                    {'movecount': None, 'score': None}, repeat=1, pool=pool,
+                                    trace_option={'mode': 'off', 'size': 100})
+        finally:
+            await pool.close()
+            await asyncio.sleep(0.2)
+
+    g = asyncio.run(play())[0]
+    latency = g['latency']
+    assert len(latency['test']['overhead']) == (len(g['moves']) + 1) // 2
+    assert len(latency['base']['overhead']) == len(g['moves']) // 2
+    assert all(len(latency['test'][m]) == len(latency['test']['overhead']) for m in ['think', 'first_output'])
+    # The mock engine thinks 5ms per move.
+    assert duel.percentile(latency['test']['think'], 50) >= 4
+    assert all(v >= 0 for v in latency['test']['overhead'])
@@ -0,0 +1,81 @@
+import json
+import random
+import sqlite3
+import subprocess
+import sys
+
+import yaml
+
+from conftest import ROOT
+
+import match_sim
+from game_optimizer import get_match_stats
+
+
+SETTING = {'test_engine': {'parameter_to_optimize': {
+               'QueenValue': {'value': 900, 'min': 800, 'max': 1000, 'factor': 200},
+               'RookValue': {'value': 500, 'min': 400, 'max': 600, 'factor': 200}}},
+           'simulator': {'draw_rate': 0.3, 'pair_correlation': -0.2, 'game_seconds': 0,
+                         'parameter': {'QueenValue': {'best': 950, 'elo': 200}}}}
+
+
+def test_elo_of_the_parameters():
+    model = match_sim.EloModel(SETTING)
+    assert model.elo({'QueenValue': 950, 'RookValue': 500}) == 0
+    assert model.elo({'QueenValue': 850, 'RookValue': 500}) == -50
+    # RookValue has the default best, the middle of min and max.
+    assert model.elo({'QueenValue': 950, 'RookValue': 600}) == -match_sim.DEFAULT_ELO / 4
+
+
+def test_games_of_a_pair_are_correlated():
+    setting = dict(SETTING, simulator={'draw_rate': 0.0, 'pair_correlation': -1.0})
+    model = match_sim.EloModel(setting)
+    points = model.play({'QueenValue': 950}, {'QueenValue': 850}, 100, random.Random(1))
+    assert all(a + b == 1.0 for a, b in zip(points[0::2], points[1::2]))
+
+
+def run_match(tmp_path, seed, test='QueenValue 950, RookValue 500'):
+    (tmp_path / 'setting.yml').write_text(yaml.safe_dump(SETTING))
+    return subprocess.run(
+        [sys.executable, (ROOT / 'match_sim.py').as_posix(), '--setting-file', 'setting.yml',
+         '--seed', str(seed), '--fcp', 'cmd=x name=test', '--scp', 'cmd=x name=base',
+         '--cutechess-cli-options', '-rounds 40 -concurrency 2 -repeat',
+         '--test-param', test, '--base-param', 'QueenValue 800, RookValue 500'],
+        cwd=tmp_path, stdout=subprocess.PIPE, text=True, timeout=60, check=True).stdout
+
+
+def test_match_output(tmp_path):
+    output = run_match(tmp_path, 3)
+    stats = get_match_stats(output)
+    assert stats['games'] == 40 and sum(stats['wdl']) == 40 and sum(stats['penta']) == 20
+    assert stats['failures'] == 0
+    assert stats['score'] > 0.5
+    assert len(stats['game_list']) == 40
+    assert 'match.total' in stats['metrics']
+
+
+def test_same_seed_same_games(tmp_path):
+    def games(output):
+        return [line for line in output.splitlines() if not line.startswith('metrics:')]
+
+    assert games(run_match(tmp_path, 3)) == games(run_match(tmp_path, 3))
+    assert games(run_match(tmp_path, 3)) != games(run_match(tmp_path, 4))
+
+
+def test_optimizer_with_the_sim_backend(tmp_path):
+    (tmp_path / 'optimizer_setting.yml').write_text(
+        (ROOT / 'optimizer_setting.yml').read_text() + '\n' + yaml.safe_dump({'simulator': SETTING['simulator']}))
+    (tmp_path / 'match_sim.py').symlink_to(ROOT / 'match_sim.py')
+    subprocess.run([sys.executable, (ROOT / 'game_optimizer.py').as_posix(), '--backend', 'sim',
+                    '--iteration', '3', '--results-file', 'results.sqlite'],
+                   cwd=tmp_path, stdout=subprocess.PIPE, timeout=120, check=True)
+
+    conn = sqlite3.connect(tmp_path / 'results.sqlite')
+    assert [i for i, in conn.execute('SELECT iter FROM iterations ORDER BY iter')] == [1, 2, 3]
+    # The matches of a gradient are played again when their goals are the same.
+    assert conn.execute('SELECT DISTINCT games FROM evaluations').fetchall() == [(4,)]
+    assert conn.execute('SELECT COUNT(*) FROM evaluations').fetchone()[0] >= 6
+    assert conn.execute('SELECT COUNT(*) FROM games').fetchone() == conn.execute('SELECT SUM(games) FROM evaluations').fetchone()
+    assert json.loads(conn.execute('SELECT theta FROM iterations WHERE iter = 3').fetchone()[0]).keys() \
+        == yaml.safe_load((ROOT / 'optimizer_setting.yml').read_text())['test_engine']['parameter_to_optimize'].keys()
+    conn.close()
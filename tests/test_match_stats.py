@@ -0,0 +1,40 @@
+import pytest
+
+from game_optimizer import get_match_stats
+
+
+def test_score_and_counts():
+    stats = get_match_stats('0.625\nwdl: 2 1 1\npenta: 0 0 1 1 0\nfailures: 1\n')
+    assert stats['score'] == 0.625
+    assert stats['wdl'] == [2, 1, 1]
+    assert stats['penta'] == [0, 0, 1, 1, 0]
+    assert stats['failures'] == 1
+    assert stats['games'] == 4
+
+
+def test_variance_from_pentanomial():
+    # Pairs of 0.5 and 0.75, mean 0.625, variance 0.125^2 over 2 pairs.
+    stats = get_match_stats('0.625\nwdl: 2 1 1\npenta: 0 0 1 1 0\n')
+    assert stats['var'] == pytest.approx(0.125 ** 2 / 2)
+
+
+def test_variance_from_wdl_without_pairs():
+    # Games of 1, 0.5, 0.5 and 0, variance 0.125 over 4 games.
+    stats = get_match_stats('0.5\nwdl: 1 2 1\n')
+    assert stats['games'] == 4
+    assert stats['var'] == pytest.approx(0.125 / 4)
+
+
+def test_json_lines():
+    output = ('1.000\nwdl: 2 0 0\npenta: 0 0 0 0 1\n'
+              'games: [{"game":1,"result":"1-0"},{"game":2,"result":"0-1"}]\n'
+              'metrics: {"match.total": {"count": 1, "sum": 2.5}}\n')
+    stats = get_match_stats(output)
+    assert [g['game'] for g in stats['game_list']] == [1, 2]
+    assert stats['metrics'] == {'match.total': {'count': 1, 'sum': 2.5}}
+
+
+def test_no_games_has_no_variance():
+    stats = get_match_stats('0.5\n')
+    assert stats['games'] == 0
+    assert 'var' not in stats
@@ -0,0 +1,90 @@
+import csv
+import json
+
+import metrics
+import spsa
+
+
+def test_histogram_buckets():
+    h = metrics.Histogram()
+    for seconds in [0.005, 0.05, 0.05, 5, 1000]:
+        h.observe(seconds)
+    assert h.to_dict() == {'count': 5, 'sum': 1005.105, 'min': 0.005, 'max': 1000,
+                           'buckets': [1, 2, 0, 1, 0, 0, 1]}
+    assert metrics.Histogram().to_dict()['min'] == 0.0
+
+
+def test_merge_of_the_snapshot_of_another_process():
+    child = metrics.Metrics()
+    child.observe('duel.play', 2.0)
+    child.observe('duel.play', 4.0)
+    snapshot = json.loads(metrics.to_json(child.snapshot()))
+
+    parent = metrics.Metrics()
+    with parent.span('optimizer.parse'):
+        pass
+    parent.observe('duel.play', 0.5)
+    parent.merge(snapshot)
+    parent.merge(None)
+    parent.merge({'duel.start': metrics.Histogram().to_dict()})
+
+    assert parent.total('duel.play') == 6.5
+    assert parent.spans['duel.play'].count == 3
+    assert parent.spans['duel.play'].min == 0.5
+    assert parent.spans['optimizer.parse'].count == 1
+    assert parent.total('duel.start') == 0.0
+    assert parent.total('unknown') == 0.0
+
+
+def test_csv_rows_per_iteration(tmp_path):
+    fn = tmp_path / 'metrics.csv'
+    m = metrics.Metrics()
+    m.observe('spsa.matches', 3.0)
+    metrics.write_csv(fn, 1, m, {'games_per_hour': 1200.0})
+    m.observe('spsa.matches', 5.0)
+    metrics.write_csv(fn, 2, m, {})
+
+    rows = list(csv.DictReader(fn.open()))
+    assert [(r['iter'], r['name']) for r in rows] == [('1', 'spsa.matches'), ('1', 'games_per_hour'),
+                                                      ('2', 'spsa.matches')]
+    assert float(rows[2]['mean']) == 4.0
+    assert rows[2]['le_10'] == '2'
+    assert float(rows[1]['sum']) == 1200.0
+
+
+def test_prometheus_histograms_are_cumulative(tmp_path):
+    fn = tmp_path / 'metrics.prom'
+    m = metrics.Metrics()
+    for seconds in [0.005, 0.5, 30]:
+        m.observe('duel.play', seconds)
+    metrics.write_prometheus(fn, m, {'games_per_hour': 100.0})
+
+    lines = fn.read_text().splitlines()
+    assert 'spsa_span_seconds_bucket{span="duel.play",le="0.01"} 1' in lines
+    assert 'spsa_span_seconds_bucket{span="duel.play",le="1"} 2' in lines
+    assert 'spsa_span_seconds_bucket{span="duel.play",le="+Inf"} 3' in lines
+    assert 'spsa_span_seconds_count{span="duel.play"} 3' in lines
+    assert 'spsa_games_per_hour 100.0' in lines
+    assert not (tmp_path / 'metrics.prom.tmp').exists()
+
+
+def test_optimizer_writes_the_spans_of_every_iteration(tmp_path):
+    def goal(i, base_theta, **theta):
+        child = metrics.Metrics()
+        child.observe('duel.play', 1.0)
+        return -0.5 + 0.1 * (i - 0.5), {'games': 4, 'var': 0.01, 'metrics': child.snapshot()}
+
+    theta0 = {'x': {'value': 1.0, 'min': 0, 'max': 2, 'factor': 1}}
+    minimizer = spsa.SPSA_minimization(goal, theta0, 2,
+                                       options={'parallel': False, 'rounds': 4, 'cores': 2,
+                                                'metrics_file': str(tmp_path / 'metrics'),
+                                                'plot_data_file': str(tmp_path / 'plot_data.csv')})
+    minimizer.run()
+
+    rows = list(csv.DictReader((tmp_path / 'metrics.csv').open()))
+    for k in ['1', '2']:
+        names = {r['name']: r for r in rows if r['iter'] == k}
+        assert {'spsa.matches', 'spsa.iteration', 'spsa.math', 'games_per_hour', 'core_utilization'} <= set(names)
+        # Both matches of the iteration are merged.
+        assert names['duel.play']['count'] == '2'
+    assert 'spsa_span_seconds_count{span="duel.play"} 4' in (tmp_path / 'metrics.prom').read_text().splitlines()
@@ -0,0 +1,83 @@
+import argparse
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+import bench_harness
+import chessboard
+import mock_engine
+
+
+def talk(commands, **options):
+    """
+    Return the lines and the exit code of mock_engine.py after commands.
+    """
+    env = {**os.environ, 'MOCK_ENGINE_OPTIONS': ' '.join(f'{k}={v}' for k, v in {'ThinkMs': 0, **options}.items())}
+    proc = subprocess.run([sys.executable, (ROOT / 'mock_engine.py').as_posix()], input='\n'.join(commands) + '\n',
+                          env=env, stdout=subprocess.PIPE, text=True, timeout=30)
+    return proc.stdout.splitlines(), proc.returncode
+
+
+def test_uci_handshake_and_search():
+    lines, code = talk(['uci', 'isready', 'position startpos moves e2e4', 'go depth 3', 'quit'], InfoLines=3)
+    assert code == 0
+    assert lines[0] == 'id name mock_engine'
+    assert 'option name Strength type spin default 50 min 0 max 100' in lines
+    assert lines.index('uciok') < lines.index('readyok')
+    assert len([line for line in lines if line.startswith('info depth')]) == 3
+
+    board = chessboard.Board()
+    board.push_uci('e2e4')
+    move = lines[-1].split()[1]
+    assert lines[-1].startswith('bestmove') and move in [chessboard.move_to_uci(m) for m in board.legal_moves()]
+
+
+def test_xboard_plays_after_the_opponent_move():
+    lines, code = talk(['xboard', 'protover 2', 'new', 'e2e4', 'ping 7', 'quit'])
+    assert code == 0
+    assert lines[0] == 'feature done=0' and 'feature done=1' in lines
+    moves = [line for line in lines if line.startswith('move ')]
+    assert len(moves) == 1 and lines[-1] == 'pong 7'
+
+
+def test_crash_after_moves():
+    lines, code = talk(['uci', 'position startpos', 'go depth 1', 'position startpos moves e2e4 e7e5', 'go depth 1',
+                        'isready'], CrashAfter=2)
+    assert code == 3
+    assert len([line for line in lines if line.startswith('bestmove')]) == 1
+    assert 'readyok' not in lines
+
+
+def test_strength_takes_the_material():
+    fen = 'k7/8/8/3q4/8/8/8/K2R4 w - - 0 1'
+    engine = mock_engine.MockEngine({'Strength': 100, 'Seed': 1})
+    engine.board = chessboard.Board(fen)
+    move, score = engine.choose()
+    assert chessboard.move_to_uci(move) == 'd1d5'
+    # The score is the material after the capture.
+    assert score == 500
+
+
+def test_parameters_lower_the_strength(tmp_path):
+    params = tmp_path / 'params.txt'
+    params.write_text('QueenValue 1050\nSeed 5\n')
+    engine = mock_engine.MockEngine({'Strength': 80, 'ParamBest': 'QueenValue=950', 'ParamRange': 200,
+                                     'ParamFile': params.as_posix()})
+    assert engine.params == {'QueenValue': 1050.0}
+    assert engine.options['Seed'] == 5
+    assert engine.strength() == pytest.approx(0.8 - 0.25)
+    engine.set_option('QueenValue', '950')
+    assert engine.strength() == pytest.approx(0.8)
+
+
+def test_harness_match():
+    args = argparse.Namespace(rounds=2, proto='uci', tc='0/10+0.1', think_ms=1, info_lines=1, startup_ms=0,
+                              duel_options='')
+    games, seconds, latency = bench_harness.run_match(2, args)
+    assert games == 2
+    assert seconds > 0
+    assert set(latency['engines']) == {'test', 'base'}
@@ -0,0 +1,77 @@
+import pytest
+
+import chessboard
+import opening_book
+
+
+PGN = '''[Event "a"]
+
+1. e4 e5 {main line} 2. Nf3 (2. Nc3) Nc6 *
+
+[Event "b"]
+
+1. e4 e5 2. Nf3 Nc6 1-0
+
+[Event "c"]
+[FEN "4k3/8/8/8/8/8/4P3/4K3 w - - 0 1"]
+
+1. e4 Kd7 1/2-1/2
+'''
+
+
+@pytest.fixture
+def pgn_file(tmp_path):
+    fn = tmp_path / 'book.pgn'
+    fn.write_text(PGN)
+    return fn
+
+
+def test_compile_pgn_keeps_unique_positions(pgn_file, tmp_path):
+    index = tmp_path / 'book.bin'
+    assert opening_book.compile_index(pgn_file, index) == 2
+    assert opening_book.is_index(index)
+    assert not opening_book.is_index(pgn_file)
+
+    with opening_book.OpeningIndex(index) as book:
+        assert len(book) == 2
+        assert book[0] == 'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq -'
+        assert book[1] == '8/3k4/8/8/4P3/8/8/4K3 w - -'
+        with pytest.raises(IndexError):
+            book[2]
+
+
+def test_compile_pgn_with_plies(pgn_file, tmp_path):
+    index = tmp_path / 'book.bin'
+    opening_book.compile_index(pgn_file, index, plies=1)
+    with opening_book.OpeningIndex(index) as book:
+        assert book[0] == 'rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq -'
+
+
+def test_compile_epd_round_trip(tmp_path):
+    epds = [' '.join(chessboard.START_FEN.split()[0:4]),
+            '8/3k4/8/8/4P3/8/8/4K3 w - -',
+            '4k3/8/8/8/8/8/4P3/4K3 w - -']
+    book_file = tmp_path / 'book.epd'
+    book_file.write_text(''.join(f'{epd} bm e4; id "{i}";\n' for i, epd in enumerate(epds))
+                         + f'{epds[0]}\n')
+    index = tmp_path / 'book.bin'
+    assert opening_book.compile_index(book_file, index) == 3
+
+    with opening_book.OpeningIndex(index) as book:
+        assert [book[i] for i in range(len(book))] == epds
+        sample = book.sample(3, seed=7)
+        assert sorted(sample) == sorted(epds)
+        assert book.sample(3, seed=7) == sample
+        assert len(book.sample(5, seed=7)) == 5
+
+
+def test_not_an_index(pgn_file):
+    with pytest.raises(ValueError):
+        opening_book.OpeningIndex(pgn_file)
+
+
+def test_stale_index(pgn_file, tmp_path):
+    index = tmp_path / 'book.bin'
+    assert opening_book.is_stale(pgn_file, index)
+    opening_book.compile_index(pgn_file, index)
+    assert not opening_book.is_stale(pgn_file, index)
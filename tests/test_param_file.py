@@ -0,0 +1,53 @@
+import pytest
+
+import chess_match
+import game_optimizer
+import mock_engine
+
+
+THETA = {'QueenValue': {'value': 950}, 'RookValue': {'value': 520}}
+
+
+def test_write_param_file(tmp_path):
+    fn = game_optimizer.write_param_file(THETA, tmp_path / 'param_test.txt')
+    assert fn == (tmp_path / 'param_test.txt').resolve().as_posix()
+    assert (tmp_path / 'param_test.txt').read_text() == 'QueenValue 950\nRookValue 520\n'
+
+
+def test_engine_options_from_the_file(tmp_path):
+    fn = game_optimizer.write_param_file(THETA, tmp_path / 'param_test.txt')
+    options = chess_match.engine_param_options(None, fn, None)
+    assert options.split() == ['option.QueenValue=950', 'option.RookValue=520']
+    assert chess_match.engine_param_options('QueenValue 950 800 1000 1', None, None).split() == \
+        ['option.QueenValue=950']
+
+
+def test_engine_reads_the_file_itself(tmp_path):
+    fn = game_optimizer.write_param_file(THETA, tmp_path / 'param_test.txt')
+    assert chess_match.engine_param_options(None, fn, 'ParamFile').strip() == f'option.ParamFile={fn}'
+
+    engine = mock_engine.MockEngine({'ParamFile': fn})
+    assert engine.params == {'QueenValue': 950.0, 'RookValue': 520.0}
+
+
+def test_match_arguments_pass_the_files():
+    job = {'seed': 7, 'fcp': 'cmd=a name=test', 'scp': 'cmd=b name=base', 'tour_manager': 'duel.py',
+           'tour_manager_options': '-repeat 2', 'rounds': 4, 'concurrency': 1,
+           'engine_options': 'tc=0/5+0.05', 'pgn_option': '', 'affinity': None,
+           'test_param_option': 'ParamFile', 'base_param_option': None}
+    args = game_optimizer.match_arguments(job, '/tmp/t.txt', '/tmp/b.txt')
+    assert '--test-param-file /tmp/t.txt --base-param-file /tmp/b.txt' in args
+    assert '--test-param-option ParamFile' in args
+    assert '--base-param-option' not in args
+
+
+def test_param_files_deleted_when_the_match_fails(tmp_path, monkeypatch):
+    def popen(*args, **kwargs):
+        raise OSError('cannot run the match')
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(game_optimizer, 'Popen', popen)
+    optimizer = game_optimizer.game_optimizer()
+    with pytest.raises(OSError):
+        optimizer.launch_engine(THETA, THETA)
+    assert list(tmp_path.glob('param_*.txt')) == []
@@ -0,0 +1,79 @@
+import gzip
+
+import pytest
+
+import pgn_sink
+
+
+def game(n):
+    return f'[Event "game {n}"]\n\n1. e4 e5 1-0\n\n'
+
+
+def test_batches_in_the_index(tmp_path):
+    with pgn_sink.PgnSink(tmp_path / 'games.pgn') as sink:
+        sink.put(game(1) + game(2), 1)
+        sink.put(game(3), 2)
+
+    assert (tmp_path / 'games.pgn').read_text() == game(1) + game(2) + game(3)
+    batches = pgn_sink.read_index(tmp_path / 'games.pgn.idx')
+    assert [(b['iteration'], b['games']) for b in batches] == [('1', 2), ('2', 1)]
+    assert pgn_sink.read_batch(tmp_path / 'games.pgn.idx', batches[1]) == game(3)
+
+
+def test_gzip_batches_are_members(tmp_path):
+    with pgn_sink.PgnSink(tmp_path / 'games.pgn', compression='gzip') as sink:
+        sink.put(game(1), 1)
+        sink.put(game(2), 2)
+
+    assert gzip.decompress((tmp_path / 'games.pgn.gz').read_bytes()).decode() == game(1) + game(2)
+    index = tmp_path / 'games.pgn.gz.idx'
+    assert [pgn_sink.read_batch(index, b) for b in pgn_sink.read_index(index)] == [game(1), game(2)]
+
+
+def test_rotation_every_iterations(tmp_path):
+    with pgn_sink.PgnSink(tmp_path / 'games.pgn', iterations_per_file=2) as sink:
+        for it in range(1, 6):
+            sink.put(game(it), it)
+    files = sorted(p.name for p in tmp_path.glob('games_*.pgn'))
+    assert files == ['games_0001.pgn', 'games_0002.pgn', 'games_0003.pgn']
+    batches = pgn_sink.read_index(tmp_path / 'games.pgn.idx')
+    assert [(b['file'], b['iteration']) for b in batches] == [
+        ('games_0001.pgn', '1'), ('games_0002.pgn', '2'), ('games_0002.pgn', '3'),
+        ('games_0003.pgn', '4'), ('games_0003.pgn', '5')]
+
+
+def test_rotation_by_size_continues_the_numbering(tmp_path):
+    # Every file is full after one batch, a new run starts after the files
+    # of the earlier run.
+    for _ in range(2):
+        with pgn_sink.PgnSink(tmp_path / 'games.pgn', max_mb=1e-6) as sink:
+            sink.put(game(1), 1)
+    files = sorted(p.name for p in tmp_path.glob('games_*.pgn'))
+    assert files == ['games_0001.pgn', 'games_0002.pgn']
+
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(ValueError):
+        pgn_sink.PgnSink(tmp_path / 'games.pgn', compression='bz2')
+
+
+def test_optimizer_collects_its_accepted_matches(tmp_path, monkeypatch):
+    import game_optimizer
+
+    monkeypatch.chdir(tmp_path)
+    optimizer = game_optimizer.game_optimizer()
+    optimizer.set_pgn_output({'file': 'output_game.pgn'})
+    optimizer.set_match_option(iteration=1)
+    stray = tmp_path / game_optimizer.match_pgn_file(optimizer.pid + 1, 0)
+    stray.write_text(game(9))
+    for num in range(2):
+        (tmp_path / game_optimizer.match_pgn_file(optimizer.pid, num)).write_text(game(num))
+    optimizer.set_match_option(accepted=True)
+
+    (tmp_path / game_optimizer.match_pgn_file(optimizer.pid, 0)).write_text(game(5))
+    optimizer.set_match_option(accepted=False)
+    optimizer.close()
+
+    assert (tmp_path / 'output_game.pgn').read_text() == game(0) + game(1)
+    assert stray.exists()
+    assert sorted(p.name for p in tmp_path.glob('match_games_*')) == [stray.name]
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+import replay
+import results_store
+
+
+PARAM = {'QueenValue': {'value': 900, 'min': 800, 'max': 1000, 'factor': 1},
+         'RookValue': {'value': 500, 'min': 400, 'max': 600, 'factor': 1}}
+
+
+def true_elo(values):
+    # The best QueenValue is 950 (x = 0.75), RookValue has no Elo.
+    x = (values['QueenValue'] - 800) / 200
+    return 120 * x - 80 * x * x
+
+
+def records(count, games, low=800, high=1000, seed=1):
+    rng = random.Random(seed)
+    res = []
+    for _ in range(count):
+        base = {'QueenValue': rng.uniform(low, high), 'RookValue': rng.uniform(400, 600)}
+        test = {'QueenValue': rng.uniform(low, high), 'RookValue': rng.uniform(400, 600)}
+        score = replay.score_from_elo(true_elo(test) - true_elo(base))
+        res.append({'test': test, 'base': base, 'score': score, 'games': games})
+    return res
+
+
+def test_elo_and_score():
+    assert replay.score_from_elo(0) == 0.5
+    assert replay.elo_from_score(replay.score_from_elo(100), 1000) == pytest.approx(100)
+    # A score of 1 is limited to half a game from it.
+    assert replay.elo_from_score(1.0, 4) == replay.elo_from_score(0.875, 4)
+
+
+def test_solve():
+    assert replay.solve([[0.0, 2.0], [3.0, 1.0]], [4.0, 5.0]) == pytest.approx([1.0, 2.0])
+
+
+def test_fit_recovers_the_model():
+    model = replay.ResponseModel.fit(PARAM, records(200, 100000))
+    b, c = model.coef['QueenValue']
+    assert b == pytest.approx(120, abs=2) and c == pytest.approx(-80, abs=2)
+    assert all(abs(v) < 1 for v in model.coef['RookValue'])
+    assert model.best()['QueenValue'] == pytest.approx(950, abs=3)
+    assert model.points == 200
+    assert model.residual < 1
+
+
+def test_fit_of_few_games_is_shrunk():
+    model = replay.ResponseModel.fit(PARAM, records(20, 4))
+    b, c = model.coef['QueenValue']
+    assert abs(b) < 30 and abs(c) < 30
+
+
+def test_best_within_the_sampled_range():
+    # The matches have QueenValue from 800 to 900, the best 950 is outside.
+    model = replay.ResponseModel.fit(PARAM, records(200, 100000, high=900))
+    low, high = model.sampled['QueenValue']
+    assert high <= 0.5
+    assert model.best()['QueenValue'] == pytest.approx(800 + 200 * high)
+
+
+def test_simulated_matches_of_a_gradient_share_the_random_numbers():
+    model = replay.ResponseModel(PARAM, {'QueenValue': (120, -80), 'RookValue': (0, 0)})
+    model.theta0 = replay.get_theta0(PARAM)
+    model.set_match_option(rounds=100, seed=5)
+    theta = replay.get_theta0(PARAM)
+    base = {n: {'value': v['value']} for n, v in PARAM.items()}
+    first = model.goal_function(0, base, **theta)
+    assert model.goal_function(1, base, **theta) == first
+    assert sum(first[1]['wdl']) == first[1]['games'] == 100
+    assert first[1]['score'] == pytest.approx(0.5, abs=0.15)
+
+
+def test_replay_of_a_results_file(tmp_path):
+    fn = (tmp_path / 'results.sqlite').as_posix()
+    config = {'setting': {'test_engine': {'parameter_to_optimize': PARAM}}}
+    with results_store.ResultsStore(fn, config) as store:
+        for k, r in enumerate(records(40, 1000), 1):
+            delta = {n: r['test'][n] - r['base'][n] for n in PARAM}
+            store.add_iteration({'iter': k, 'rounds': 500},
+                                [{'attempt': 1, 'num': 0, 'score': r['score'], 'games': r['games'],
+                                  'wdl': [400, 200, 400], 'theta': r['test'], 'perturbation': delta}])
+
+    param, recs, draw_rate, games_per_round = replay.load_run(fn)
+    assert param == PARAM and len(recs) == 40
+    assert recs[0]['base']['QueenValue'] == pytest.approx(records(1, 1000)[0]['base']['QueenValue'])
+    assert draw_rate == pytest.approx(0.2) and games_per_round == 2
+
+    model = replay.ResponseModel.fit(param, recs)
+    elos = replay.run_variant(model, {'rounds': 8}, 20, 1, (tmp_path / 'plot_data.csv').as_posix())
+    assert len(elos) == 20
+    assert elos == replay.run_variant(model, {'rounds': 8}, 20, 1, (tmp_path / 'plot_data.csv').as_posix())
+
+    assert replay.parse_variant('name=fast a=2.0 rounds=16') == ('fast', {'a': 2.0, 'rounds': 16})
+    with pytest.raises(ValueError):
+        replay.parse_variant('name=fast b=1')
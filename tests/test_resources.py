@@ -0,0 +1,33 @@
+import resources
+
+
+def test_budget_leaves_the_reserve():
+    budget = resources.get_budget({'cores': 8, 'memory_mb': 16000, 'reserve_cores': 2,
+                                   'reserve_memory_mb': 2000})
+    assert budget == {'cores': 8, 'memory_mb': 16000, 'game_cores': 6, 'game_memory_mb': 14000}
+    assert resources.get_budget({'cores': 1, 'memory_mb': 512})['game_cores'] == 1
+    assert resources.get_budget({'cores': 1, 'memory_mb': 512})['game_memory_mb'] == 0
+
+
+def test_game_cost():
+    cost = resources.get_game_cost({'Threads': 2, 'Hash': 128}, {'Threads': 1, 'Hash': 64})
+    assert cost == {'cores': 2, 'memory_mb': 192 + 2 * resources.ENGINE_OVERHEAD_MB}
+    assert resources.get_game_cost({'Threads': 2}, {'Threads': 3}, ponder=True)['cores'] == 5
+    assert resources.get_game_cost({}, {}) == {'cores': 1, 'memory_mb': 32 + 2 * resources.ENGINE_OVERHEAD_MB}
+
+
+def test_admit_by_cores():
+    budget = {'game_cores': 7, 'game_memory_mb': None}
+    assert resources.admit(budget, {'cores': 1, 'memory_mb': 100}, 8) == (3, 2)
+    assert resources.admit(budget, {'cores': 2, 'memory_mb': 100}, 8) == (1, 2)
+    assert resources.admit(budget, {'cores': 1, 'memory_mb': 100}, 2) == (2, 2)
+
+
+def test_admit_by_memory():
+    budget = {'game_cores': 16, 'game_memory_mb': 1000}
+    assert resources.admit(budget, {'cores': 1, 'memory_mb': 300}, 8) == (1, 2)
+
+
+def test_admit_one_match_when_one_game_fits():
+    budget = {'game_cores': 1, 'game_memory_mb': None}
+    assert resources.admit(budget, {'cores': 4, 'memory_mb': 100}, 8) == (1, 1)
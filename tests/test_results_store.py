@@ -0,0 +1,69 @@
+import json
+import sqlite3
+
+import results_store
+import spsa
+
+
+def evaluation(num, games):
+    return {'attempt': 1, 'num': num, 'seed': 7, 'goal': -0.5, 'score': 0.5, 'wdl': [1, 2, 1],
+            'penta': [0, 1, 0, 1, 0], 'games': 4, 'theta': {'x': 1.5}, 'perturbation': {'x': 0.5},
+            'game_list': games}
+
+
+def test_iterations_evaluations_and_games(tmp_path):
+    fn = (tmp_path / 'results.sqlite').as_posix()
+    games = [{'game': 1, 'white': 'test', 'black': 'base', 'result': '1-0', 'termination': 'mate',
+              'fen': 'startpos', 'plies': 41},
+             {'game': 2, 'white': 'base', 'black': 'test', 'result': '1-0', 'termination': 'time forfeit'}]
+    with results_store.ResultsStore(fn, {'rounds': 4}) as store:
+        store.add_iteration({'iter': 1, 'mean_all_goal': -0.5, 'theta': {'x': 1.0}},
+                            [evaluation(0, games), evaluation(1, [])])
+        # An iteration written again replaces the row.
+        store.add_iteration({'iter': 2, 'mean_all_goal': -0.4}, [])
+        store.add_iteration({'iter': 2, 'mean_all_goal': -0.6}, [])
+        run_id = store.run_id
+
+    conn = sqlite3.connect(fn)
+    assert conn.execute('SELECT iter, mean_all_goal FROM iterations ORDER BY iter').fetchall() == [(1, -0.5), (2, -0.6)]
+    assert json.loads(conn.execute('SELECT theta FROM iterations WHERE iter = 1').fetchone()[0]) == {'x': 1.0}
+    row = conn.execute('SELECT run_id, num, wins, draws, losses, penta, perturbation FROM evaluations '
+                       'WHERE num = 0').fetchone()
+    assert row[:5] == (run_id, 0, 1, 2, 1)
+    assert json.loads(row[5]) == [0, 1, 0, 1, 0] and json.loads(row[6]) == {'x': 0.5}
+    assert conn.execute("SELECT DISTINCT iter FROM games WHERE termination LIKE '%time%'").fetchall() == [(1,)]
+    assert conn.execute('SELECT COUNT(*) FROM games g JOIN evaluations e ON g.evaluation_id = e.id '
+                        'WHERE e.num = 0').fetchone() == (2,)
+    conn.close()
+
+
+def test_runs_with_the_same_config(tmp_path):
+    fn = (tmp_path / 'results.sqlite').as_posix()
+    for config in [{'rounds': 4, 'tc': '5+0.05'}, {'tc': '5+0.05', 'rounds': 4}, {'rounds': 8}]:
+        results_store.ResultsStore(fn, config).close()
+
+    conn = sqlite3.connect(fn)
+    hashes = [h for h, in conn.execute('SELECT config_hash FROM runs ORDER BY id')]
+    assert hashes[0] == hashes[1] != hashes[2]
+    conn.close()
+
+
+def test_optimizer_writes_every_match(tmp_path):
+    fn = (tmp_path / 'results.sqlite').as_posix()
+
+    def goal(i, base_theta, **theta):
+        return -0.5 + 0.1 * (i - 0.5), {'games': 4, 'var': 0.01, 'wdl': [1, 2, 1],
+                                         'game_list': [{'game': 1, 'result': '1-0'}]}
+
+    theta0 = {'x': {'value': 1.0, 'min': 0, 'max': 2, 'factor': 1}}
+    minimizer = spsa.SPSA_minimization(goal, theta0, 3,
+                                       options={'parallel': False, 'rounds': 4, 'results_file': fn,
+                                                'results_config': {'rounds': 4},
+                                                'plot_data_file': str(tmp_path / 'plot_data.csv')})
+    minimizer.run()
+
+    conn = sqlite3.connect(fn)
+    assert [i for i, in conn.execute('SELECT iter FROM iterations ORDER BY iter')] == [1, 2, 3]
+    assert conn.execute('SELECT iter, COUNT(*) FROM evaluations GROUP BY iter').fetchall() == [(1, 2), (2, 2), (3, 2)]
+    assert conn.execute('SELECT COUNT(*) FROM games').fetchone() == (6,)
+    conn.close()
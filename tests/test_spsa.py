@@ -0,0 +1,73 @@
+import pytest
+
+import spsa
+
+
+@pytest.fixture
+def minimizer(tmp_path):
+    def make(rounds=8, target_snr=2.0, **options):
+        theta0 = {'x': {'value': 1.0, 'min': 0, 'max': 2, 'factor': 1}}
+        return spsa.SPSA_minimization(lambda *args, **kwargs: 0.0, theta0, 10,
+                                      options={'rounds': rounds, 'target_snr': target_snr,
+                                               'plot_data_file': str(tmp_path / 'plot_data.csv'),
+                                               **options})
+    return make
+
+
+def stats(var, games=8):
+    return {'var': var, 'games': games}
+
+
+def test_rounds_held_without_signal(minimizer):
+    m = minimizer()
+    m.update_rounds(-0.5, -0.5, stats(0.01), stats(0.01))
+    assert m.rounds == 8
+    assert m.snr == 0.0
+
+
+def test_rounds_at_most_doubled(minimizer):
+    # The signal is small, many more games are needed.
+    m = minimizer()
+    m.update_rounds(0.0, 0.145, stats(0.01), stats(0.01))
+    assert m.rounds == 16
+    m.update_rounds(0.0, 0.145, stats(0.01), stats(0.01))
+    assert m.rounds == 32
+
+
+def test_rounds_at_most_halved(minimizer):
+    m = minimizer(rounds=16)
+    m.update_rounds(0.0, 1.0, stats(0.01), stats(0.01))
+    assert m.rounds == 8
+
+
+def test_rounds_within_limits(minimizer):
+    m = minimizer(rounds=48, max_rounds=64)
+    m.update_rounds(0.0, 0.145, stats(0.01), stats(0.01))
+    assert m.rounds == 64
+
+    m = minimizer(rounds=6, min_rounds=4)
+    m.update_rounds(0.0, 1.0, stats(0.01), stats(0.01))
+    assert m.rounds == 4
+
+
+def test_rounds_without_variance(minimizer):
+    m = minimizer()
+    m.update_rounds(0.0, 1.0, {'games': 8}, {'games': 8})
+    assert m.rounds == 8
+    assert m.unit_var_avg is None
+
+
+def test_fixed_rounds_without_target(minimizer):
+    m = minimizer(target_snr=None)
+    m.update_rounds(0.0, 1.0, stats(0.01), stats(0.01))
+    assert m.rounds == 8
+    assert m.snr > 0
+
+
+def test_snr_from_the_averages(minimizer):
+    m = minimizer(target_snr=None)
+    m.update_rounds(0.0, 1.0, stats(0.01), stats(0.01))
+    # A noisy variance of one gradient does not change the snr alone.
+    m.update_rounds(0.0, 1.0, stats(0.5), stats(0.5))
+    assert m.var_sum_avg == pytest.approx(0.9 * 0.02 + 0.1 * 1.0)
+    assert m.snr == pytest.approx(((1.0 - m.var_sum_avg) / m.var_sum_avg) ** 0.5)
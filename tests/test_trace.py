@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+import duel
+
+
+def test_trace_keeps_the_last_lines():
+    trace = duel.Trace(size=3)
+    for i in range(5):
+        trace.add('test', '>', f'line {i}')
+    assert [line for _, _, _, line in trace.lines] == ['line 2', 'line 3', 'line 4']
+
+
+def test_trace_written_in_one_block(tmp_path):
+    trace = duel.Trace(size=10)
+    trace.add('test', '>', 'uci')
+    trace.add('test', '<', 'uciok')
+    trace.write(tmp_path / 'trace.txt', 'game 1')
+    lines = (tmp_path / 'trace.txt').read_text().splitlines()
+    assert lines[0].endswith(': game 1')
+    assert lines[1].endswith('test > uci') and lines[2].endswith('test < uciok')
+
+
+def play(e1, e2, mode):
+    async def run():
+        pool = duel.EnginePool()
+        try:
+            return await duel.match(e1, e2, None, None, 'normal',
+                                    {'movenumber': None, 'movecount': None, 'score': None},
+                                    {'movecount': None, 'score': None}, pool=pool,
+                                    trace_option={'mode': mode, 'size': 50}, game_timeout=60)
+        finally:
+            await pool.close()
+            # The killed engines are reaped before the loop is closed.
+            await asyncio.sleep(0.2)
+    return asyncio.run(run())
+
+
+def test_no_trace_of_a_regular_game(engine_cfg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    play(engine_cfg('test'), engine_cfg('base'), 'errors')
+    assert not (tmp_path / duel.TRACE_FILE).exists()
+
+
+def test_trace_of_a_crashed_engine(engine_cfg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(duel.RETRY_ERRORS):
+        play(engine_cfg('test', CrashAfter=3), engine_cfg('base'), 'errors')
+    text = (tmp_path / duel.TRACE_FILE).read_text()
+    assert 'test > go depth 1' in text
+    assert len(text.splitlines()) <= 51
+
+
+def test_trace_of_every_game(engine_cfg, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    play(engine_cfg('test'), engine_cfg('base'), 'all')
+    text = (tmp_path / duel.TRACE_FILE).read_text()
+    assert text.count('--- pid') == 2
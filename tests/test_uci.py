@@ -0,0 +1,64 @@
+import asyncio
+
+import chessboard
+import duel
+
+
+def uci(engine_cfg, **cfg):
+    e = duel.UciEngine({**engine_cfg('test'), **cfg})
+    e.sent = []
+    e.send = e.sent.append
+    return e
+
+
+def test_parse_info(engine_cfg):
+    e = uci(engine_cfg)
+    assert e.parse_info('info depth 10 score cp 25 time 120 nodes 250000 pv e2e4 e7e5') == (10, 25, 120)
+    assert e.parse_info('info depth 3 score mate 2 pv d1h5') == (3, duel.MATE_SCORE - 2, None)
+    assert e.parse_info('info depth 3 score mate -1') == (3, -duel.MATE_SCORE + 1, None)
+    assert e.parse_info('info string hello score') is None
+    assert e.parse_info('info nodes 100') is None
+    assert e.parse_move('bestmove e2e4 ponder e7e5') == 'e2e4'
+    assert e.parse_move('info depth 1') is None
+
+
+def test_position_and_limits(engine_cfg):
+    e = uci(engine_cfg)
+    e.go(chessboard.START_FEN, ['e2e4', 'e7e5'], None, None, True, 4)
+    e.go('8/8/8/8/8/8/4P3/4K2k w - - 0 1', [], None, None, True, 0, nodes=500)
+    assert e.sent == ['position startpos moves e2e4 e7e5', 'go depth 4',
+                      'position fen 8/8/8/8/8/8/4P3/4K2k w - - 0 1', 'go nodes 500']
+
+
+def test_deterministic_game_uses_one_thread(engine_cfg):
+    e = uci(engine_cfg, deterministic=True)
+    e.engine_options = {'Threads', 'Hash', 'Clear Hash'}
+    e.new_game({'Threads': 4, 'Hash': 64}, 'normal', None, None)
+    assert e.sent == ['setoption name Threads value 1', 'setoption name Hash value 64',
+                      'ucinewgame', 'setoption name Clear Hash']
+
+
+def test_uci_engine_plays_an_xboard_engine(engine_cfg):
+    e1, e2 = engine_cfg('test', proto='uci'), engine_cfg('base', proto='xboard')
+
+    async def play():
+        pool = duel.EnginePool()
+        try:
+            games = await duel.match(e1, e2, None, None, 'normal',
+                                     {'movenumber': None, 'movecount': None, 'score': None},
+                                     {'movecount': None, 'score': None}, pool=pool,
+                                     trace_option={'mode': 'off', 'size': 100})
+            engines = [e for idle in pool.idle.values() for e in idle]
+            return games, engines
+        finally:
+            await pool.close()
+
+    games, engines = asyncio.run(play())
+    assert len(games) == 2
+    for g in games:
+        board = chessboard.Board()
+        for move in g['moves']:
+            board.push_san(move)
+        assert g['gres'] in ('1-0', '0-1', '1/2-1/2')
+    [u] = [e for e in engines if isinstance(e, duel.UciEngine)]
+    assert {'Hash', 'Threads'} <= u.engine_options
@@ -5,7 +5,6 @@ Author: Stéphane Nicolet
 """
 
 import math
-import copy
 
 
 ### Helper functions
@@ -34,15 +33,18 @@ def linear_combinaison(alpha = 1.0, m1 = {},
                        beta = None, m2 = {}):
     """
     Return the linear combinaison m = alpha * m1 + beta * m2.
+
+    The entries of a point are dicts of numbers like value, min and max,
+    they are copied one level deep.
     """
     if m2 == {}:
-        m2 = copy.deepcopy(m1)
+        m2 = m1
         beta = 0.0
 
-    m = copy.deepcopy(m1)
+    m = {}
     for (name, value) in m1.items():
-        val = alpha * value['value'] + beta * m2[name]['value']
-        m[name]['value'] = val
+        m[name] = dict(value)
+        m[name]['value'] = alpha * value['value'] + beta * m2[name]['value']
 
     return m
 
@@ -162,8 +164,9 @@ def apply_limits(m, is_factor=True):
 def true_param(m):
     # Todo: Determine if original param value is a float or integer.
     # Now it is assumed that it is integer.
-    ret = copy.deepcopy(m)
+    ret = {}
     for k, v in m.items():
+        ret[k] = dict(v)
         ret[k]['value'] = int(m[k]['value'] * m[k]['factor'])
 
     return ret